@@ -3,11 +3,14 @@ import os
 import httpx # Changed from requests to align with other async usage
 import logging
 import json
+import hashlib
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv # For loading root .env
 from pathlib import Path
+from shared_services import perplexity_client
+from shared_services.singleflight import SingleFlight
 
 # --- Load .env from the project root ---
 # Assuming this file is .../medical-assistant/advisories_app/main_router.py
@@ -19,7 +22,7 @@ DOTENV_PATH = PROJECT_ROOT_FOR_ENV / '.env'
 # Get config values directly
 PERPLEXITY_API_KEY_ADVISORIES = os.getenv('PERPLEXITY_API_KEY')
 MODEL_FOR_ADVISORIES_ROUTER = os.getenv('ADVISORY_APP_MODEL_NAME', "sonar-pro") # Default
-API_BASE_URL_ADVISORIES = os.getenv('PERPLEXITY_API_BASE_URL', "https://api.perplexity.ai/chat/completions")
+API_BASE_URL_ADVISORIES = perplexity_client.PERPLEXITY_API_BASE_URL
 
 if not PERPLEXITY_API_KEY_ADVISORIES:
     print("ADVISORIES_ROUTER: CRITICAL - PERPLEXITY_API_KEY could not be loaded.")
@@ -36,6 +39,13 @@ class AdvisoryResponse(BaseModel):
 class ErrorResponse(BaseModel):
     error: str
 
+advisories_flights = SingleFlight("advisories")
+
+def generate_advisory_key(state: str, country: str) -> str:
+    """Canonical key for a location, hashed the same way survey report IDs are."""
+    canonical_string = json.dumps({"state": state, "country": country, "model": MODEL_FOR_ADVISORIES_ROUTER}, sort_keys=True)
+    return hashlib.md5(canonical_string.lower().encode()).hexdigest()[:16]
+
 # --- APIRouter Instance ---
 router = APIRouter(
     prefix="/advisories-app",
@@ -88,18 +98,15 @@ async def get_advisories_endpoint(payload: AdvisoryRequest): # Renamed from orig
         "max_tokens": 1000,
         "temperature": 0.2
     }
-    headers = {
-        "Authorization": f"Bearer {PERPLEXITY_API_KEY_ADVISORIES}",
-        "Content-Type": "application/json",
-        "accept": "application/json"
-    }
-
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(API_BASE_URL_ADVISORIES, json=perplexity_payload, headers=headers)
-            response.raise_for_status() 
-        
-        api_response_data = response.json()
+        # Concurrent requests for the same location share one upstream call
+        api_response_data = await advisories_flights.do(
+            generate_advisory_key(state, country),
+            lambda: perplexity_client.create_chat_completion(
+                perplexity_payload, PERPLEXITY_API_KEY_ADVISORIES, cache_mode="advisories", app="advisories",
+                hedge=True # Short call; hedged after the model's p95 latency
+            )
+        )
         if api_response_data.get("choices") and len(api_response_data["choices"]) > 0:
             advisory_text = api_response_data["choices"][0]["message"]["content"].strip()
             return AdvisoryResponse(advisories=advisory_text)
@@ -1,46 +1,91 @@
-from typing import Dict, Any, List, Optional, Annotated, get_args
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
+from typing import Dict, Any, List, Literal, Optional, Annotated, Tuple, get_args
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, Header, Query, Request
+from fastapi.responses import Response, StreamingResponse
+import asyncio
+import base64
+import hashlib
+import json
+import secrets
 import uuid
 from datetime import datetime, timezone
 from .models import ( # Use . for current package
     ChatMessageOutput, FileInformation, AISchemeInfo, AIDoctorRecommendation,
-    ReactAnalysisRequest, ReactSymptomAnalysisOutput, ReactSymptomInput, ReactConditionOutput
+    ReactAnalysisRequest, ReactBatchAnalysisRequest, ReactSymptomAnalysisOutput, ReactSymptomInput, ReactConditionOutput,
+    HistorySearchHit, HistorySearchResponse
 )
-from ..utils.ai_handler import AIInteractionHandler
-from ..utils.medical_memory import MedicalMemory, ConversationMode
+from ..utils.ai_handler import AIInteractionHandler, FILE_TEXT_MAX_CHARS
+from ..utils.conversation_summarizer import ConversationSummarizer
+from ..utils.history_index import highlight
+from ..utils.memory_transfer import ImportFormatError, export_ndjson, import_ndjson
+from ..utils.symptom_cache import SymptomResultCache
+from ..utils.medical_memory import (
+    MedicalMemory, ConversationMode, SINGLE_USER_ID, HistoryPosition, history_position, is_valid_user_id, parse_timestamp
+)
+from shared_services import file_extraction
+from shared_services.blocking_io import run_io
 
-# from ..config import settings # Not directly needed here if AIHandler uses it
+from ..config import settings
 
 router = APIRouter()
 
 ai_handler = AIInteractionHandler()
-memory_handler = MedicalMemory() # Single persistent user, but manages modes internally
+memory_handler = MedicalMemory() # Partitioned per user (see get_user_id), with modes managed internally
+summarizer = ConversationSummarizer(memory_handler, ai_handler) # Rolling summaries of older turns, updated in the background
+symptom_cache = SymptomResultCache() # /symptoms/analyze results by normalized symptom set
+# MedicalMemory calls can touch the disk (first load of a user, cross-worker refresh, json backend),
+# so routes always make them through run_io rather than on the event loop.
 
-# --- Endpoint for React Symptom Analyzer ---
-@router.post("/symptoms/analyze", response_model=ReactSymptomAnalysisOutput, tags=["Symptom Analyzer (React)"])
-async def analyze_symptoms_for_react_app(request: ReactAnalysisRequest):
-    if not request.symptoms:
-        raise HTTPException(status_code=400, detail="At least one symptom is required for analysis.")
+def get_user_id(x_user_id: Annotated[Optional[str], Header()] = None) -> str:
+    """Identity for history and medical-summary storage, from the X-User-ID header (a user or session id
+    set by the client or an auth proxy). Requests without it share the original single-user history."""
+    if not x_user_id:
+        return SINGLE_USER_ID
+    if not is_valid_user_id(x_user_id):
+        raise HTTPException(status_code=400, detail="Invalid X-User-ID header. Use 1-64 letters, digits, '_', '-' or '.'.")
+    return x_user_id
+
+UserId = Annotated[str, Depends(get_user_id)]
 
+# --- Endpoint for React Symptom Analyzer ---
+def _describe_symptoms(request: ReactAnalysisRequest) -> str:
     symptoms_descriptions_list = []
     severity_map_display = {1: "Mild", 2: "Moderate", 3: "Severe"}
     for s_in in request.symptoms:
         s_desc = f"- {s_in.description} (Duration: {s_in.duration}, Severity: {severity_map_display.get(s_in.severity, 'Unknown')})"
         symptoms_descriptions_list.append(s_desc)
-    symptoms_full_description_str = "\n".join(symptoms_descriptions_list) or "User submitted an empty symptom list."
+    return "\n".join(symptoms_descriptions_list) or "User submitted an empty symptom list."
+
+async def _analyze_symptom_request(
+    request: ReactAnalysisRequest, user_id: str
+) -> Tuple[ReactSymptomAnalysisOutput, Dict[str, Any], Optional[Dict[str, Any]], str]:
+    """Runs one symptom analysis. Returns the response, the history entry to record, the medical
+    summary update (if any) and the result cache status ("hit", "miss" or "bypass"); recording them
+    is left to the caller. Raises HTTPException on errors."""
+    if not request.symptoms:
+        raise HTTPException(status_code=400, detail="At least one symptom is required for analysis.")
+    symptoms_full_description_str = _describe_symptoms(request)
 
-    # For this specific integration, we might not have user_region from React app unless it's added.
     # History context can be generic or tied to a global user ID if you implement that later.
-    history_context_for_symptoms = memory_handler.get_context_for_ai("symptoms") # Use symptoms-specific history
+    history_context_for_symptoms = await run_io(memory_handler.get_context_for_ai, "symptoms", user_id=user_id, query=symptoms_full_description_str) # Use symptoms-specific history
 
     # Call the AI handler's method meant for symptom analysis
     # This method is expected to return a dictionary that can be mapped to ChatMessageOutput,
     # so we need to adapt it to ReactSymptomAnalysisOutput.
-    ai_handler_result_dict = await ai_handler.analyze_personal_symptoms(
+    analyze = lambda: ai_handler.analyze_personal_symptoms(
         symptoms_description=symptoms_full_description_str,
         history_context=history_context_for_symptoms,
-        user_region=None # TODO: Consider how React app might provide region, or use a global setting
+        user_region=request.user_region
     )
+    # Results are shared across users, so only users without symptom history (whose prompt is the
+    # same for everyone with this symptom set) use the cache; anyone with history gets their own analysis
+    if symptom_cache.enabled and not request.bypass_cache and not await run_io(memory_handler.has_context, "symptoms", user_id=user_id):
+        cache_key = symptom_cache.make_key(request.symptoms, request.user_region, ai_handler.symptom_model)
+        ai_handler_result_dict, cache_hit = await symptom_cache.get_or_compute(cache_key, analyze)
+        cache_status = "hit" if cache_hit else "miss"
+    else:
+        symptom_cache.record_bypass()
+        cache_status = "bypass"
+        ai_handler_result_dict = await analyze()
 
     if ai_handler_result_dict.get("error"):
         # Pass through AI handler's error or raise a new one
@@ -105,13 +150,14 @@ async def analyze_symptoms_for_react_app(request: ReactAnalysisRequest):
         doctor_specialties_recommended=specialties_recommended
     )
     
-    # Save this interaction to main app's "symptoms" history
-    memory_handler.add_to_conversation_history(
-        mode="symptoms",
-        user_message=f"Symptom Analysis (via React App): {symptoms_full_description_str}",
-        ai_response=response_for_react.general_advice + " Possible conditions: " + ", ".join([c.name for c in response_for_react.possible_conditions]),
-    )
-    # Update medical summary based on what ai_handler extracted
+    # The interaction for main app's "symptoms" history
+    history_entry = {
+        "user_message": f"Symptom Analysis (via React App): {symptoms_full_description_str}",
+        "ai_response": response_for_react.general_advice + " Possible conditions: " + ", ".join([c.name for c in response_for_react.possible_conditions]),
+        "interaction_id": response_for_react.id,
+    }
+    # Medical summary update based on what ai_handler extracted
+    summary_update_data = None
     if ai_handler_result_dict.get("extracted_medical_info_dict"):
         extracted_info = ai_handler_result_dict["extracted_medical_info_dict"]
         # Ensure keys align with what update_medical_summary expects
@@ -119,17 +165,84 @@ async def analyze_symptoms_for_react_app(request: ReactAnalysisRequest):
             "current_symptoms_list": extracted_info.get("current_symptoms_list", [s.description for s in request.symptoms]),
             "potential_conditions_discussed_list": extracted_info.get("potential_conditions_discussed_list", [c.name for c in response_for_react.possible_conditions]),
         }
-        memory_handler.update_medical_summary(summary_update_data)
+    return response_for_react, history_entry, summary_update_data, cache_status
+
+@router.post("/symptoms/analyze", response_model=ReactSymptomAnalysisOutput, tags=["Symptom Analyzer (React)"])
+async def analyze_symptoms_for_react_app(request: ReactAnalysisRequest, user_id: UserId, response: Response):
+    response_for_react, history_entry, summary_update_data, cache_status = await _analyze_symptom_request(request, user_id)
+    response.headers["X-Symptom-Cache"] = cache_status
+
+    # Save this interaction to main app's "symptoms" history
+    await run_io(memory_handler.add_to_conversation_history, mode="symptoms", user_id=user_id, **history_entry)
+    summarizer.schedule(user_id, "symptoms")
+    if summary_update_data:
+        await run_io(memory_handler.update_medical_summary, summary_update_data, user_id=user_id)
 
     return response_for_react
 
-@router.post("/chat", response_model=ChatMessageOutput)
-async def handle_chat_message(
-    message: Annotated[Optional[str], Form()] = None,
-    mode_str: Annotated[str, Form()] = "qna", # Receive mode as string
-    user_region: Annotated[Optional[str], Form()] = None,
-    upload_file: Annotated[Optional[UploadFile], File()] = None
-):
+async def _run_symptom_batch(items: List[ReactAnalysisRequest], user_id: str, results: "asyncio.Queue[Optional[Dict[str, Any]]]"):
+    # Runs as its own task, so analyses already paid for are recorded even if the client disconnects
+    semaphore = asyncio.Semaphore(settings.SYMPTOM_BATCH_CONCURRENCY)
+    recorded: Dict[int, Tuple[Dict[str, Any], Optional[Dict[str, Any]]]] = {}
+
+    async def analyze_item(index: int, item: ReactAnalysisRequest):
+        async with semaphore:
+            try:
+                response_for_react, history_entry, summary_update_data, cache_status = await _analyze_symptom_request(item, user_id)
+            except HTTPException as e:
+                await results.put({"index": index, "status_code": e.status_code, "error": e.detail})
+                return
+            except Exception as e:
+                print(f"Error in symptom batch item {index}: {e.__class__.__name__} - {e}")
+                await results.put({"index": index, "status_code": 500, "error": str(e)})
+                return
+        recorded[index] = (history_entry, summary_update_data)
+        await results.put({"index": index, "status_code": 200, "cache": cache_status, "result": response_for_react.model_dump(mode="json")})
+
+    try:
+        await asyncio.gather(*(analyze_item(index, item) for index, item in enumerate(items)))
+        if recorded:
+            ordered = [recorded[index] for index in sorted(recorded)] # History in submission order
+            await run_io(
+                memory_handler.add_interactions_batch, "symptoms",
+                [history_entry for history_entry, _ in ordered],
+                [summary_update for _, summary_update in ordered if summary_update],
+                user_id=user_id,
+            )
+            summarizer.schedule(user_id, "symptoms")
+    finally:
+        await results.put(None)
+
+@router.post("/symptoms/analyze/batch", response_class=StreamingResponse, tags=["Symptom Analyzer (React)"])
+async def analyze_symptoms_batch_for_react_app(batch: ReactBatchAnalysisRequest, user_id: UserId):
+    """Analyzes many symptom sets concurrently (at most SYMPTOM_BATCH_CONCURRENCY at a time). Streams
+    NDJSON: one {"index", "status_code", "result" | "error"} line per item as it completes, in completion
+    order, then {"done": true, ...}. History and summary writes for the whole batch happen once at the end."""
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="At least one symptom set is required.")
+    if len(batch.items) > settings.SYMPTOM_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many symptom sets in one batch (max {settings.SYMPTOM_BATCH_MAX_ITEMS}).")
+
+    results: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+    batch_task = asyncio.create_task(_run_symptom_batch(batch.items, user_id, results))
+
+    async def result_lines():
+        succeeded = failed = 0
+        while (line := await results.get()) is not None:
+            if line["status_code"] == 200:
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(line) + "\n"
+        await batch_task # Surfaces a failed history write
+        yield json.dumps({"done": True, "total": len(batch.items), "succeeded": succeeded, "failed": failed}) + "\n"
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _prepare_chat_input(
+    message: Optional[str], mode_str: str, upload_file: Optional[UploadFile]
+) -> Tuple[ConversationMode, Optional[str], Optional[FileInformation]]:
+    """Validates the chat form fields and reads an optional upload. Shared by /chat and /chat/stream."""
     current_mode: ConversationMode
     if mode_str not in get_args(ConversationMode): # Validate against Literal values
         raise HTTPException(status_code=400, detail=f"Invalid mode: '{mode_str}'. Must be one of {get_args(ConversationMode)}.")
@@ -142,30 +255,86 @@ async def handle_chat_message(
         if upload_file.size > 10 * 1024 * 1024: # 10MB limit
             raise HTTPException(status_code=413, detail="File too large. Max 10MB.")
         
-        contents_bytes = await upload_file.read()
-        import base64
-        content_base64 = base64.b64encode(contents_bytes).decode('utf-8')
-        
+        # The form parser has already spooled the upload. Only the start of its text can go into a
+        # prompt, so extract just that (per format, off the event loop, cached by content hash)
+        # instead of copying and base64-encoding the whole file.
+        file_name = upload_file.filename or "uploaded_file"
+        content_type = upload_file.content_type or "application/octet-stream"
+        file_size = upload_file.size if upload_file.size is not None else upload_file.file.seek(0, 2) # seek returns the end offset
+        extraction = await file_extraction.extract_upload(upload_file.file, file_name, content_type, FILE_TEXT_MAX_CHARS)
         file_info_model = FileInformation(
-            name=upload_file.filename or "uploaded_file",
-            type=upload_file.content_type or "application/octet-stream",
-            size=len(contents_bytes), # Use actual byte length
-            content_base64=content_base64
+            name=file_name,
+            type=content_type,
+            size=file_size,
+            text_excerpt=extraction["text"] or None,
+            text_truncated=extraction["truncated"],
+            content_format=extraction["format"],
+            content_detail=extraction["detail"],
+            image_data_uri=extraction.get("image_data_uri")
         )
+        if extraction.get("error"):
+            print(f"File extraction problem for {file_name}: {extraction['error']}")
         await upload_file.close()
-        print(f"File received: {file_info_model.name}, Type: {file_info_model.type}, Size: {file_info_model.size}")
+        print(f"File received: {file_info_model.name}, Type: {file_info_model.type}, Size: {file_info_model.size}, Content: {file_info_model.content_detail}{' (cached)' if extraction['cached'] else ''}")
         if not input_message: # If only file is uploaded, make a default message for context
             input_message = f"Please analyze the uploaded file: {file_info_model.name}"
 
     if not input_message and not file_info_model:
         raise HTTPException(status_code=400, detail="No message or file provided.")
+    return current_mode, input_message, file_info_model
+
+def _build_chat_output(response_data_dict: Dict[str, Any]) -> ChatMessageOutput:
+    # Ensure all fields for ChatMessageOutput are present, defaulting if necessary
+    # The _parse_ai_response_to_structured_output in ai_handler should mostly handle this.
+    # This is a final safety net.
+    final_output_data = {
+        "answer": response_data_dict.get("answer", "No specific answer generated by AI."),
+        "answer_format": response_data_dict.get("answer_format", "markdown"),
+        "follow_up_questions": response_data_dict.get("follow_up_questions"),
+        "disease_identification": response_data_dict.get("disease_identification"),
+        "next_steps": response_data_dict.get("next_steps"),
+        "government_schemes": response_data_dict.get("government_schemes"),
+        "doctor_recommendations": response_data_dict.get("doctor_recommendations"),
+        "graphs_data": response_data_dict.get("graphs_data"),
+        "error": response_data_dict.get("error"),
+        "file_processed_with_message": response_data_dict.get("file_processed_with_message")
+    }
+    return ChatMessageOutput(**final_output_data)
+
+def _record_chat_interaction(
+    user_id: str, current_mode: ConversationMode, input_message: Optional[str], file_info_model: Optional[FileInformation],
+    response_output: ChatMessageOutput, response_data_dict: Dict[str, Any]
+):
+    # Save to conversation history for the specific mode
+    memory_handler.add_to_conversation_history(
+        mode=current_mode,
+        user_message=input_message, 
+        ai_response=response_output.answer, # Storing main answer text
+        # To store the full AI JSON response for richer history display:
+        # ai_response_full_obj=response_output.model_dump_json(), # Store full ChatMessageOutput as JSON string
+        file_name=file_info_model.name if file_info_model else None,
+        user_id=user_id
+    )
+    
+    if current_mode in ["personal_symptoms"] and response_data_dict.get("extracted_medical_info"):
+        memory_handler.update_medical_summary(response_data_dict["extracted_medical_info"], user_id=user_id)
+
+@router.post("/chat", response_model=ChatMessageOutput)
+async def handle_chat_message(
+    user_id: UserId,
+    message: Annotated[Optional[str], Form()] = None,
+    mode_str: Annotated[str, Form()] = "qna", # Receive mode as string
+    user_region: Annotated[Optional[str], Form()] = None,
+    upload_file: Annotated[Optional[UploadFile], File()] = None
+):
+    current_mode, input_message, file_info_model = await _prepare_chat_input(message, mode_str, upload_file)
 
     # Use Pydantic model for consistent input to AI handler, built from Form data
     # This isn't strictly necessary here as we pass individual args, but good practice if AI handler expects a model
     # For now, we'll pass individual args as AI handler methods are defined that way
     file_info_model_dict = file_info_model.model_dump() if file_info_model else None
 
-    history_context = memory_handler.get_context_for_ai(current_mode)
+    history_context = await run_io(memory_handler.get_context_for_ai, current_mode, user_id=user_id, query=input_message)
     response_data_dict: Dict[str, Any] = {}
 
     try:
@@ -183,36 +352,9 @@ async def handle_chat_message(
             )
         # No 'else' needed due to mode_str validation earlier
 
-        # Ensure all fields for ChatMessageOutput are present, defaulting if necessary
-        # The _parse_ai_response_to_structured_output in ai_handler should mostly handle this.
-        # This is a final safety net.
-        final_output_data = {
-            "answer": response_data_dict.get("answer", "No specific answer generated by AI."),
-            "answer_format": response_data_dict.get("answer_format", "markdown"),
-            "follow_up_questions": response_data_dict.get("follow_up_questions"),
-            "disease_identification": response_data_dict.get("disease_identification"),
-            "next_steps": response_data_dict.get("next_steps"),
-            "government_schemes": response_data_dict.get("government_schemes"),
-            "doctor_recommendations": response_data_dict.get("doctor_recommendations"),
-            "graphs_data": response_data_dict.get("graphs_data"),
-            "error": response_data_dict.get("error"),
-            "file_processed_with_message": response_data_dict.get("file_processed_with_message")
-        }
-        response_output = ChatMessageOutput(**final_output_data)
-
-        # Save to conversation history for the specific mode
-        memory_handler.add_to_conversation_history(
-            mode=current_mode,
-            user_message=input_message, 
-            ai_response=response_output.answer, # Storing main answer text
-            # To store the full AI JSON response for richer history display:
-            # ai_response_full_obj=response_output.model_dump_json(), # Store full ChatMessageOutput as JSON string
-            file_name=file_info_model.name if file_info_model else None
-        )
-        
-        if current_mode in ["personal_symptoms"] and response_data_dict.get("extracted_medical_info"):
-            memory_handler.update_medical_summary(response_data_dict["extracted_medical_info"])
-            
+        response_output = _build_chat_output(response_data_dict)
+        await run_io(_record_chat_interaction, user_id, current_mode, input_message, file_info_model, response_output, response_data_dict)
+        summarizer.schedule(user_id, current_mode)
         return response_output
 
     except HTTPException as e:
@@ -223,25 +365,212 @@ async def handle_chat_message(
         traceback.print_exc()
         return ChatMessageOutput(answer=f"Sorry, an unexpected server error occurred while processing your request for {current_mode}.", error=str(e))
 
+def _format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream", response_class=StreamingResponse)
+async def handle_chat_message_stream(
+    user_id: UserId,
+    message: Annotated[Optional[str], Form()] = None,
+    mode_str: Annotated[str, Form()] = "qna",
+    user_region: Annotated[Optional[str], Form()] = None,
+    upload_file: Annotated[Optional[UploadFile], File()] = None
+):
+    """
+    Server-Sent Events version of /chat. Emits 'token' events ({"text": ...}) as the model writes,
+    then one 'final' event carrying the full ChatMessageOutput (follow-ups, graphs, sources).
+    History and the medical summary are only written once the stream has completed.
+    """
+    current_mode, input_message, file_info_model = await _prepare_chat_input(message, mode_str, upload_file)
+    if current_mode == "personal_symptoms" and not input_message:
+        raise HTTPException(status_code=400, detail="Symptom description is required for this mode.")
+    file_info_model_dict = file_info_model.model_dump() if file_info_model else None
+    history_context = await run_io(memory_handler.get_context_for_ai, current_mode, user_id=user_id, query=input_message)
+
+    async def event_stream():
+        response_data_dict: Dict[str, Any] = {}
+        try:
+            if current_mode in ("qna", "personal_symptoms"):
+                async for event in ai_handler.stream_chat_answer(
+                    current_mode,
+                    input_message or "User uploaded a file for context. Please see file details if relevant.",
+                    history_context, file_info=file_info_model_dict, user_region=user_region
+                ):
+                    if event["event"] == "token":
+                        yield _format_sse("token", {"text": event["data"]})
+                    else:
+                        response_data_dict = event["data"]
+
+            response_output = _build_chat_output(response_data_dict)
+            await run_io(_record_chat_interaction, user_id, current_mode, input_message, file_info_model, response_output, response_data_dict)
+            summarizer.schedule(user_id, current_mode)
+            yield _format_sse("final", response_output.model_dump(mode="json"))
+        except Exception as e:
+            print(f"Critical Error in /chat/stream endpoint processing mode '{current_mode}': {e.__class__.__name__} - {str(e)}")
+            import traceback
+            traceback.print_exc()
+            error_output = ChatMessageOutput(answer=f"Sorry, an unexpected server error occurred while processing your request for {current_mode}.", error=str(e))
+            yield _format_sse("final", error_output.model_dump(mode="json"))
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Stop proxies from buffering tokens
+    )
+
+
+# --- History API: pagination, filtering, projection and conditional GETs ---
+HISTORY_FIELDS = ("id", "timestamp", "user_message", "ai_response", "file_processed")
+MAX_HISTORY_PAGE_SIZE = 100
+
+def _encode_history_cursor(entry: Dict[str, Any]) -> str:
+    raw = json.dumps([entry.get("timestamp") or "", str(entry.get("id") or "")])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_history_cursor(cursor: str) -> HistoryPosition:
+    try:
+        timestamp, entry_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return history_position({"timestamp": timestamp, "id": entry_id})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid history cursor.")
+
+def _parse_since(since: Optional[str]):
+    if since is None:
+        return None
+    parsed = parse_timestamp(since)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Invalid 'since' timestamp: '{since}'. Use ISO 8601, e.g. 2025-01-31T12:00:00Z.")
+    return parsed
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in HISTORY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown history field(s): {', '.join(unknown)}. Choose from: {', '.join(HISTORY_FIELDS)}.")
+    return requested
+
+def _project(entries: List[Dict[str, Any]], fields: Optional[List[str]]) -> List[Dict[str, Any]]:
+    if fields is None:
+        return entries
+    return [{f: entry[f] for f in fields if f in entry} for entry in entries]
+
+def _json_response_with_etag(request: Request, payload: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    # Strong ETag over the exact body, so it is the same on every worker; pollers get a bodiless 304
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    response_headers = {**(headers or {}), "ETag": etag, "Cache-Control": "private, no-cache", "Vary": "X-User-ID"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidate_tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in candidate_tags or etag in candidate_tags:
+            return Response(status_code=304, headers=response_headers)
+    return Response(content=body, media_type="application/json", headers=response_headers)
+
+# Registered before /history/{mode_str}, which would otherwise take "search" as a mode
+@router.get("/history/search", response_model=HistorySearchResponse)
+async def search_history_route(
+    user_id: UserId,
+    q: Annotated[str, Query(min_length=1, max_length=500, description="Words to look for in past questions and answers")],
+    mode: Annotated[Optional[str], Query(description="Limit to one mode (qna or symptoms)")] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_HISTORY_PAGE_SIZE)] = 20,
+    offset: Annotated[int, Query(ge=0)] = 0,
+):
+    """Ranked full-text search over the user's past interactions, best match first. Covers the retained
+    history only, the newest 50 interactions per mode; older turns are no longer stored and can't be found."""
+    if mode is not None and mode not in get_args(ConversationMode):
+        raise HTTPException(status_code=400, detail=f"Invalid mode for history search: '{mode}'.")
+    total, hits = await run_io(memory_handler.search_history, q, [mode] if mode else None, limit, offset, user_id=user_id)
+    results = [
+        HistorySearchHit(
+            mode=hit_mode, score=round(score, 4), **{f: entry.get(f) for f in HISTORY_FIELDS},
+            highlights={f: highlight(entry[f], q) for f in ("user_message", "ai_response") if entry.get(f)}
+        )
+        for hit_mode, score, entry in hits
+    ]
+    return HistorySearchResponse(query=q, total=total, offset=offset, limit=limit, results=results)
 
 @router.get("/history/{mode_str}", response_model=List[Dict[str, Any]])
-async def get_mode_history_route(mode_str: str):
+async def get_mode_history_route(
+    request: Request,
+    mode_str: str,
+    user_id: UserId,
+    limit: Annotated[Optional[int], Query(ge=1, le=MAX_HISTORY_PAGE_SIZE, description="Newest N interactions; older pages via the X-Next-Cursor header")] = None,
+    cursor: Annotated[Optional[str], Query(description="X-Next-Cursor value from the previous page")] = None,
+    since: Annotated[Optional[str], Query(description="Only interactions after this ISO 8601 timestamp")] = None,
+    fields: Annotated[Optional[str], Query(description=f"Comma-separated subset of: {', '.join(HISTORY_FIELDS)}")] = None,
+):
+    """A mode's interactions, oldest-first. Still a plain list; the cursor for the next (older) page is
+    returned in X-Next-Cursor. Supports If-None-Match against the ETag header."""
     current_mode: ConversationMode
     if mode_str not in get_args(ConversationMode):
         raise HTTPException(status_code=400, detail=f"Invalid mode for history: '{mode_str}'.")
     current_mode = mode_str #type: ignore
-    return memory_handler.get_conversation_history(current_mode)
+    before = _decode_history_cursor(cursor) if cursor else None
+    since_dt, projected_fields = _parse_since(since), _parse_fields(fields)
+
+    entries, has_more = await run_io(memory_handler.get_conversation_page, current_mode, limit, before, since_dt, user_id=user_id)
+    headers = {"X-Next-Cursor": _encode_history_cursor(entries[0])} if has_more and entries else {}
+    return _json_response_with_etag(request, _project(entries, projected_fields), headers)
 
 @router.get("/history/summary/all")
-async def get_all_history_summary_route(): # Renamed to avoid conflict if class has same name
-    conv_summary = memory_handler.get_all_conversations_summary()
-    med_summary = memory_handler.get_medical_summary()
-    return {
-        "conversation_summaries": conv_summary,
-        "medical_summary": med_summary
-    }
+async def get_all_history_summary_route( # Renamed to avoid conflict if class has same name
+    request: Request,
+    user_id: UserId,
+    limit: Annotated[Optional[int], Query(ge=1, le=MAX_HISTORY_PAGE_SIZE, description="Newest N interactions per mode")] = None,
+    since: Annotated[Optional[str], Query(description="Only interactions after this ISO 8601 timestamp")] = None,
+    fields: Annotated[Optional[str], Query(description=f"Comma-separated subset of: {', '.join(HISTORY_FIELDS)}")] = None,
+):
+    since_dt, projected_fields = _parse_since(since), _parse_fields(fields)
+    overview = await run_io(memory_handler.get_history_overview, user_id) # One read for histories and summary
+    for mode, entries in overview["conversation_summaries"].items():
+        if since_dt is not None:
+            entries = [entry for entry in entries if history_position(entry)[0] > since_dt]
+        if limit:
+            entries = entries[-limit:]
+        overview["conversation_summaries"][mode] = _project(entries, projected_fields)
+    return _json_response_with_etag(request, overview)
+
+# --- Bulk export/import (NDJSON, streamed both ways; format in utils/memory_transfer.py) ---
+def _require_admin(x_admin_token: Optional[str]):
+    # all_users reaches other users' data, which X-User-ID alone must never unlock. Off unless an admin token is configured.
+    if not settings.MEDICAL_MEMORY_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="all_users is disabled on this server.")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode("utf-8"), settings.MEDICAL_MEMORY_ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="all_users requires a valid X-Admin-Token header.")
+
+@router.get("/memory/export", response_class=StreamingResponse)
+async def export_memory_route(
+    user_id: UserId,
+    all_users: Annotated[bool, Query(description="Export every stored user instead of just the requesting one (admin only)")] = False,
+    x_admin_token: Annotated[Optional[str], Header()] = None,
+):
+    if all_users:
+        _require_admin(x_admin_token)
+    user_ids = await run_io(memory_handler.iter_user_ids) if all_users else [user_id]
+    file_name = f"medical_memory_{'all_users' if all_users else user_id}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}.ndjson"
+    return StreamingResponse(
+        export_ndjson(memory_handler, user_ids), media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"', "Cache-Control": "no-store"}
+    )
+
+@router.post("/memory/import")
+async def import_memory_route(
+    request: Request,
+    user_id: UserId,
+    all_users: Annotated[bool, Query(description="Import each record into the user_id it carries instead of the requesting user (admin only)")] = False,
+    strategy: Annotated[Literal["merge", "replace"], Query(description="merge: add to existing data; replace: clear each imported user first")] = "merge",
+    x_admin_token: Annotated[Optional[str], Header()] = None,
+):
+    """Body: an NDJSON export from /memory/export, read as a stream. Returns import counts and any rejected lines."""
+    if all_users:
+        _require_admin(x_admin_token)
+    try:
+        return await import_ndjson(memory_handler, request.stream(), None if all_users else user_id, replace=strategy == "replace")
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/history/clear/all")
-async def clear_all_data_route(): # Renamed
-    memory_handler.clear_all_user_data()
+async def clear_all_data_route(user_id: UserId): # Renamed
+    await run_io(memory_handler.clear_all_user_data, user_id)
     return {"message": "All user data has been cleared."}
\ No newline at end of file
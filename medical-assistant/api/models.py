@@ -6,6 +6,12 @@ class FileInformation(BaseModel):
     type: str
     size: int
     content_base64: Optional[str] = None # Optional if file is just referenced by name/path
+    # Chat uploads carry only the extracted start of the file (what the prompt can use), not the bytes
+    text_excerpt: Optional[str] = None
+    text_truncated: bool = False
+    content_format: Optional[str] = None # "pdf", "image", "text" or "binary", detected from the content
+    content_detail: Optional[str] = None # E.g. "PDF, 3 page(s)" or "PNG image, 800x600"
+    image_data_uri: Optional[str] = None # Downscaled JPEG of an image upload, for vision-capable models
 
 class ChatMessageInput(BaseModel):
     message: Optional[str] = None
@@ -56,6 +62,10 @@ class ReactAnalysisRequest(BaseModel):
     symptoms: List[ReactSymptomInput]
     user_region: Optional[str] = None # Add if React can send it
     history_context_string: Optional[str] = None # For SPA to send its history summary
+    bypass_cache: bool = False # Always run a fresh analysis (the shared result cache is only used for users without history)
+
+class ReactBatchAnalysisRequest(BaseModel):
+    items: List[ReactAnalysisRequest] # One entry per symptom set (e.g. a kiosk's queued submissions)
 
 class ReactConditionOutput(BaseModel):  
     name: str
@@ -71,4 +81,22 @@ class ReactSymptomAnalysisOutput(BaseModel):
     general_advice: str
     should_seek_medical_attention: bool
     government_schemes: Optional[List[AISchemeInfo]] = None # Mirroring AISchemeInfo
-    doctor_specialties_recommended: Optional[List[str]] = None # List of specialty strings
\ No newline at end of file
+    doctor_specialties_recommended: Optional[List[str]] = None # List of specialty strings
+
+# --- Models for history search ---
+class HistorySearchHit(BaseModel):
+    mode: str
+    score: float
+    id: Optional[str] = None
+    timestamp: Optional[str] = None
+    user_message: Optional[str] = None
+    ai_response: Optional[str] = None
+    file_processed: Optional[str] = None
+    highlights: Dict[str, str] = Field(default_factory=dict, description="HTML-escaped excerpts with matches wrapped in <mark>")
+
+class HistorySearchResponse(BaseModel):
+    query: str
+    total: int
+    offset: int
+    limit: int
+    results: List[HistorySearchHit]
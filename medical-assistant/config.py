@@ -17,7 +17,7 @@ class Settings:
     
 
     PERPLEXITY_API_KEY: str = os.getenv('PERPLEXITY_API_KEY')
-    PERPLEXITY_API_BASE_URL: str = "https://api.perplexity.ai/chat/completions"
+    PERPLEXITY_API_BASE_URL: str = os.getenv('PERPLEXITY_API_BASE_URL', "https://api.perplexity.ai/chat/completions")
 
     
     QNA_MODEL: str = os.getenv('PERPLEXITY_QNA_MODEL', "sonar-pro")
@@ -27,6 +27,41 @@ class Settings:
     ADVISORY_APP_MODEL_NAME_CONFIG: str = os.getenv('ADVISORY_APP_MODEL_NAME', "sonar-pro")
     REPORT_APP_MODEL_NAME_CONFIG: str = os.getenv('REPORT_APP_MODEL_NAME', "sonar-pro") 
 
+    # Conversation/medical-summary storage for the chat assistant: "sqlite" or "json"
+    MEDICAL_MEMORY_BACKEND: str = os.getenv('MEDICAL_MEMORY_BACKEND', "sqlite").lower()
+    # Keep chat history in memory and flush writes in the background, batching writes within the delay
+    MEDICAL_MEMORY_WRITE_BEHIND: bool = os.getenv('MEDICAL_MEMORY_WRITE_BEHIND', "true").lower() in ("1", "true", "yes")
+    MEDICAL_MEMORY_FLUSH_DELAY_SECONDS: float = float(os.getenv('MEDICAL_MEMORY_FLUSH_DELAY_SECONDS', "0.5"))
+    # Users are hashed across this many SQLite files so writers rarely share a lock (changing it strands data)
+    MEDICAL_MEMORY_SQLITE_SHARDS: int = int(os.getenv('MEDICAL_MEMORY_SQLITE_SHARDS', "8"))
+    # Most users whose history is kept in memory per worker process
+    MEDICAL_MEMORY_CACHED_USERS: int = int(os.getenv('MEDICAL_MEMORY_CACHED_USERS', "1000"))
+    # Approximate token cap for the history context added to chat prompts (0 = no cap)
+    MEDICAL_MEMORY_CONTEXT_TOKEN_BUDGET: int = int(os.getenv('MEDICAL_MEMORY_CONTEXT_TOKEN_BUDGET', "1000"))
+    # Earlier interactions retrieved by relevance to the current question (0 = only the latest turns)
+    MEDICAL_MEMORY_CONTEXT_TOP_K: int = int(os.getenv('MEDICAL_MEMORY_CONTEXT_TOP_K', "4"))
+    # Background rolling summary of turns older than the recent ones, used in prompts instead of raw history
+    MEDICAL_MEMORY_SUMMARY_ENABLED: bool = os.getenv('MEDICAL_MEMORY_SUMMARY_ENABLED', "true").lower() in ("1", "true", "yes")
+    MEDICAL_MEMORY_SUMMARY_MODEL: str = os.getenv('MEDICAL_MEMORY_SUMMARY_MODEL', "sonar")
+    MEDICAL_MEMORY_SUMMARY_BATCH_TURNS: int = int(os.getenv('MEDICAL_MEMORY_SUMMARY_BATCH_TURNS', "4")) # Older turns folded in per update
+    MEDICAL_MEMORY_SUMMARY_MAX_CHARS: int = int(os.getenv('MEDICAL_MEMORY_SUMMARY_MAX_CHARS', "1200"))
+
+    # /symptoms/analyze/batch: analyses run at once per batch, and symptom sets accepted per batch
+    SYMPTOM_BATCH_CONCURRENCY: int = max(1, int(os.getenv('SYMPTOM_BATCH_CONCURRENCY', "4")))
+    SYMPTOM_BATCH_MAX_ITEMS: int = int(os.getenv('SYMPTOM_BATCH_MAX_ITEMS', "50"))
+
+    # /symptoms/analyze result cache, keyed on the normalized symptom set (see utils/symptom_cache.py).
+    # Only used for users without symptom history (their prompt is the same as everyone's); bypass_cache skips it.
+    SYMPTOM_CACHE_ENABLED: bool = os.getenv('SYMPTOM_CACHE_ENABLED', "true").lower() in ("1", "true", "yes")
+    SYMPTOM_CACHE_TTL_SECONDS: int = int(os.getenv('SYMPTOM_CACHE_TTL_SECONDS', str(6 * 3600)))
+    SYMPTOM_CACHE_MAX_ENTRIES: int = int(os.getenv('SYMPTOM_CACHE_MAX_ENTRIES', "1024"))
+
+    # Enables all_users=true on /memory/export and /memory/import for callers sending it as X-Admin-Token. Unset: disabled.
+    MEDICAL_MEMORY_ADMIN_TOKEN: str = os.getenv('MEDICAL_MEMORY_ADMIN_TOKEN', "")
+
+    # Symptom/condition vocabulary mapping free text to concept IDs (see utils/symptom_lexicon.py)
+    SYMPTOM_LEXICON_PATH: str = os.getenv('SYMPTOM_LEXICON_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "symptom_lexicon.json"))
+
   
 
     if not PERPLEXITY_API_KEY:
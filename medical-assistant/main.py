@@ -1,7 +1,7 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import disease_outbreak_app.main_router as outbreak_router
 import os
@@ -13,6 +13,8 @@ from .api import chat_router as main_chat_api_router # This one is a sub-package
 import report_analyzer_app.main_router as report_analyzer_router
 import survey_research_app.main_router as survey_research_router
 import advisories_app.main_router as advisories_router
+from shared_services import blocking_io, file_extraction, perplexity_client, telemetry
+from shared_services.upstream_scheduler import upstream_scheduler
 # Note: To make 'import report_analyzer_app.main_router' work,
 # report_analyzer_app MUST have an __init__.py file. Same for others.
 
@@ -28,6 +30,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Lets upstream LLM telemetry attribute each call to the route that triggered it
+app.add_middleware(telemetry.EndpointLabelMiddleware)
 
 # --- Define Base Directories ---
 main_app_module_dir = os.path.dirname(os.path.abspath(__file__)) # medical-assistant/
@@ -81,8 +85,20 @@ async def startup_event():
     print("MAIN_APP: Running startup tasks...")
     # Trigger the forecast generation for the disease outbreak app
     outbreak_router.generate_and_cache_forecast()
+    # Open the shared keep-alive connection pools used for all Perplexity calls
+    await perplexity_client.startup()
     print("MAIN_APP: Startup tasks complete.")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    print("MAIN_APP: Running shutdown tasks...")
+    await main_chat_api_router.summarizer.shutdown()
+    await perplexity_client.shutdown()
+    main_chat_api_router.memory_handler.close() # Write out chat history still queued in memory
+    blocking_io.shutdown() # Let in-flight result/history writes finish
+    file_extraction.shutdown()
+    print("MAIN_APP: Shutdown tasks complete.")
+
 # --- Include API Routers ---
 app.include_router(main_chat_api_router.router, prefix="/api/v1") # This router is inside medical_assistant package
 app.include_router(report_analyzer_router.router)      # Imported as top-level
@@ -143,5 +159,26 @@ async def serve_symptom_analyzer_spa_base(request: Request):
 async def health_check():
     return {"status": "healthy", "application": "Main AI Medical Suite"}
 
+@app.get("/api/v1/upstream/stats", tags=["Main App Health"])
+async def upstream_stats():
+    # Per-model slot usage and queue depth of the shared Perplexity scheduler
+    return {
+        "scheduler": upstream_scheduler.stats(),
+        "resilience": perplexity_client.resilience.stats(),
+        "cache": perplexity_client.llm_cache.llm_response_cache.stats(),
+        "symptom_cache": main_chat_api_router.symptom_cache.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    # Prometheus text format: upstream latency/tokens/cost/errors by app, endpoint and model, plus cache and scheduler gauges
+    body = telemetry.render_prometheus(
+        cache_stats=perplexity_client.llm_cache.llm_response_cache.stats(),
+        scheduler_stats=upstream_scheduler.stats(),
+        resilience_stats=perplexity_client.resilience.stats(),
+        blocking_io_stats=blocking_io.stats(),
+    )
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # To run (from my_ai_medical_assistant/ directory):
 # uvicorn medical-assistant.main:app --reload --port 8000
@@ -1,11 +1,19 @@
 import httpx, html, json, re, datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
 
+from shared_services import perplexity_client, resilience
+from shared_services.upstream_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE
 from ..config import settings 
 from ..api.models import AISchemeInfo, AIDoctorRecommendation, AIGraphData
 
 ExtractedMedicalInfo = Dict[str, Any]
 
+FILE_TEXT_MAX_CHARS = 12000 # File text included in a Q&A prompt
+FILE_TEXT_MAX_BYTES = 4 * FILE_TEXT_MAX_CHARS # Enough bytes for that many UTF-8 characters
+
+class StreamFailed(Exception):
+    """Raised by _stream_perplexity_api; str(e) is the user-facing 'Error: ...' message."""
+
 class AIInteractionHandler:
     def __init__(self):
         self.api_key = settings.PERPLEXITY_API_KEY
@@ -13,6 +21,7 @@ class AIInteractionHandler:
 
         self.qna_model = settings.QNA_MODEL
         self.symptom_model = settings.SYMPTOM_MODEL       
+        self.summary_model = settings.MEDICAL_MEMORY_SUMMARY_MODEL
 
         if not self.api_key:
             print("AIInteractionHandler: CRITICAL - PERPLEXITY_API_KEY is not set.")
@@ -24,11 +33,14 @@ class AIInteractionHandler:
         model_name: str,
         max_tokens: int = 2048,
         temperature: float = 0.3,   
+        cache_mode: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        image_data_uri: Optional[str] = None,
     ) -> str:
         if not self.api_key:
             return "Error: API Key not configured on the server."
 
-        messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+        messages = self._build_messages(system_prompt, user_prompt, image_data_uri)
         payload = {
             "model": model_name,
             "messages": messages,
@@ -38,51 +50,89 @@ class AIInteractionHandler:
             # "top_p": 0.9,
             # "frequency_penalty": 0.1,
         }
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        timeout_duration = 180.0 # Increased timeout slightly
+        timeout_duration = resilience.get_timeout(model_name) # Adaptive per-model timeout, for error messages
 
         print(f"--- Sending Request to Perplexity (ai_handler) ---")
         print(f"Model: {model_name}")
         
 
         try:
-            async with httpx.AsyncClient(timeout=timeout_duration) as client:
-                response = await client.post(self.base_url, json=payload, headers=headers)
-                response.raise_for_status()
-                response_data = response.json()
+            response_data = await perplexity_client.create_chat_completion(
+                payload, self.api_key, cache_mode=cache_mode, priority=priority, app="chat"
+            )
 
             if response_data.get("choices") and response_data["choices"][0].get("message"):
                 content = response_data["choices"][0]["message"]["content"].strip()
-                # Log usage if needed for tracking: print(f"Usage: {response_data.get('usage')}")
+                # Token usage is recorded per app/endpoint/model by shared_services.telemetry (see /metrics)
                 print(f"Raw response received from {model_name} (length: {len(content)} chars).")
                 return content
             else:
                 error_msg = response_data.get("error", {}).get("message", "Unknown API response format.")
                 print(f"API Error (model: {model_name}): {error_msg} Full response: {json.dumps(response_data, indent=2)}")
                 return f"Error: AI API returned an error: {error_msg}"
-        except httpx.HTTPStatusError as http_err:
+        except Exception as e:
+            return self._format_api_error(e, model_name, timeout_duration)
+
+    @staticmethod
+    def _build_messages(system_prompt: str, user_prompt: str, image_data_uri: Optional[str] = None) -> List[Dict[str, Any]]:
+        # An uploaded image goes along as a vision content part, the same shape the report analyzer uses
+        user_content: Any = user_prompt
+        if image_data_uri:
+            user_content = [{"type": "text", "text": user_prompt}, {"type": "image_url", "image_url": {"url": image_data_uri}}]
+        return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_content}]
+
+    def _format_api_error(self, error: Exception, model_name: str, timeout_duration: float) -> str:
+        """Turns an exception from a Perplexity call into the 'Error: ...' string callers expect."""
+        if isinstance(error, httpx.HTTPStatusError):
             error_content = "Unknown error"
             try:
-                error_details = http_err.response.json()
-                error_content = error_details.get("error", {}).get("message", http_err.response.text[:200])
+                error_details = error.response.json()
+                error_content = error_details.get("error", {}).get("message", error.response.text[:200])
             except json.JSONDecodeError:
-                error_content = http_err.response.text[:200]
-            print(f"HTTP error (model: {model_name}): {http_err} - Details: {error_content}")
-            return f"Error: AI API request failed (HTTP {http_err.response.status_code}). Details: {error_content}"
-        except httpx.TimeoutException:
+                error_content = error.response.text[:200]
+            print(f"HTTP error (model: {model_name}): {error} - Details: {error_content}")
+            return f"Error: AI API request failed (HTTP {error.response.status_code}). Details: {error_content}"
+        if isinstance(error, httpx.TimeoutException):
             print(f"API request timed out for model {model_name} after {timeout_duration}s.")
             return "Error: The AI API request timed out. Please try again later."
-        except httpx.RequestError as req_err:
-            print(f"Request error (model: {model_name}): {req_err}")
-            return f"Error: AI API request failed due to a network issue: {str(req_err)}"
+        if isinstance(error, httpx.RequestError):
+            print(f"Request error (model: {model_name}): {error}")
+            return f"Error: AI API request failed due to a network issue: {str(error)}"
+        print(f"Generic error in Perplexity call (model: {model_name}): {error.__class__.__name__} - {error}")
+        import traceback; traceback.print_exception(error)
+        return f"Error: An unexpected error occurred: {str(error)}"
+
+    async def _stream_perplexity_api(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model_name: str,
+        max_tokens: int = 2048,
+        temperature: float = 0.3,
+        cache_mode: Optional[str] = None,
+        priority: str = PRIORITY_INTERACTIVE,
+        image_data_uri: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Streaming counterpart of _call_perplexity_api: yields content deltas. On failure it yields
+        nothing further and raises StreamFailed carrying the usual 'Error: ...' string.
+        """
+        if not self.api_key:
+            raise StreamFailed("Error: API Key not configured on the server.")
+
+        messages = self._build_messages(system_prompt, user_prompt, image_data_uri)
+        payload = {"model": model_name, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+        timeout_duration = resilience.get_timeout(model_name)
+
+        print(f"--- Streaming Request to Perplexity (ai_handler) ---")
+        print(f"Model: {model_name}")
+        try:
+            async for delta in perplexity_client.stream_chat_completion(
+                payload, self.api_key, cache_mode=cache_mode, priority=priority, app="chat"
+            ):
+                yield delta
         except Exception as e:
-            print(f"Generic error in _call_perplexity_api (model: {model_name}): {e.__class__.__name__} - {e}")
-            import traceback; traceback.print_exc()
-            return f"Error: An unexpected error occurred: {str(e)}"
+            raise StreamFailed(self._format_api_error(e, model_name, timeout_duration)) from e
 
     def _strip_think_blocks(self, text_with_thoughts: str) -> str:
         """Removes <think>...</think> blocks from text, case-insensitive, handles newlines."""
@@ -244,7 +294,7 @@ class AIInteractionHandler:
         print(f"Final Parsed Output for mode '{mode}': Answer snippet: {str(output.get('answer'))[:100]}..., Error: {output.get('error')}")
         return output
     
-    async def get_general_qna_answer(self, question: str, history_context: str, file_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def _build_qna_prompts(self, question: str, history_context: str, file_info: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
         system_prompt = (
             "You are 'sonar-pro', an expert AI Medical Information Assistant. Your goal is to provide comprehensive, accurate, and well-structured answers to medical questions. "
             "Your response MUST adhere to the following structure and guidelines:\n\n"
@@ -267,28 +317,46 @@ class AIInteractionHandler:
         user_prompt_parts = [f"Relevant User History (for context only):\n{history_context}\n"]
         if file_info:
             file_summary = f"The user has also uploaded a file relevant to their question: '{file_info['name']}' (Type: '{file_info['type']}'). Please consider its content when answering."
-            if file_info.get('content_base64'):
+            if file_info.get('content_detail'):
+                file_summary += f" Detected content: {file_info['content_detail']}."
+            if file_info.get('image_data_uri'):
+                file_summary += " The image is attached to this message."
+            elif file_info.get('content_format') in ("image", "binary"):
+                file_summary += " Its content could not be read as text; do not guess what it contains."
+            decoded_content, truncated = file_info.get('text_excerpt'), bool(file_info.get('text_truncated'))
+            if decoded_content is None and file_info.get('content_base64'):
                 try:
                     import base64
-                    decoded_content = base64.b64decode(file_info['content_base64']).decode('utf-8', errors='ignore')
-                    max_text_chars = 12000 
-                    if len(decoded_content) > max_text_chars:
-                        decoded_content = decoded_content[:max_text_chars] + "\n... (File content truncated in prompt due to length)"
-                    file_summary += f"\n\nHere is the text content of the file for your analysis:\n\"\"\"\n{decoded_content}\n\"\"\""
+                    # Only decode the prefix the prompt can use (4 base64 chars -> 3 bytes)
+                    encoded_prefix = file_info['content_base64'][:(FILE_TEXT_MAX_BYTES + 2) // 3 * 4]
+                    decoded_content = base64.b64decode(encoded_prefix).decode('utf-8', errors='ignore')
+                    truncated = len(encoded_prefix) < len(file_info['content_base64'])
                 except Exception as e:
                     print(f"QnA: Error decoding file for prompt: {e}")
                     file_summary += "\n(Note: Could not decode file content for inclusion in this prompt snippet.)"
+            if decoded_content:
+                if truncated or len(decoded_content) > FILE_TEXT_MAX_CHARS:
+                    decoded_content = decoded_content[:FILE_TEXT_MAX_CHARS] + "\n... (File content truncated in prompt due to length)"
+                file_summary += f"\n\nHere is the text content of the file for your analysis:\n\"\"\"\n{decoded_content}\n\"\"\""
             user_prompt_parts.append(file_summary)
         user_prompt_parts.append(f"\nUser's Question: {question}")
         user_prompt = "\n".join(user_prompt_parts)
+        return system_prompt, user_prompt
+
+    async def get_general_qna_answer(self, question: str, history_context: str, file_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        system_prompt, user_prompt = self._build_qna_prompts(question, history_context, file_info)
 
         # Call the API
         api_response_content = await self._call_perplexity_api(
             system_prompt, user_prompt, self.qna_model,
             temperature=0.3, 
-            max_tokens=3000 
+            max_tokens=3000,
+            cache_mode="qna",
+            image_data_uri=(file_info or {}).get("image_data_uri")
         )
-        
+        return self._parse_qna_response(api_response_content, file_info)
+
+    def _parse_qna_response(self, api_response_content: str, file_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         # Initialize output structure
         output = {
             "answer": api_response_content, # Default to full API response if parsing fails or not applicable
@@ -408,7 +476,7 @@ class AIInteractionHandler:
 
 
     
-    async def analyze_personal_symptoms(self, symptoms_description: str, history_context: str, user_region: Optional[str]) -> Dict[str, Any]:
+    def _build_symptom_prompts(self, symptoms_description: str, history_context: str, user_region: Optional[str]) -> Tuple[str, str]:
         system_prompt = (
         "You are 'sonar-reasoning-pro', an AI Medical Symptom Analyzer. Your goal is to provide helpful, general information, not a definitive diagnosis. "
         "If the user's symptom description is brief or vague, your PRIORITY is to ask 2-4 specific, clarifying follow-up questions to gather more details. "
@@ -429,7 +497,14 @@ class AIInteractionHandler:
             f"User's Stated Region: {user_region or 'Not Specified'}\n\n"
             f"User's Described Symptoms: {symptoms_description}\n\n"
             "Please provide your analysis ONLY as a single JSON object string with the specified keys. If the symptoms are too vague, prioritize asking follow-up questions within the JSON structure.")
-        raw_response = await self._call_perplexity_api(system_prompt, user_prompt, self.symptom_model, max_tokens=3000)
+        return system_prompt, user_prompt
+
+    async def analyze_personal_symptoms(self, symptoms_description: str, history_context: str, user_region: Optional[str]) -> Dict[str, Any]:
+        system_prompt, user_prompt = self._build_symptom_prompts(symptoms_description, history_context, user_region)
+        raw_response = await self._call_perplexity_api(system_prompt, user_prompt, self.symptom_model, max_tokens=3000, cache_mode="symptoms")
+        return self._parse_symptom_response(raw_response)
+
+    def _parse_symptom_response(self, raw_response: str) -> Dict[str, Any]:
         # Parsing logic will strip <think> then try to parse JSON
         parsed_output = self._parse_ai_response_to_structured_output(raw_response, "personal_symptoms", self.symptom_model)
         # Ensure the 'answer' field in the final dict gets the 'answer_markdown' from the parsed JSON
@@ -438,5 +513,72 @@ class AIInteractionHandler:
         elif isinstance(parsed_output.get("extracted_medical_info"), dict) and parsed_output.get("answer_markdown"): # If keys were parsed correctly
             parsed_output["answer"] = parsed_output.pop("answer_markdown") # Use specific key for main answer
         return parsed_output
-    
 
+    async def stream_chat_answer(
+        self, mode: str, message: str, history_context: str,
+        file_info: Optional[Dict[str, Any]] = None, user_region: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of get_general_qna_answer ("qna") / analyze_personal_symptoms ("personal_symptoms").
+        Yields {"event": "token", "data": <text delta>} while the model writes, then exactly one
+        {"event": "final", "data": <parsed output dict>} built by the same parsers as the blocking calls.
+        For personal_symptoms the tokens are the raw model output (JSON, possibly with <think> blocks);
+        clients should render the final event.
+        """
+        if mode == "qna":
+            system_prompt, user_prompt = self._build_qna_prompts(message, history_context, file_info)
+            stream = self._stream_perplexity_api(system_prompt, user_prompt, self.qna_model, max_tokens=3000, temperature=0.3, cache_mode="qna",
+                                                 image_data_uri=(file_info or {}).get("image_data_uri"))
+        elif mode == "personal_symptoms":
+            system_prompt, user_prompt = self._build_symptom_prompts(message, history_context, user_region)
+            stream = self._stream_perplexity_api(system_prompt, user_prompt, self.symptom_model, max_tokens=3000, cache_mode="symptoms")
+        else:
+            raise ValueError(f"Streaming is not supported for mode '{mode}'.")
+
+        chunks: List[str] = []
+        try:
+            async for delta in stream:
+                chunks.append(delta)
+                yield {"event": "token", "data": delta}
+            raw_response = "".join(chunks).strip()
+            print(f"Streamed response received (length: {len(raw_response)} chars).")
+        except StreamFailed as e_stream:
+            raw_response = str(e_stream)
+
+        if mode == "qna":
+            yield {"event": "final", "data": self._parse_qna_response(raw_response, file_info)}
+        else:
+            yield {"event": "final", "data": self._parse_symptom_response(raw_response)}
+
+    async def summarize_conversation(self, previous_summary: str, interactions: List[Dict[str, Any]], mode: str, max_chars: int) -> str:
+        """
+        Folds interactions into previous_summary, for the rolling conversation summary. Runs in the
+        batch lane so it never competes with a user waiting on an answer. Returns the summary text,
+        or an 'Error: ...' string like the other calls.
+        """
+        system_prompt = (
+            "You maintain a compact running summary of a user's conversation with a medical assistant. "
+            "Merge the new exchanges into the existing summary. Keep facts about the user (symptoms, conditions, "
+            "medications, allergies, tests, stated preferences) and the key advice given, with dates where known. "
+            "Drop pleasantries and generic information. Write plain-text bullet points starting with '- ', "
+            f"no headings, no markdown, no <think> blocks, at most {max_chars} characters in total."
+        )
+        exchanges = "\n".join(
+            f"[{(entry.get('timestamp') or '')[:10]}] User: {(entry.get('user_message') or 'File: ' + str(entry.get('file_processed', 'N/A')))[:600]}\n"
+            f"Assistant: {(entry.get('ai_response') or '')[:1200]}"
+            for entry in interactions
+        )
+        user_prompt = (
+            f"Conversation mode: {mode}\n\n"
+            f"Existing summary:\n{previous_summary or '(none yet)'}\n\n"
+            f"New exchanges (oldest first):\n{exchanges}\n\n"
+            "Return only the updated summary."
+        )
+        response = await self._call_perplexity_api(
+            system_prompt, user_prompt, self.summary_model,
+            max_tokens=max(128, max_chars // 3), temperature=0.1, priority=PRIORITY_BATCH
+        )
+        if response.startswith("Error:"):
+            return response
+        last_think_end = response.rfind("</think>")
+        return (response[last_think_end + len("</think>"):] if last_think_end != -1 else response).strip()
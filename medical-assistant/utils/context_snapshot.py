@@ -0,0 +1,188 @@
+# medical-assistant/utils/context_snapshot.py
+# Precomputed prompt context for one user and mode. MedicalMemory keeps one snapshot per
+# (user, mode) and updates it as interactions and summary changes arrive, so building the
+# history part of a prompt is a dictionary lookup instead of a reload-slice-join per request.
+# Each snapshot also indexes the mode's whole retained history (and, for "symptoms", the symptom
+# logs) so a question can pull in the most relevant older turns instead of just the latest ones;
+# the same index answers the history search API. Symptom-lexicon concept IDs are indexed next to the
+# words, so "head ache" finds a turn about migraine-like pain. Turns older than the recent ones are represented
+# by the rolling summary that utils/conversation_summarizer.py maintains in the background.
+import itertools
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .history_index import BM25Index
+from .symptom_lexicon import get_lexicon
+
+CONTEXT_RECENT_INTERACTIONS = 3   # Interactions shown as "recent snippets"
+CONTEXT_SNIPPET_CHARS = 100       # Characters kept from each side of an interaction
+RELEVANT_SNIPPET_CHARS = 300      # Retrieved turns were picked for relevance, so keep more of them
+RECENT_WHEN_RETRIEVING = 1        # With a query, only the latest turn is kept for continuity
+NO_CONTEXT_TEXT = "No significant context available for this mode."
+
+_versions = itertools.count(1)
+_versions_lock = threading.Lock()
+
+
+def _next_version() -> int:
+    with _versions_lock:
+        return next(_versions)
+
+
+def estimate_tokens(text: str) -> int:
+    # No tokenizer dependency: ~4 characters per token is close enough for English prompt budgeting
+    return (len(text) + 3) // 4
+
+
+def interaction_snippet(entry: Dict[str, Any]) -> str:
+    user_msg_snippet = (entry.get('user_message') or f"File: {entry.get('file_processed','N/A')}")[:CONTEXT_SNIPPET_CHARS]
+    ai_msg_snippet = (entry.get('ai_response') or "")[:CONTEXT_SNIPPET_CHARS]
+    return f"- User: {user_msg_snippet}... -> AI: {ai_msg_snippet}..."
+
+
+def relevant_snippet(entry: Dict[str, Any]) -> str:
+    user_msg_snippet = (entry.get('user_message') or f"File: {entry.get('file_processed','N/A')}")[:RELEVANT_SNIPPET_CHARS]
+    ai_msg_snippet = (entry.get('ai_response') or "")[:RELEVANT_SNIPPET_CHARS]
+    return f"- ({(entry.get('timestamp') or '')[:10]}) User: {user_msg_snippet}... -> AI: {ai_msg_snippet}..."
+
+
+def symptom_log_snippet(log_entry: Dict[str, Any]) -> str:
+    line = f"- (symptom log {log_entry.get('date', '')[:10]}) {', '.join(log_entry.get('symptoms', []))}"
+    return f"{line} - {log_entry['notes']}" if log_entry.get("notes") else line
+
+
+def medical_summary_lines(medical_summary: Dict[str, Any]) -> List[str]:
+    lines = []
+    if medical_summary.get("symptoms_log"):
+        s_logs = [f"{s['date'][:10]}: {', '.join(s['symptoms'])}" for s in medical_summary['symptoms_log'][-3:]]
+        if s_logs: lines.append(f"- Recent Symptom Logs: {'; '.join(s_logs)}")
+    if medical_summary.get("key_diagnoses_mentioned"):
+        lines.append(f"- Key Diagnoses Mentioned: {', '.join(medical_summary['key_diagnoses_mentioned'][-3:])}")
+    if medical_summary.get("allergies"):
+        lines.append(f"- Known Allergies: {', '.join(medical_summary['allergies'])}")
+    # No "analyzed_reports_info" in context from this app's memory
+    return lines
+
+
+class ContextSnapshot:
+    """The rolling summary of earlier turns, the recent-interaction snippets (and, for "symptoms", the
+    medical summary lines) for one user and mode. `version` changes on every update and is unique across snapshots, so callers can
+    cache anything derived from it. `storage_token` is the storage change token it was built at."""
+
+    def __init__(self, mode: str, storage_token: Optional[Any] = None, max_entries: int = 50):
+        self.mode = mode
+        self.storage_token = storage_token
+        self.max_entries = max_entries # Same bound as the stored history, so the index never outgrows it
+        self.include_summary = mode == "symptoms" # Q&A prompts don't carry the medical summary
+        self.recent_lines: Deque[str] = deque(maxlen=CONTEXT_RECENT_INTERACTIONS)
+        self.summary_lines: List[str] = []
+        self.rolling_summary = ""
+        self.index = BM25Index()
+        self._interaction_doc_ids: Deque[Tuple[str, int]] = deque()
+        self._interaction_entries: Dict[Tuple[str, int], Dict[str, Any]] = {} # For search results
+        self._symptom_log_doc_count = 0
+        self._next_seq = 0
+        self.version = _next_version()
+        self._rendered: Dict[Optional[int], str] = {} # max_tokens -> text, for the current version
+
+    @property
+    def is_empty(self) -> bool:
+        """No turns, rolling summary or medical summary content: the context is the same as any new user's."""
+        return not (len(self.index) or self.rolling_summary or self.summary_lines)
+
+    def _changed(self):
+        self.version = _next_version()
+        self._rendered.clear()
+
+    def add_interaction(self, entry: Dict[str, Any]):
+        self.recent_lines.append(interaction_snippet(entry))
+        doc_id = ("interaction", self._next_seq)
+        self._next_seq += 1
+        text = f"{entry.get('user_message') or ''} {entry.get('file_processed') or ''} {entry.get('ai_response') or ''}"
+        self.index.add(doc_id, text, relevant_snippet(entry), get_lexicon().concept_terms(text))
+        self._interaction_doc_ids.append(doc_id)
+        self._interaction_entries[doc_id] = entry
+        if len(self._interaction_doc_ids) > self.max_entries: # Mirrors the storage trimming the oldest entry
+            evicted_doc_id = self._interaction_doc_ids.popleft()
+            self.index.remove(evicted_doc_id)
+            del self._interaction_entries[evicted_doc_id]
+        self._changed()
+
+    def set_rolling_summary(self, text: str):
+        if text != self.rolling_summary:
+            self.rolling_summary = text
+            self._changed()
+
+    def set_medical_summary(self, medical_summary: Dict[str, Any]):
+        if not self.include_summary:
+            return
+        self.summary_lines = medical_summary_lines(medical_summary)
+        # The log is short (capped at 20) and rewritten as a whole, so re-index it as a whole
+        for index in range(self._symptom_log_doc_count):
+            self.index.remove(("symptom_log", index))
+        symptoms_log = medical_summary.get("symptoms_log") or []
+        for index, log_entry in enumerate(symptoms_log):
+            text = f"{' '.join(log_entry.get('symptoms', []))} {log_entry.get('notes', '')}"
+            self.index.add(("symptom_log", index), text, symptom_log_snippet(log_entry), get_lexicon().concept_terms(text))
+        self._symptom_log_doc_count = len(symptoms_log)
+        self._changed()
+
+    def _join(self, recent_lines: List[str], summary_lines: List[str], relevant_lines: Optional[List[str]] = None, rolling_summary: str = "") -> str:
+        context_parts = []
+        if rolling_summary:
+            context_parts.append("Summary of Earlier Conversation:")
+            context_parts.append(rolling_summary)
+        if recent_lines:
+            context_parts.append("Recent Q&A Snippets (User -> AI):" if self.mode == "qna" else f"Recent '{self.mode}' Interaction Snippets (User -> AI):")
+            context_parts.extend(recent_lines)
+        if relevant_lines:
+            context_parts.append("Earlier History Relevant to This Question (most relevant first):")
+            context_parts.extend(relevant_lines)
+        if self.include_summary:
+            context_parts.append("\nRelevant Medical Summary (from QnA/Symptom interactions):")
+            context_parts.extend(summary_lines)
+        return "\n".join(context_parts) if context_parts else NO_CONTEXT_TEXT
+
+    def relevant_lines(self, query: str, top_k: int) -> List[str]:
+        """Snippets of the past turns and symptom logs that best match query, best first. The turns
+        already shown as recent are skipped."""
+        recent_doc_ids = {self._interaction_doc_ids[-i] for i in range(1, min(RECENT_WHEN_RETRIEVING, len(self._interaction_doc_ids)) + 1)}
+        hits = self.index.search(query, top_k + len(recent_doc_ids), get_lexicon().concept_terms(query))
+        return [payload for _, doc_id, payload in hits if doc_id not in recent_doc_ids][:top_k]
+
+    def search_interactions(self, query: str) -> List[Tuple[float, Dict[str, Any]]]:
+        """Every stored interaction matching query as (score, entry), unordered. Symptom logs are not included."""
+        scores = self.index.scores(query, get_lexicon().concept_terms(query))
+        return [(score, self._interaction_entries[doc_id]) for doc_id, score in scores.items() if doc_id[0] == "interaction"]
+
+    def _trim(self, recent_lines: List[str], summary_lines: List[str], relevant_lines: List[str], max_tokens: Optional[int]) -> str:
+        # Drop order: least relevant retrieved turn, then oldest recent snippet, then the rolling
+        # summary, then summary lines in order, so known allergies are the last thing dropped.
+        rolling_summary = self.rolling_summary
+        text = self._join(recent_lines, summary_lines, relevant_lines, rolling_summary)
+        while max_tokens and estimate_tokens(text) > max_tokens and (relevant_lines or recent_lines or rolling_summary or summary_lines):
+            if relevant_lines:
+                relevant_lines.pop()
+            elif recent_lines:
+                recent_lines.pop(0)
+            elif rolling_summary:
+                rolling_summary = ""
+            else:
+                summary_lines.pop(0)
+            text = self._join(recent_lines, summary_lines, relevant_lines, rolling_summary)
+        return text
+
+    def render(self, max_tokens: Optional[int] = None, query: Optional[str] = None, top_k: int = 4) -> str:
+        """The context text, trimmed to roughly max_tokens. With a query, the latest turn plus the
+        top_k most relevant earlier turns/symptom logs replace the plain "last few turns" view;
+        if nothing in the history matches, the plain view is used."""
+        if query and top_k > 0:
+            relevant_lines = self.relevant_lines(query, top_k)
+            if relevant_lines:
+                recent_lines = list(self.recent_lines)[-RECENT_WHEN_RETRIEVING:]
+                return self._trim(recent_lines, list(self.summary_lines), relevant_lines, max_tokens)
+        text = self._rendered.get(max_tokens)
+        if text is None:
+            text = self._rendered[max_tokens] = self._trim(list(self.recent_lines), list(self.summary_lines), [], max_tokens)
+        return text
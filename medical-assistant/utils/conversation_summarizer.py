@@ -0,0 +1,125 @@
+# medical-assistant/utils/conversation_summarizer.py
+# Keeps a compact rolling summary of each user's older turns per mode, so prompts carry the few
+# recent turns plus this summary instead of ever more raw history. Updates run as background tasks
+# after an interaction is recorded: once enough turns have left the "recent" window they are folded
+# into the summary by a batch-priority LLM call, or extractively if that call fails.
+import asyncio
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from shared_services.blocking_io import run_io
+from ..config import settings
+from .ai_handler import AIInteractionHandler
+from .context_snapshot import CONTEXT_RECENT_INTERACTIONS
+from .medical_memory import ConversationMode, MedicalMemory
+
+MAX_CONCURRENT_SUMMARIES = 2 # Summaries in flight per process; the scheduler's batch lane bounds them further
+
+
+def _first_sentence(text: Optional[str], max_chars: int) -> str:
+    text = re.sub(r"\s+", " ", re.sub(r"[#*_`>|]+", "", text or "")).strip() # Drop markdown markup
+    match = re.match(r"(.+?[.!?])(\s|$)", text)
+    sentence = match.group(1) if match else text
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars - 3].rstrip() + "..."
+
+
+def _clip_lines(text: str, max_chars: int) -> str:
+    # Cut at a line boundary so a bullet is never left half-written
+    if len(text) <= max_chars:
+        return text
+    clipped = text[:max_chars]
+    return clipped[:clipped.rfind("\n")] if "\n" in clipped else clipped
+
+
+def extractive_summary(previous_summary: str, interactions: List[Dict[str, Any]], max_chars: int) -> str:
+    """Fallback when the LLM is unavailable: one line per turn (the question and the first sentence of
+    the answer) appended to the previous summary, dropping its oldest lines to fit max_chars."""
+    lines = [line for line in (previous_summary or "").splitlines() if line.strip()]
+    for entry in interactions:
+        question = _first_sentence(entry.get("user_message") or f"File: {entry.get('file_processed', 'N/A')}", 160)
+        answer = _first_sentence(entry.get("ai_response"), 200)
+        lines.append(f"- ({(entry.get('timestamp') or '')[:10]}) Asked: {question} Answer: {answer}")
+    while len(lines) > 1 and len("\n".join(lines)) > max_chars:
+        lines.pop(0)
+    return _clip_lines("\n".join(lines), max_chars)
+
+
+class ConversationSummarizer:
+    """Schedules and runs rolling-summary updates. schedule() is called on the event loop after an
+    interaction is stored; at most one update per (user, mode) runs at a time, and writes arriving
+    during an update trigger one more pass afterwards."""
+
+    def __init__(self, memory: MedicalMemory, ai_handler: AIInteractionHandler, batch_turns: Optional[int] = None,
+                 max_chars: Optional[int] = None, enabled: Optional[bool] = None):
+        self.memory = memory
+        self.ai_handler = ai_handler
+        self.batch_turns = max(1, batch_turns or settings.MEDICAL_MEMORY_SUMMARY_BATCH_TURNS)
+        self.max_chars = max_chars or settings.MEDICAL_MEMORY_SUMMARY_MAX_CHARS
+        self.enabled = settings.MEDICAL_MEMORY_SUMMARY_ENABLED if enabled is None else enabled
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._rerun: Set[Tuple[str, str]] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None # Created on first use, inside the running loop
+
+    def schedule(self, user_id: str, mode: ConversationMode):
+        if not self.enabled:
+            return
+        key = (user_id, mode)
+        if key in self._tasks:
+            self._rerun.add(key)
+            return
+        self._tasks[key] = asyncio.get_running_loop().create_task(self._run(key))
+
+    async def _run(self, key: Tuple[str, str]):
+        try:
+            while True:
+                self._rerun.discard(key)
+                try:
+                    await self.update(*key)
+                except Exception as e:
+                    print(f"CONVERSATION_SUMMARIZER: WARNING - Summary update failed for user '{key[0]}', mode '{key[1]}': {e.__class__.__name__} - {e}")
+                if key not in self._rerun:
+                    break
+        finally:
+            self._tasks.pop(key, None)
+
+    async def update(self, user_id: str, mode: ConversationMode) -> bool:
+        """Folds the turns that left the recent window into the summary once at least batch_turns of
+        them are waiting. Returns whether a new summary was stored."""
+        history = await run_io(self.memory.get_conversation_history, mode, user_id=user_id)
+        state = await run_io(self.memory.get_rolling_summary, mode, user_id=user_id)
+        covered_until_id = state.get("covered_until_id")
+        older = history[:-CONTEXT_RECENT_INTERACTIONS]
+        # Turns after the last folded one; if that one was already trimmed from storage, all are new
+        start = next((index + 1 for index, entry in enumerate(history) if entry.get("id") == covered_until_id), 0) if covered_until_id else 0
+        pending = older[start:]
+        if len(pending) < self.batch_turns:
+            return False
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_SUMMARIES)
+        async with self._semaphore:
+            text = await self.ai_handler.summarize_conversation(state.get("text", ""), pending, mode, self.max_chars)
+        method = "llm"
+        if not text or text.startswith("Error:"):
+            print(f"CONVERSATION_SUMMARIZER: LLM summary unavailable ({text[:80] or 'empty response'}); using extractive summary.")
+            text, method = extractive_summary(state.get("text", ""), pending, self.max_chars), "extractive"
+
+        new_state = {
+            "text": _clip_lines(text, self.max_chars),
+            "covered_until_id": pending[-1].get("id"),
+            "turns_covered": state.get("turns_covered", 0) + len(pending),
+            "method": method,
+            "updated_at": datetime.utcnow().isoformat() + "Z",
+        }
+        stored = await run_io(self.memory.set_rolling_summary, mode, new_state, covered_until_id, user_id=user_id)
+        if stored:
+            print(f"CONVERSATION_SUMMARIZER: Folded {len(pending)} turns into the '{mode}' summary for user '{user_id}' ({method}).")
+        return stored
+
+    async def shutdown(self):
+        """Cancels pending updates; turns not yet folded in are picked up after the next interaction."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,125 @@
+# medical-assistant/utils/history_index.py
+# Small in-process BM25 index used to pick the past interactions (and symptom logs) most relevant
+# to the current question. Documents are added and removed one at a time, so keeping it in step
+# with a user's history costs a few dictionary updates per message; scoring only touches the
+# postings of the query's terms. Also backs the history search API, which needs full rankings and
+# highlighted snippets.
+import heapq
+import html
+import math
+import re
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+WORD_PATTERN = re.compile(r"[a-z0-9]+", re.IGNORECASE) # Same tokens, matched on the original text for highlighting
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be been before being but by can could did do does doing
+for from had has have having he her here hers him his how i if in into is it its itself just me more most my
+no not now of on once only or other our out over own same she should so some such than that the their them
+then there these they this those through to too under until up very was we were what when where which while
+who whom why will with would you your yours please tell know like get got feel feeling really much
+""".split())
+
+
+def fold_plural(token: str) -> str:
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1] # Crude plural folding: "headaches" matches "headache"
+    return token
+
+
+def normalize_token(token: str) -> Optional[str]:
+    """The index term for one lower-cased token, or None if it isn't indexed."""
+    if len(token) < 2 or token in STOPWORDS:
+        return None
+    return fold_plural(token)
+
+
+def tokenize(text: str) -> List[str]:
+    terms = []
+    for token in TOKEN_PATTERN.findall((text or "").lower()):
+        term = normalize_token(token)
+        if term is not None:
+            terms.append(term)
+    return terms
+
+
+def highlight(text: str, query: str, max_chars: int = 200) -> str:
+    """An HTML-escaped excerpt of text of about max_chars, centred on the first query term it
+    contains, with every matching word wrapped in <mark>. Plain excerpt if nothing matches."""
+    text = text or ""
+    query_terms = set(tokenize(query))
+    matches = [m for m in WORD_PATTERN.finditer(text) if normalize_token(m.group().lower()) in query_terms]
+    start = 0
+    if matches and len(text) > max_chars:
+        start = max(0, min(matches[0].start() - max_chars // 4, len(text) - max_chars))
+    end = min(len(text), start + max_chars)
+    parts, position = [], start
+    for match in matches:
+        if match.start() < start or match.end() > end:
+            continue
+        parts.append(html.escape(text[position:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group())}</mark>")
+        position = match.end()
+    parts.append(html.escape(text[position:end]))
+    return ("..." if start > 0 else "") + "".join(parts) + ("..." if end < len(text) else "")
+
+
+class BM25Index:
+    """Okapi BM25 over short documents. doc_id is any hashable; payload is returned with results.
+    extra_terms are index terms used as-is next to the text's words (e.g. symptom concept IDs)."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.postings: Dict[str, Dict[Hashable, int]] = {}              # term -> {doc_id: term frequency}
+        self.documents: Dict[Hashable, Tuple[int, Dict[str, int], Any]] = {} # doc_id -> (length, term frequencies, payload)
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, doc_id: Hashable, text: str, payload: Any = None, extra_terms: Iterable[str] = ()):
+        if doc_id in self.documents:
+            self.remove(doc_id)
+        term_frequencies: Dict[str, int] = {}
+        terms = tokenize(text) + list(extra_terms)
+        for term in terms:
+            term_frequencies[term] = term_frequencies.get(term, 0) + 1
+        for term, frequency in term_frequencies.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.documents[doc_id] = (len(terms), term_frequencies, payload)
+        self.total_length += len(terms)
+
+    def remove(self, doc_id: Hashable):
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return
+        length, term_frequencies, _ = document
+        for term in term_frequencies:
+            term_postings = self.postings.get(term)
+            if term_postings is not None:
+                term_postings.pop(doc_id, None)
+                if not term_postings:
+                    del self.postings[term]
+        self.total_length -= length
+
+    def scores(self, query: str, extra_terms: Iterable[str] = ()) -> Dict[Hashable, float]:
+        """BM25 score of every document sharing at least one term with the query."""
+        if not self.documents:
+            return {}
+        document_count = len(self.documents)
+        average_length = self.total_length / document_count or 1.0
+        scores: Dict[Hashable, float] = {}
+        for term in set(tokenize(query)).union(extra_terms):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1 + (document_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for doc_id, frequency in term_postings.items():
+                length_norm = 1 - self.b + self.b * self.documents[doc_id][0] / average_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return scores
+
+    def search(self, query: str, top_k: int = 5, extra_terms: Iterable[str] = ()) -> List[Tuple[float, Hashable, Any]]:
+        """Best-scoring (score, doc_id, payload) first; documents sharing no term with the query are left out."""
+        ranked = heapq.nlargest(top_k, self.scores(query, extra_terms).items(), key=lambda item: item[1])
+        return [(score, doc_id, self.documents[doc_id][2]) for doc_id, score in ranked]
@@ -1,122 +1,140 @@
 # medical-assistant/utils/medical_memory.py
-import json
-import os
-from datetime import datetime
-from typing import List, Dict, Any, Literal, Optional, get_args
+import heapq
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Iterable, List, Dict, Any, Literal, Optional, Set, Tuple, get_args
+
+from ..config import settings
+from .context_snapshot import ContextSnapshot
+from .memory_storage import MemoryStorage, WriteBehindStorage, create_storage
+from .symptom_lexicon import get_lexicon
 
 # Conversation Modes for this main application - "report" is REMOVED
 ConversationMode = Literal["qna", "symptoms"]
 
-DATA_DIR_RELATIVE_TO_PROJECT_ROOT = os.path.join('medical-assistant', 'data')
-CONVERSATIONS_FILE = os.path.join(DATA_DIR_RELATIVE_TO_PROJECT_ROOT, 'conversations_by_mode.json')
-MEDICAL_SUMMARY_FILE = os.path.join(DATA_DIR_RELATIVE_TO_PROJECT_ROOT, 'medical_summary.json')
+SINGLE_USER_ID = "default_persistent_user" # Used when a request carries no user identity
+# Interactions kept per user and mode; older ones are deleted from storage and live on only in the
+# rolling summary. Every context snapshot indexes this many turns in memory, so raising it grows each
+# cached user's index and the cost of rebuilding it from storage in proportion.
+MAX_HISTORY_ENTRIES_PER_MODE = 50
+USER_LOCK_STRIPES = 64 # Users hashed onto this many locks; two users rarely share one
+
+# User ids become file names (json backend), so keep them to a safe character set
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+def is_valid_user_id(user_id: str) -> bool:
+    return bool(USER_ID_PATTERN.match(user_id)) and user_id not in (".", "..")
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parses stored/request ISO timestamps ("...Z" or with an offset) as aware UTC; None if invalid."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+HistoryPosition = Tuple[datetime, str] # (timestamp, id): orders interactions for cursors
 
-SINGLE_USER_ID = "default_persistent_user"
+def history_position(entry: Dict[str, Any]) -> HistoryPosition:
+    return (parse_timestamp(entry.get("timestamp")) or datetime.min.replace(tzinfo=timezone.utc), str(entry.get("id") or ""))
 
 class MedicalMemory:
-    def __init__(self):
-        self.user_id = SINGLE_USER_ID
-        if not os.path.exists(DATA_DIR_RELATIVE_TO_PROJECT_ROOT):
-            os.makedirs(DATA_DIR_RELATIVE_TO_PROJECT_ROOT, exist_ok=True)
-        self._ensure_files_exist()
-
-    def _ensure_files_exist(self):
-        # Default structure now only includes qna and symptoms
-        default_conversations_structure = {
-            self.user_id: {
-                "qna": [],
-                "symptoms": []
-            }
-        }
-        if not os.path.exists(CONVERSATIONS_FILE):
-            with open(CONVERSATIONS_FILE, 'w') as f:
-                json.dump(default_conversations_structure, f, indent=4)
-        else: 
-            try:
-                with open(CONVERSATIONS_FILE, 'r+') as f:
-                    data = json.load(f)
-                    if self.user_id not in data: 
-                        data[self.user_id] = default_conversations_structure[self.user_id]
-                    for mode_key in get_args(ConversationMode): # Use Literal values
-                        if mode_key not in data[self.user_id]: 
-                            data[self.user_id][mode_key] = []
-                    if "report" in data.get(self.user_id, {}): # Clean up old "report" key if present
-                        del data[self.user_id]["report"]
-                    f.seek(0); json.dump(data, f, indent=4); f.truncate()
-            except json.JSONDecodeError:
-                with open(CONVERSATIONS_FILE, 'w') as f: 
-                    json.dump(default_conversations_structure, f, indent=4)
-
-        # Medical summary no longer stores report-specific analysis summaries from this app
-        default_medical_summary = {
-            self.user_id: {
-                "symptoms_log": [], 
-                # "analyzed_reports_info": [], # This key is fully removed
-                "key_diagnoses_mentioned": [], # From symptom analysis
-                "allergies": [], 
-                "medications_log": []
-            }
-        }
-        if not os.path.exists(MEDICAL_SUMMARY_FILE):
-            with open(MEDICAL_SUMMARY_FILE, 'w') as f:
-                json.dump(default_medical_summary, f, indent=4)
-        else: 
-            try:
-                with open(MEDICAL_SUMMARY_FILE, 'r+') as f:
-                    data = json.load(f)
-                    if self.user_id not in data: 
-                        data[self.user_id] = default_medical_summary[self.user_id]
-                    for key_summary in default_medical_summary[self.user_id]:
-                        if key_summary not in data[self.user_id]: 
-                            data[self.user_id][key_summary] = default_medical_summary[self.user_id][key_summary]
-                    if "analyzed_reports_info" in data.get(self.user_id, {}): # Clean up old report info key
-                        del data[self.user_id]["analyzed_reports_info"]
-                    f.seek(0); json.dump(data, f, indent=4); f.truncate()
-            except json.JSONDecodeError:
-                 with open(MEDICAL_SUMMARY_FILE, 'w') as f: 
-                    json.dump(default_medical_summary, f, indent=4)
-
-    def _load_conversations(self) -> Dict[str, Any]:
-        try:
-            with open(CONVERSATIONS_FILE, 'r') as f: 
-                data = json.load(f)
-                # Ensure basic structure for current user and valid modes
-                if self.user_id not in data: data[self.user_id] = {}
-                for mode_key in get_args(ConversationMode):
-                    if mode_key not in data[self.user_id]: data[self.user_id][mode_key] = []
-                return data
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {self.user_id: {"qna": [], "symptoms": []}}
-
-    def _save_conversations(self, data: Dict[str, Any]):
-        with open(CONVERSATIONS_FILE, 'w') as f: json.dump(data, f, indent=4)
-
-    def _load_medical_summary(self) -> Dict[str, Any]:
-        try:
-            with open(MEDICAL_SUMMARY_FILE, 'r') as f: 
-                data = json.load(f)
-                # Ensure basic structure
-                if self.user_id not in data: data[self.user_id] = {}
-                for key_summary in ["symptoms_log", "key_diagnoses_mentioned", "allergies", "medications_log"]:
-                    if key_summary not in data[self.user_id]: data[self.user_id][key_summary] = []
-                return data
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {self.user_id: {"symptoms_log": [], "key_diagnoses_mentioned": [], "allergies": [], "medications_log": []}}
-
-    def _save_medical_summary(self, data: Dict[str, Any]):
-        with open(MEDICAL_SUMMARY_FILE, 'w') as f: json.dump(data, f, indent=4)
-
-    def add_to_conversation_history(self, mode: ConversationMode, user_message: Optional[str], ai_response: str, file_name: Optional[str] = None, interaction_id: Optional[str]=None):
+    def __init__(self, backend: Optional[str] = None):
+        self.user_id = SINGLE_USER_ID # Default for calls that don't pass user_id
+        # "sqlite" (default) or "json"; see utils/memory_storage.py
+        self.backend = backend or settings.MEDICAL_MEMORY_BACKEND
+        self.storage: MemoryStorage = create_storage(self.backend, settings.MEDICAL_MEMORY_SQLITE_SHARDS)
+        if settings.MEDICAL_MEMORY_WRITE_BEHIND:
+            # Serve reads from memory and persist writes in batches off the request path
+            self.storage = WriteBehindStorage(self.storage, MAX_HISTORY_ENTRIES_PER_MODE, settings.MEDICAL_MEMORY_FLUSH_DELAY_SECONDS, settings.MEDICAL_MEMORY_CACHED_USERS)
+            self.storage.preload(self.user_id)
+        # Prompt context per (user_id, mode), kept current by the write methods below
+        self._snapshots: "OrderedDict[Tuple[str, str], ContextSnapshot]" = OrderedDict()
+        self._snapshots_lock = threading.Lock() # Guards the dict only; never held across storage I/O
+        # Per-user locks (striped, so memory stays bounded however many users there are) make a user's
+        # storage write and snapshot update atomic without one user's disk I/O stalling everyone else
+        self._user_locks = [threading.Lock() for _ in range(USER_LOCK_STRIPES)]
+        self.max_snapshots = 2 * settings.MEDICAL_MEMORY_CACHED_USERS
+
+    def _lock_stripe(self, user_id: str) -> int:
+        return zlib.crc32(user_id.encode("utf-8")) % len(self._user_locks)
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        return self._user_locks[self._lock_stripe(user_id)]
+
+    def _users_locked(self, user_ids: Iterable[str]) -> ExitStack:
+        # Several users' locks, taken in stripe order so two bulk operations can't deadlock
+        stack = ExitStack()
+        for stripe in sorted({self._lock_stripe(user_id) for user_id in user_ids}):
+            stack.enter_context(self._user_locks[stripe])
+        return stack
+
+    def _cached_snapshot(self, user_id: str, mode: str) -> Optional[ContextSnapshot]:
+        with self._snapshots_lock:
+            return self._snapshots.get((user_id, mode))
+
+    def _drop_snapshots(self, user_id: str):
+        with self._snapshots_lock:
+            for mode in get_args(ConversationMode):
+                self._snapshots.pop((user_id, mode), None) # Rebuilt from storage on next use
+
+    def _context_snapshot(self, mode: ConversationMode, user_id: str) -> ContextSnapshot:
+        # Caller holds the user's lock. Rebuilds only when missing or when the storage says another
+        # process changed this user's data since the snapshot was built; the rebuild reads storage
+        # without the shared dict lock, which is taken only to look up and swap in the snapshot.
+        token = self.storage.change_token(user_id)
+        key = (user_id, mode)
+        with self._snapshots_lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and snapshot.storage_token == token:
+                self._snapshots.move_to_end(key)
+                return snapshot
+        snapshot = ContextSnapshot(mode, token, MAX_HISTORY_ENTRIES_PER_MODE)
+        for entry in self.storage.get_history(user_id, mode): # Whole retained history, for the relevance index
+            snapshot.add_interaction(entry)
+        snapshot.set_medical_summary(self.storage.get_medical_summary(user_id))
+        snapshot.set_rolling_summary((self.storage.get_rolling_summaries(user_id).get(mode) or {}).get("text") or "")
+        with self._snapshots_lock:
+            self._snapshots[key] = snapshot
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def get_context_version(self, mode: ConversationMode, user_id: Optional[str] = None) -> int:
+        """Changes whenever the context returned by get_context_for_ai would change."""
+        user_id = user_id or self.user_id
+        with self._user_lock(user_id):
+            return self._context_snapshot(mode, user_id).version
+
+    def flush(self):
+        if isinstance(self.storage, WriteBehindStorage):
+            self.storage.flush()
+
+    def close(self):
+        if isinstance(self.storage, WriteBehindStorage):
+            self.storage.close()
+
+    def add_to_conversation_history(self, mode: ConversationMode, user_message: Optional[str], ai_response: str, file_name: Optional[str] = None, interaction_id: Optional[str]=None, user_id: Optional[str] = None):
         if mode not in get_args(ConversationMode): # Runtime check just in case
             print(f"Warning: Attempted to add history for invalid mode '{mode}'. Skipping.")
             return
 
-        all_convos = self._load_conversations()
-        if self.user_id not in all_convos: all_convos[self.user_id] = {"qna": [], "symptoms": []}
-        if mode not in all_convos[self.user_id]: all_convos[self.user_id][mode] = []
-            
-        user_mode_history = all_convos[self.user_id][mode]
-        
+        interaction = self._new_interaction(user_message, ai_response, file_name, interaction_id)
+        user_id = user_id or self.user_id
+        with self._user_lock(user_id):
+            self.storage.append_interaction(user_id, mode, interaction, MAX_HISTORY_ENTRIES_PER_MODE)
+            snapshot = self._cached_snapshot(user_id, mode)
+            if snapshot is not None:
+                snapshot.add_interaction(interaction)
+
+    @staticmethod
+    def _new_interaction(user_message: Optional[str], ai_response: str, file_name: Optional[str] = None, interaction_id: Optional[str] = None) -> Dict[str, Any]:
         interaction = {
             "id": interaction_id or datetime.utcnow().isoformat() + "Z",
             "timestamp": datetime.utcnow().isoformat() + "Z",
@@ -124,97 +142,216 @@ class MedicalMemory:
             "ai_response": ai_response, # Storing the main answer string for simplicity
         }
         if file_name: interaction["file_processed"] = file_name
-        user_mode_history.append(interaction)
-        
-        all_convos[self.user_id][mode] = user_mode_history[-50:]
-        self._save_conversations(all_convos)
+        return interaction
 
-    def get_conversation_history(self, mode: ConversationMode) -> List[Dict[str, Any]]:
+    def add_interactions_batch(self, mode: ConversationMode, entries: List[Dict[str, Any]], medical_info_updates: Optional[List[Dict[str, Any]]] = None, user_id: Optional[str] = None):
+        """Records several interactions (dicts of add_to_conversation_history's arguments) and medical
+        summary updates as one storage batch with a single merged summary update."""
+        if mode not in get_args(ConversationMode):
+            print(f"Warning: Attempted to add history for invalid mode '{mode}'. Skipping.")
+            return
+        user_id = user_id or self.user_id
+        interactions = [self._new_interaction(e.get("user_message"), e["ai_response"], e.get("file_name"), e.get("interaction_id")) for e in entries]
+        with self._user_lock(user_id):
+            changes: List[Tuple] = [("append", user_id, mode, interaction, MAX_HISTORY_ENTRIES_PER_MODE) for interaction in interactions]
+            if medical_info_updates:
+                now = datetime.utcnow().isoformat() + "Z"
+                def merge_all(user_summary: Dict[str, Any]):
+                    for medical_info_dict in medical_info_updates:
+                        self._merge_medical_info(user_summary, medical_info_dict, now)
+                changes.append(("summary_update", user_id, merge_all))
+            self.storage.apply_changes(changes)
+            snapshot = self._cached_snapshot(user_id, mode)
+            if snapshot is not None:
+                for interaction in interactions:
+                    snapshot.add_interaction(interaction)
+            if medical_info_updates:
+                self._set_snapshot_summaries(user_id, self.storage.get_medical_summary(user_id))
+
+    def get_conversation_history(self, mode: ConversationMode, limit: Optional[int] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
         if mode not in get_args(ConversationMode): return [] # Return empty for invalid modes
-        all_convos = self._load_conversations()
-        return all_convos.get(self.user_id, {}).get(mode, [])
+        return self.storage.get_history(user_id or self.user_id, mode, limit)
+
+    def get_conversation_page(self, mode: ConversationMode, limit: Optional[int] = None, before: Optional[HistoryPosition] = None,
+                              since: Optional[datetime] = None, user_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], bool]:
+        """Pages backwards from the newest interaction: entries after `since` and older than the
+        `before` position, newest `limit` of them (returned oldest-first), plus whether older ones remain."""
+        history = self.get_conversation_history(mode, user_id=user_id)
+        if since is not None:
+            history = [entry for entry in history if history_position(entry)[0] > since]
+        if before is not None:
+            history = [entry for entry in history if history_position(entry) < before]
+        if limit and len(history) > limit:
+            return history[-limit:], True
+        return history, False
+
+    def get_history_overview(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Both modes' histories and the medical summary, read together in one call."""
+        return {"conversation_summaries": self.get_all_conversations_summary(user_id), "medical_summary": self.get_medical_summary(user_id)}
 
-    def get_all_conversations_summary(self) -> Dict[str, List[Dict[str,Any]]]:
-        all_convos = self._load_conversations()
-        user_convos = all_convos.get(self.user_id, {})
+    def search_history(self, query: str, modes: Optional[List[ConversationMode]] = None, limit: int = 20, offset: int = 0,
+                       user_id: Optional[str] = None) -> Tuple[int, List[Tuple[str, float, Dict[str, Any]]]]:
+        """Ranks the user's stored interactions against query using the per-mode indexes kept by the
+        context snapshots (no storage scan unless a snapshot has to be rebuilt). Only the retained
+        history is searchable: the newest MAX_HISTORY_ENTRIES_PER_MODE interactions per mode. Returns the total
+        number of matches and the (mode, score, entry) hits in [offset, offset + limit), best first,
+        newest first on ties."""
+        user_id = user_id or self.user_id
+        hits: List[Tuple[str, float, Dict[str, Any]]] = []
+        with self._user_lock(user_id):
+            for mode in modes or get_args(ConversationMode):
+                hits.extend((mode, score, entry) for score, entry in self._context_snapshot(mode, user_id).search_interactions(query))
+        # Only the requested page needs ordering; stored timestamps share one ISO format, so they compare as strings
+        ranked = heapq.nlargest(offset + limit, hits, key=lambda hit: (hit[1], hit[2].get("timestamp") or ""))
+        return len(hits), ranked[offset:]
+
+    def iter_user_ids(self) -> List[str]:
+        return self.storage.iter_user_ids()
+
+    def import_records(self, records: List[Tuple], clear_first: Optional[Set[str]] = None) -> Dict[str, int]:
+        """Applies a batch of bulk-import records in order: ("interaction", user_id, mode, interaction)
+        or ("medical_summary", user_id, summary). Users in clear_first are cleared before anything else.
+        Interactions whose id is already stored for that user and mode are skipped, so re-running an
+        import is harmless. The batch goes to storage as one apply_changes call."""
+        counts = {"interactions": 0, "duplicates_skipped": 0, "medical_summaries": 0}
+        clear_first = clear_first or set()
+        changes: List[Tuple] = [("clear", user_id) for user_id in sorted(clear_first)]
+        known_ids: Dict[Tuple[str, str], Set[str]] = {}
+        with self._users_locked(set(clear_first) | {record[1] for record in records}):
+            for record in records:
+                user_id = record[1]
+                if record[0] == "interaction":
+                    mode, interaction = record[2], record[3]
+                    ids = known_ids.get((user_id, mode))
+                    if ids is None:
+                        stored = [] if user_id in clear_first else self.storage.get_history(user_id, mode)
+                        ids = known_ids[(user_id, mode)] = {entry.get("id") for entry in stored}
+                    if interaction["id"] in ids:
+                        counts["duplicates_skipped"] += 1
+                        continue
+                    ids.add(interaction["id"])
+                    changes.append(("append", user_id, mode, interaction, MAX_HISTORY_ENTRIES_PER_MODE))
+                    counts["interactions"] += 1
+                elif record[0] == "medical_summary":
+                    changes.append(("summary", user_id, record[2]))
+                    counts["medical_summaries"] += 1
+            self.storage.apply_changes(changes)
+            for user_id in {change[1] for change in changes}:
+                self._drop_snapshots(user_id)
+        self.flush() # Keep the write-behind queue from growing across a large import
+        return counts
+
+    def get_all_conversations_summary(self, user_id: Optional[str] = None) -> Dict[str, List[Dict[str,Any]]]:
+        user_id = user_id or self.user_id
         return {
-            "qna": user_convos.get("qna", []),
-            "symptoms": user_convos.get("symptoms", [])
+            "qna": self.storage.get_history(user_id, "qna"),
+            "symptoms": self.storage.get_history(user_id, "symptoms")
             # "report" key is no longer included
         }
 
-    def update_medical_summary(self, medical_info_dict: Dict[str, Any]):
+    def update_medical_summary(self, medical_info_dict: Dict[str, Any], user_id: Optional[str] = None):
         # This function is now only called by "symptoms" mode analysis
-        summary_data = self._load_medical_summary()
-        user_summary = summary_data.get(self.user_id, {})
-        
-        if not user_summary: 
-            user_summary = {"symptoms_log": [], "key_diagnoses_mentioned": [], "allergies": [], "medications_log": []}
+        user_id = user_id or self.user_id
+        # Timestamp computed once, so replaying the update through write-behind and then storage is idempotent
+        now = datetime.utcnow().isoformat() + "Z"
+        with self._user_lock(user_id): # Merged by the storage, so the summarizer's and other workers' updates aren't overwritten
+            user_summary = self.storage.update_medical_summary(user_id, lambda summary: self._merge_medical_info(summary, medical_info_dict, now))
+            self._set_snapshot_summaries(user_id, user_summary)
 
+    @staticmethod
+    def _merge_medical_info(user_summary: Dict[str, Any], medical_info_dict: Dict[str, Any], now: Optional[str] = None):
+        # Symptoms and diagnoses are compared by symptom-lexicon concept key, so "Head ache" and
+        # "headaches" are one symptom and "flu" / "Influenza" one diagnosis
+        lexicon = get_lexicon()
         if "current_symptoms_list" in medical_info_dict:
-            log_entry = {"date": datetime.utcnow().isoformat() + "Z", "symptoms": medical_info_dict["current_symptoms_list"]}
+            symptoms, symptom_keys = [], set()
+            for symptom in medical_info_dict["current_symptoms_list"]:
+                symptom_key = lexicon.concept_key(symptom)
+                if symptom_key not in symptom_keys: # First spelling wins
+                    symptom_keys.add(symptom_key)
+                    symptoms.append(symptom)
+            log_entry = {"date": now or datetime.utcnow().isoformat() + "Z", "symptoms": symptoms}
+            concept_ids = sorted({concept_id for symptom in symptoms for concept_id in lexicon.concept_ids(symptom)})
+            if concept_ids:
+                log_entry["concept_ids"] = concept_ids
             if "potential_conditions_discussed_list" in medical_info_dict:
                 log_entry["notes"] = f"Potential relation to: {', '.join(medical_info_dict['potential_conditions_discussed_list'])}"
-            user_summary.setdefault("symptoms_log", []).append(log_entry)
-            user_summary["symptoms_log"] = user_summary["symptoms_log"][-20:]
+            symptoms_log = user_summary.setdefault("symptoms_log", [])
+            previous = symptoms_log[-1] if symptoms_log else None
+            # The same complaint logged again on the same day replaces the earlier entry instead of crowding the log
+            if previous and previous.get("date", "")[:10] == log_entry["date"][:10] and \
+                    {lexicon.concept_key(symptom) for symptom in previous.get("symptoms", [])} == symptom_keys:
+                symptoms_log[-1] = log_entry
+            else:
+                symptoms_log.append(log_entry)
+            user_summary["symptoms_log"] = symptoms_log[-20:]
 
         if "new_diagnoses_mentioned_list" in medical_info_dict:
             current_diagnoses = user_summary.setdefault("key_diagnoses_mentioned", [])
+            known_keys = {lexicon.concept_key(diag) for diag in current_diagnoses}
             for diag in medical_info_dict["new_diagnoses_mentioned_list"]:
-                if diag not in current_diagnoses: current_diagnoses.append(diag)
+                diag_key = lexicon.concept_key(diag)
+                if diag_key not in known_keys:
+                    current_diagnoses.append(diag)
+                    known_keys.add(diag_key)
         
         # No longer handles "reports_analyzed_info_item"
-        
-        summary_data[self.user_id] = user_summary
-        self._save_medical_summary(summary_data)
 
-    def get_medical_summary(self) -> Dict[str, Any]:
-        summary_data = self._load_medical_summary()
-        return summary_data.get(self.user_id, {})
+    def _set_snapshot_summaries(self, user_id: str, user_summary: Dict[str, Any]):
+        # Caller holds the user's lock
+        for mode in get_args(ConversationMode):
+            snapshot = self._cached_snapshot(user_id, mode)
+            if snapshot is not None:
+                snapshot.set_medical_summary(user_summary)
 
-    def clear_all_user_data(self):
-        self._save_conversations({self.user_id: {"qna": [], "symptoms": []}})
-        self._save_medical_summary({
-            self.user_id: {"symptoms_log": [], "key_diagnoses_mentioned": [], "allergies": [], "medications_log": []}
-        })
-        print(f"All main app data cleared for user: {self.user_id} (QnA and Symptoms only)")
+    def get_rolling_summary(self, mode: ConversationMode, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """The rolling summary state for a mode: {"text", "covered_until_id", "turns_covered", "method", "updated_at"}; {} if none yet."""
+        return dict(self.storage.get_rolling_summaries(user_id or self.user_id).get(mode) or {})
 
-    def get_context_for_ai(self, mode: ConversationMode) -> str:
-        if mode not in get_args(ConversationMode): return "Invalid mode for context."
+    def set_rolling_summary(self, mode: ConversationMode, rolling_summary: Dict[str, Any], based_on_id: Optional[str], user_id: Optional[str] = None) -> bool:
+        """Stores a new rolling summary unless the one it was built on (based_on_id, its covered_until_id)
+        has changed meanwhile, or its last folded turn is no longer stored (e.g. the user cleared their data)."""
+        user_id = user_id or self.user_id
+        with self._user_lock(user_id):
+            if not any(entry.get("id") == rolling_summary["covered_until_id"] for entry in self.storage.get_history(user_id, mode)):
+                return False
+            outcomes: List[bool] = []
+            def compare_and_set(rolling_summaries: Dict[str, Any]):
+                # Checked against the stored state inside the storage's read-modify-write
+                matches = (rolling_summaries.get(mode) or {}).get("covered_until_id") == based_on_id
+                if matches:
+                    rolling_summaries[mode] = rolling_summary
+                outcomes.append(matches)
+            self.storage.update_rolling_summaries(user_id, compare_and_set)
+            snapshot = self._cached_snapshot(user_id, mode)
+            if outcomes[0] and snapshot is not None: # The first application is the one this process sees
+                snapshot.set_rolling_summary(rolling_summary.get("text") or "")
+            return outcomes[0]
 
-        mode_specific_conv_history = self.get_conversation_history(mode)[-3:]
-        medical_summary = self.get_medical_summary()
-        
-        context_parts = []
-        
-        if mode == "qna":
-            if mode_specific_conv_history:
-                context_parts.append("Recent Q&A Snippets (User -> AI):")
-                for entry in mode_specific_conv_history:
-                    user_msg_snippet = (entry.get('user_message') or f"File: {entry.get('file_processed','N/A')}")[:100]
-                    ai_msg_snippet = (entry.get('ai_response') or "")[:100]
-                    context_parts.append(f"- User: {user_msg_snippet}... -> AI: {ai_msg_snippet}...")
-        
-        elif mode == "symptoms":
-            if mode_specific_conv_history:
-                context_parts.append(f"Recent '{mode}' Interaction Snippets (User -> AI):")
-                for entry in mode_specific_conv_history:
-                    user_msg_snippet = (entry.get('user_message') or f"File: {entry.get('file_processed','N/A')}")[:100]
-                    ai_msg_snippet = (entry.get('ai_response') or "")[:100]
-                    context_parts.append(f"- User: {user_msg_snippet}... -> AI: {ai_msg_snippet}...")
-
-            if medical_summary:
-                context_parts.append("\nRelevant Medical Summary (from QnA/Symptom interactions):")
-                if medical_summary.get("symptoms_log"):
-                    s_logs = [f"{s['date'][:10]}: {', '.join(s['symptoms'])}" for s in medical_summary['symptoms_log'][-3:]]
-                    if s_logs: context_parts.append(f"- Recent Symptom Logs: {'; '.join(s_logs)}")
-                if medical_summary.get("key_diagnoses_mentioned"):
-                    context_parts.append(f"- Key Diagnoses Mentioned: {', '.join(medical_summary['key_diagnoses_mentioned'][-3:])}")
-                if medical_summary.get("allergies"):
-                    context_parts.append(f"- Known Allergies: {', '.join(medical_summary['allergies'])}")
-                # No "analyzed_reports_info" in context from this app's memory
-        
-        if not context_parts:
-            return "No significant context available for this mode."
-            
-        return "\n".join(context_parts)
\ No newline at end of file
+    def get_medical_summary(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+        return self.storage.get_medical_summary(user_id or self.user_id)
+
+    def clear_all_user_data(self, user_id: Optional[str] = None):
+        user_id = user_id or self.user_id
+        with self._user_lock(user_id):
+            self.storage.clear_user(user_id)
+            self._drop_snapshots(user_id)
+        print(f"All main app data cleared for user: {user_id} (QnA and Symptoms only)")
+
+    def has_context(self, mode: ConversationMode, user_id: Optional[str] = None) -> bool:
+        """Whether the user has anything (turns, summaries, symptom logs) that would shape a prompt for mode."""
+        user_id = user_id or self.user_id
+        with self._user_lock(user_id):
+            return not self._context_snapshot(mode, user_id).is_empty
+
+    def get_context_for_ai(self, mode: ConversationMode, user_id: Optional[str] = None, max_tokens: Optional[int] = None, query: Optional[str] = None) -> str:
+        """Recent interactions (plus the medical summary for "symptoms") as prompt text, served from the
+        precomputed snapshot. Given the user's question as query, the earlier turns most relevant to it
+        are included instead of only the latest ones. max_tokens bounds the size; defaults to
+        MEDICAL_MEMORY_CONTEXT_TOKEN_BUDGET."""
+        if mode not in get_args(ConversationMode): return "Invalid mode for context."
+        if max_tokens is None:
+            max_tokens = settings.MEDICAL_MEMORY_CONTEXT_TOKEN_BUDGET
+        user_id = user_id or self.user_id
+        with self._user_lock(user_id):
+            return self._context_snapshot(mode, user_id).render(max_tokens, query, settings.MEDICAL_MEMORY_CONTEXT_TOP_K)
@@ -0,0 +1,813 @@
+# medical-assistant/utils/memory_storage.py
+# Storage engines behind MedicalMemory, partitioned by user. "json" keeps one locked JSON document
+# per user; "sqlite" stores one row per interaction in WAL-mode databases (users hashed across
+# shards) so appends, history reads and per-mode trimming are single indexed statements.
+# Both are safe to share between several worker processes.
+# Either can sit behind WriteBehindStorage, which serves reads from in-memory ring buffers and
+# flushes batched writes from a background thread.
+import copy
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, Dict, Any, Optional, Set, Tuple, Deque
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+DATA_DIR_RELATIVE_TO_PROJECT_ROOT = os.path.join('medical-assistant', 'data')
+CONVERSATIONS_FILE = os.path.join(DATA_DIR_RELATIVE_TO_PROJECT_ROOT, 'conversations_by_mode.json')
+MEDICAL_SUMMARY_FILE = os.path.join(DATA_DIR_RELATIVE_TO_PROJECT_ROOT, 'medical_summary.json')
+JSON_USERS_DIR = os.path.join(DATA_DIR_RELATIVE_TO_PROJECT_ROOT, 'users')
+SQLITE_DB_FILE = os.path.join(DATA_DIR_RELATIVE_TO_PROJECT_ROOT, 'medical_memory.db')
+
+CONVERSATION_MODES: Tuple[str, ...] = ("qna", "symptoms")
+SUMMARY_KEYS: Tuple[str, ...] = ("symptoms_log", "key_diagnoses_mentioned", "allergies", "medications_log")
+LEGACY_ROLLING_SUMMARIES_KEY = "rolling_summaries" # Older builds kept rolling summaries inside the medical summary
+
+
+def empty_conversations() -> Dict[str, List[Dict[str, Any]]]:
+    return {mode: [] for mode in CONVERSATION_MODES}
+
+
+def empty_medical_summary() -> Dict[str, List[Any]]:
+    return {key: [] for key in SUMMARY_KEYS}
+
+
+def _strip_legacy_keys(summary: Dict[str, Any]) -> Dict[str, Any]:
+    summary.pop("analyzed_reports_info", None)
+    summary.pop(LEGACY_ROLLING_SUMMARIES_KEY, None) # Derived data; the summarizer rebuilds it from the turns
+    return summary
+
+
+SummaryUpdate = Callable[[Dict[str, Any]], None] # Edits a medical summary (or a user's rolling summaries) in place
+
+
+class MemoryStorage:
+    """Interface every MedicalMemory storage engine implements. Histories are oldest-first."""
+
+    def append_interaction(self, user_id: str, mode: str, interaction: Dict[str, Any], max_entries: int):
+        raise NotImplementedError
+
+    def get_history(self, user_id: str, mode: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Returns the mode's interactions, or only the newest `limit` of them."""
+        raise NotImplementedError
+
+    def get_medical_summary(self, user_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def save_medical_summary(self, user_id: str, summary: Dict[str, Any]):
+        raise NotImplementedError
+
+    def update_medical_summary(self, user_id: str, update: SummaryUpdate) -> Dict[str, Any]:
+        """Applies update (which edits the summary in place) to the stored summary as one read-modify-write
+        under the engine's lock, so concurrent writers' changes merge instead of the last one winning.
+        Returns the updated summary."""
+        raise NotImplementedError
+
+    def get_rolling_summaries(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        """The user's rolling conversation summaries by mode; {} if none. Stored apart from the medical
+        summary: they are derived from the stored turns, so they are never exported or imported."""
+        raise NotImplementedError
+
+    def update_rolling_summaries(self, user_id: str, update: SummaryUpdate) -> Dict[str, Dict[str, Any]]:
+        """update_medical_summary for the rolling summaries (update edits the {mode: state} dict in place)."""
+        raise NotImplementedError
+
+    def clear_user(self, user_id: str):
+        """Removes the user's interactions, medical summary and rolling summaries."""
+        raise NotImplementedError
+
+    def change_token(self, user_id: str) -> Optional[Any]:
+        """A cheap value that changes whenever this user's data is written (by any process); None if unknown."""
+        return None
+
+    def iter_user_ids(self) -> List[str]:
+        """Every user with stored data, sorted. Used by bulk export."""
+        raise NotImplementedError
+
+    def apply_changes(self, changes: List[Tuple]) -> Dict[str, Any]:
+        """Applies a batch of queued writes in order: ("append", user_id, mode, interaction, max_entries),
+        ("summary", user_id, summary), ("summary_update", user_id, update), ("rolling_update", user_id, update)
+        or ("clear", user_id). Returns each touched user's change token as of this batch's own write, so a
+        caller can tell its writes from a later one by another process. Engines override this to do it in
+        one go (and to read the tokens inside the write, which this fallback can't)."""
+        for change in changes:
+            if change[0] == "append":
+                self.append_interaction(*change[1:])
+            elif change[0] == "summary":
+                self.save_medical_summary(*change[1:])
+            elif change[0] == "summary_update":
+                self.update_medical_summary(*change[1:])
+            elif change[0] == "rolling_update":
+                self.update_rolling_summaries(*change[1:])
+            elif change[0] == "clear":
+                self.clear_user(*change[1:])
+        return {user_id: self.change_token(user_id) for user_id in dict.fromkeys(change[1] for change in changes)}
+
+
+@contextmanager
+def _interprocess_lock(lock_path: str):
+    """Exclusive OS-level lock on lock_path, held across worker processes (and threads)."""
+    with open(lock_path, 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _empty_user_document() -> Dict[str, Any]:
+    return {"conversations": empty_conversations(), "medical_summary": empty_medical_summary(), "rolling_summaries": {}}
+
+
+class JsonFileStorage(MemoryStorage):
+    """One document per user under data/users/ ({"conversations": {mode: [...]}, "medical_summary": {...},
+    "rolling_summaries": {mode: {...}}}).
+    Writes hold an OS lock on the user's own lock file and replace the document atomically, so several
+    worker processes can write safely and different users never contend. Users found only in the old
+    shared conversations_by_mode.json / medical_summary.json are seeded from them on first use."""
+
+    def __init__(self, users_dir: str = JSON_USERS_DIR):
+        self.users_dir = users_dir
+        os.makedirs(users_dir, exist_ok=True)
+
+    def _user_path(self, user_id: str) -> str:
+        return os.path.join(self.users_dir, f"{user_id}.json")
+
+    @staticmethod
+    def _load_json(path: str) -> Dict[str, Any]:
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _save_json_atomically(path: str, data: Dict[str, Any]):
+        # Write a sibling temp file and rename it over the original so a crash never leaves half a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f: json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def _load_legacy_user(self, user_id: str) -> Dict[str, Any]:
+        document = _empty_user_document()
+        try:
+            legacy_convos = self._load_json(CONVERSATIONS_FILE).get(user_id) or {}
+            for mode in CONVERSATION_MODES: # Drops the old "report" key
+                document["conversations"][mode] = legacy_convos.get(mode, [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        try:
+            document["medical_summary"].update(self._load_json(MEDICAL_SUMMARY_FILE).get(user_id) or {})
+            _strip_legacy_keys(document["medical_summary"])
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        return document
+
+    def _load_user(self, user_id: str) -> Dict[str, Any]:
+        try:
+            document = self._load_json(self._user_path(user_id))
+        except FileNotFoundError:
+            return self._load_legacy_user(user_id)
+        except json.JSONDecodeError:
+            print(f"MEDICAL_MEMORY: WARNING - {self._user_path(user_id)} is corrupt; starting this user afresh.")
+            document = {}
+        conversations = document.setdefault("conversations", {})
+        for mode in CONVERSATION_MODES:
+            conversations.setdefault(mode, [])
+        summary = _strip_legacy_keys(document.setdefault("medical_summary", {}))
+        for key_summary in SUMMARY_KEYS:
+            summary.setdefault(key_summary, [])
+        document.setdefault("rolling_summaries", {})
+        return document
+
+    def _update_user(self, user_id: str, changes: List[Tuple]) -> Tuple[Dict[str, Any], Optional[Tuple]]:
+        # Read-modify-write under the user's lock; other users' files are untouched. Returns the new
+        # document and its change token, taken before the lock is released so no other writer's shows up.
+        with _interprocess_lock(self._user_path(user_id) + ".lock"):
+            document = self._load_user(user_id)
+            for change in changes:
+                if change[0] == "append":
+                    _, _, mode, interaction, max_entries = change
+                    history = document["conversations"].setdefault(mode, [])
+                    history.append(interaction)
+                    document["conversations"][mode] = history[-max_entries:]
+                elif change[0] == "summary":
+                    document["medical_summary"] = change[2]
+                elif change[0] == "summary_update":
+                    change[2](document["medical_summary"])
+                elif change[0] == "rolling_update":
+                    change[2](document["rolling_summaries"])
+                elif change[0] == "clear":
+                    document = _empty_user_document()
+            self._save_json_atomically(self._user_path(user_id), document)
+            token = self.change_token(user_id)
+        return document, token
+
+    def iter_user_ids(self) -> List[str]:
+        user_ids = {name[:-len(".json")] for name in os.listdir(self.users_dir) if name.endswith(".json")}
+        for legacy_file in (CONVERSATIONS_FILE, MEDICAL_SUMMARY_FILE):
+            try:
+                user_ids.update(self._load_json(legacy_file).keys())
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+        return sorted(user_ids)
+
+    def change_token(self, user_id: str) -> Optional[Tuple]:
+        try:
+            stat = os.stat(self._user_path(user_id))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) # Every write is a rename, so the inode changes
+
+    def append_interaction(self, user_id: str, mode: str, interaction: Dict[str, Any], max_entries: int):
+        self._update_user(user_id, [("append", user_id, mode, interaction, max_entries)])
+
+    def get_history(self, user_id: str, mode: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        # No lock needed: documents are only ever replaced whole
+        history = self._load_user(user_id)["conversations"].get(mode, [])
+        return history[-limit:] if limit else history
+
+    def get_medical_summary(self, user_id: str) -> Dict[str, Any]:
+        return self._load_user(user_id)["medical_summary"]
+
+    def save_medical_summary(self, user_id: str, summary: Dict[str, Any]):
+        self._update_user(user_id, [("summary", user_id, summary)])
+
+    def update_medical_summary(self, user_id: str, update: SummaryUpdate) -> Dict[str, Any]:
+        return self._update_user(user_id, [("summary_update", user_id, update)])[0]["medical_summary"]
+
+    def get_rolling_summaries(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        return self._load_user(user_id)["rolling_summaries"]
+
+    def update_rolling_summaries(self, user_id: str, update: SummaryUpdate) -> Dict[str, Dict[str, Any]]:
+        return self._update_user(user_id, [("rolling_update", user_id, update)])[0]["rolling_summaries"]
+
+    def clear_user(self, user_id: str):
+        self._update_user(user_id, [("clear", user_id)])
+
+    def apply_changes(self, changes: List[Tuple]) -> Dict[str, Any]:
+        # One locked read and one rewrite per user for the whole batch
+        changes_by_user: Dict[str, List[Tuple]] = {}
+        for change in changes:
+            changes_by_user.setdefault(change[1], []).append(change)
+        return {user_id: self._update_user(user_id, user_changes)[1] for user_id, user_changes in changes_by_user.items()}
+
+
+class SQLiteStorage(MemoryStorage):
+    """One row per interaction, indexed by (user_id, mode, seq). WAL mode lets history reads run
+    alongside a writer; all statements for one operation run in a single transaction, which also
+    bumps the user's row in user_versions (their change token)."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS interactions (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            interaction_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            user_message TEXT,
+            ai_response TEXT,
+            file_processed TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_interactions_user_mode_seq ON interactions (user_id, mode, seq);
+        CREATE TABLE IF NOT EXISTS medical_summaries (
+            user_id TEXT PRIMARY KEY,
+            summary_json TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rolling_summaries (
+            user_id TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            state_json TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, mode)
+        );
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    BUSY_TIMEOUT_MS = 10000 # How long a write waits for another process's write lock before failing
+
+    def __init__(self, db_path: str = SQLITE_DB_FILE, owns_user: Optional[Callable[[str], bool]] = None):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.owns_user = owns_user or (lambda user_id: True) # Which users this database holds (for sharding)
+        self._lock = threading.Lock() # Guards the write connection; sqlite3 objects are not safe to use concurrently
+        self._conn = self._connect(check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # Durable across app crashes; WAL keeps it consistent
+        self._conn.executescript(self.SCHEMA)
+        self._readers = threading.local() # One read connection per thread, so reads never queue on self._lock
+        self._migrate_from_json_once()
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=check_same_thread, isolation_level=None, timeout=self.BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={self.BUSY_TIMEOUT_MS}")
+        return conn
+
+    def _transaction(self):
+        return _SQLiteTransaction(self._conn, self._lock)
+
+    def _query(self, sql: str, params: tuple) -> List[sqlite3.Row]:
+        # Reads are a single autocommit statement: consistent on their own, and in WAL mode they
+        # neither block nor wait for the writer
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = self._connect()
+        return conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _bump_version(cur: sqlite3.Cursor, user_id: str) -> int:
+        # In the caller's transaction, so the new version commits (or rolls back) with the write itself
+        cur.execute("INSERT INTO user_versions (user_id, version) VALUES (?, 1) ON CONFLICT(user_id) DO UPDATE SET version = version + 1", (user_id,))
+        return cur.execute("SELECT version FROM user_versions WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def _migrate_from_json_once(self):
+        # BEGIN IMMEDIATE makes concurrent workers queue here; only the first one finds no marker
+        with self._transaction() as cur:
+            if cur.execute("SELECT 1 FROM meta WHERE key = 'json_migrated_at'").fetchone():
+                return
+            source = JsonFileStorage()
+            migrated_users = migrated_interactions = 0
+            for user_id in filter(self.owns_user, source.iter_user_ids()):
+                for mode in CONVERSATION_MODES:
+                    for interaction in source.get_history(user_id, mode):
+                        self._insert_interaction(cur, user_id, mode, interaction)
+                        migrated_interactions += 1
+                self._upsert_summary(cur, user_id, source.get_medical_summary(user_id))
+                migrated_users += 1
+            cur.execute("INSERT INTO meta (key, value) VALUES ('json_migrated_at', ?)", (datetime.utcnow().isoformat() + "Z",))
+        print(f"MEDICAL_MEMORY: Migrated {migrated_interactions} interactions for {migrated_users} user(s) from JSON into {self.db_path}.")
+
+    @staticmethod
+    def _insert_interaction(cur: sqlite3.Cursor, user_id: str, mode: str, interaction: Dict[str, Any]):
+        timestamp = interaction.get("timestamp") or datetime.utcnow().isoformat() + "Z"
+        cur.execute(
+            "INSERT INTO interactions (user_id, mode, interaction_id, timestamp, user_message, ai_response, file_processed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, mode, interaction.get("id") or timestamp, timestamp, interaction.get("user_message"), interaction.get("ai_response"), interaction.get("file_processed")),
+        )
+
+    @staticmethod
+    def _upsert_summary(cur: sqlite3.Cursor, user_id: str, summary: Dict[str, Any]):
+        cur.execute(
+            "INSERT INTO medical_summaries (user_id, summary_json, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET summary_json = excluded.summary_json, updated_at = excluded.updated_at",
+            (user_id, json.dumps(summary), datetime.utcnow().isoformat() + "Z"),
+        )
+
+    @staticmethod
+    def _summary_from_rows(rows: List[sqlite3.Row]) -> Dict[str, Any]:
+        user_summary = json.loads(rows[0]["summary_json"]) if rows else {}
+        for key_summary in SUMMARY_KEYS:
+            user_summary.setdefault(key_summary, [])
+        return _strip_legacy_keys(user_summary)
+
+    @classmethod
+    def _update_summary(cls, cur: sqlite3.Cursor, user_id: str, update: SummaryUpdate) -> Dict[str, Any]:
+        # Inside the caller's BEGIN IMMEDIATE transaction, so no other writer can slip in between
+        user_summary = cls._summary_from_rows(cur.execute("SELECT summary_json FROM medical_summaries WHERE user_id = ?", (user_id,)).fetchall())
+        update(user_summary)
+        cls._upsert_summary(cur, user_id, user_summary)
+        return user_summary
+
+    @staticmethod
+    def _rolling_from_rows(rows: List[sqlite3.Row]) -> Dict[str, Dict[str, Any]]:
+        return {row["mode"]: json.loads(row["state_json"]) for row in rows}
+
+    @classmethod
+    def _update_rolling(cls, cur: sqlite3.Cursor, user_id: str, update: SummaryUpdate) -> Dict[str, Dict[str, Any]]:
+        rolling_summaries = cls._rolling_from_rows(cur.execute("SELECT mode, state_json FROM rolling_summaries WHERE user_id = ?", (user_id,)).fetchall())
+        update(rolling_summaries)
+        cur.execute("DELETE FROM rolling_summaries WHERE user_id = ?", (user_id,))
+        updated_at = datetime.utcnow().isoformat() + "Z"
+        cur.executemany(
+            "INSERT INTO rolling_summaries (user_id, mode, state_json, updated_at) VALUES (?, ?, ?, ?)",
+            [(user_id, mode, json.dumps(state), updated_at) for mode, state in rolling_summaries.items()],
+        )
+        return rolling_summaries
+
+    @staticmethod
+    def _row_to_interaction(row: sqlite3.Row) -> Dict[str, Any]:
+        interaction = {
+            "id": row["interaction_id"],
+            "timestamp": row["timestamp"],
+            "user_message": row["user_message"],
+            "ai_response": row["ai_response"],
+        }
+        if row["file_processed"]: interaction["file_processed"] = row["file_processed"]
+        return interaction
+
+    @classmethod
+    def _append_and_trim(cls, cur: sqlite3.Cursor, user_id: str, mode: str, interaction: Dict[str, Any], max_entries: int):
+        cls._insert_interaction(cur, user_id, mode, interaction)
+        # Keep only the newest max_entries rows for this user/mode (index range scan)
+        cur.execute(
+            "DELETE FROM interactions WHERE user_id = ? AND mode = ? AND seq <= "
+            "(SELECT seq FROM interactions WHERE user_id = ? AND mode = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+            (user_id, mode, user_id, mode, max_entries),
+        )
+
+    @classmethod
+    def _clear_user_rows(cls, cur: sqlite3.Cursor, user_id: str):
+        cur.execute("DELETE FROM interactions WHERE user_id = ?", (user_id,))
+        cur.execute("DELETE FROM rolling_summaries WHERE user_id = ?", (user_id,))
+        cls._upsert_summary(cur, user_id, empty_medical_summary())
+
+    def append_interaction(self, user_id: str, mode: str, interaction: Dict[str, Any], max_entries: int):
+        with self._transaction() as cur:
+            self._append_and_trim(cur, user_id, mode, interaction, max_entries)
+            self._bump_version(cur, user_id)
+
+    def get_history(self, user_id: str, mode: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        rows = self._query(
+            "SELECT * FROM interactions WHERE user_id = ? AND mode = ? ORDER BY seq DESC LIMIT ?",
+            (user_id, mode, limit if limit else -1),
+        )
+        return [self._row_to_interaction(row) for row in reversed(rows)]
+
+    def get_medical_summary(self, user_id: str) -> Dict[str, Any]:
+        return self._summary_from_rows(self._query("SELECT summary_json FROM medical_summaries WHERE user_id = ?", (user_id,)))
+
+    def save_medical_summary(self, user_id: str, summary: Dict[str, Any]):
+        with self._transaction() as cur:
+            self._upsert_summary(cur, user_id, summary)
+            self._bump_version(cur, user_id)
+
+    def update_medical_summary(self, user_id: str, update: SummaryUpdate) -> Dict[str, Any]:
+        with self._transaction() as cur:
+            self._bump_version(cur, user_id)
+            return self._update_summary(cur, user_id, update)
+
+    def get_rolling_summaries(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        return self._rolling_from_rows(self._query("SELECT mode, state_json FROM rolling_summaries WHERE user_id = ?", (user_id,)))
+
+    def update_rolling_summaries(self, user_id: str, update: SummaryUpdate) -> Dict[str, Dict[str, Any]]:
+        with self._transaction() as cur:
+            self._bump_version(cur, user_id)
+            return self._update_rolling(cur, user_id, update)
+
+    def clear_user(self, user_id: str):
+        with self._transaction() as cur:
+            self._clear_user_rows(cur, user_id)
+            self._bump_version(cur, user_id)
+
+    def iter_user_ids(self) -> List[str]:
+        rows = self._query("SELECT user_id FROM interactions UNION SELECT user_id FROM medical_summaries ORDER BY user_id", ())
+        return [row["user_id"] for row in rows if self.owns_user(row["user_id"])]
+
+    def change_token(self, user_id: str) -> int:
+        # Per user: writes to other users in this database don't change it
+        rows = self._query("SELECT version FROM user_versions WHERE user_id = ?", (user_id,))
+        return rows[0]["version"] if rows else 0
+
+    def apply_changes(self, changes: List[Tuple]) -> Dict[str, int]:
+        # The whole batch is one transaction: one fsync-able commit instead of one per write
+        with self._transaction() as cur:
+            for change in changes:
+                if change[0] == "append":
+                    self._append_and_trim(cur, *change[1:])
+                elif change[0] == "summary":
+                    self._upsert_summary(cur, *change[1:])
+                elif change[0] == "summary_update":
+                    self._update_summary(cur, *change[1:])
+                elif change[0] == "rolling_update":
+                    self._update_rolling(cur, *change[1:])
+                elif change[0] == "clear":
+                    self._clear_user_rows(cur, change[1])
+            return {user_id: self._bump_version(cur, user_id) for user_id in dict.fromkeys(change[1] for change in changes)}
+
+
+class ShardedSQLiteStorage(MemoryStorage):
+    """Spreads users over shard_count SQLite files by a stable hash of the user id, so writers for
+    different users rarely wait on the same database lock. Changing the shard count strands data."""
+
+    def __init__(self, shard_count: int = 1, db_path: str = SQLITE_DB_FILE):
+        self.shard_count = max(1, shard_count)
+        if self.shard_count == 1:
+            db_paths = [db_path]
+        else:
+            root, ext = os.path.splitext(db_path)
+            db_paths = [f"{root}.{index}{ext}" for index in range(self.shard_count)]
+        self.shards = [
+            SQLiteStorage(path, owns_user=lambda user_id, index=index: self.shard_index(user_id) == index)
+            for index, path in enumerate(db_paths)
+        ]
+
+    def shard_index(self, user_id: str) -> int:
+        return zlib.crc32(user_id.encode("utf-8")) % self.shard_count
+
+    def _shard(self, user_id: str) -> SQLiteStorage:
+        return self.shards[self.shard_index(user_id)]
+
+    def append_interaction(self, user_id: str, mode: str, interaction: Dict[str, Any], max_entries: int):
+        self._shard(user_id).append_interaction(user_id, mode, interaction, max_entries)
+
+    def get_history(self, user_id: str, mode: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self._shard(user_id).get_history(user_id, mode, limit)
+
+    def get_medical_summary(self, user_id: str) -> Dict[str, Any]:
+        return self._shard(user_id).get_medical_summary(user_id)
+
+    def save_medical_summary(self, user_id: str, summary: Dict[str, Any]):
+        self._shard(user_id).save_medical_summary(user_id, summary)
+
+    def update_medical_summary(self, user_id: str, update: SummaryUpdate) -> Dict[str, Any]:
+        return self._shard(user_id).update_medical_summary(user_id, update)
+
+    def get_rolling_summaries(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        return self._shard(user_id).get_rolling_summaries(user_id)
+
+    def update_rolling_summaries(self, user_id: str, update: SummaryUpdate) -> Dict[str, Dict[str, Any]]:
+        return self._shard(user_id).update_rolling_summaries(user_id, update)
+
+    def clear_user(self, user_id: str):
+        self._shard(user_id).clear_user(user_id)
+
+    def change_token(self, user_id: str) -> int:
+        return self._shard(user_id).change_token(user_id)
+
+    def iter_user_ids(self) -> List[str]:
+        return list(heapq.merge(*(shard.iter_user_ids() for shard in self.shards)))
+
+    def apply_changes(self, changes: List[Tuple]) -> Dict[str, int]:
+        # One transaction per shard touched; per-user order is preserved
+        changes_by_shard: Dict[int, List[Tuple]] = {}
+        for change in changes:
+            changes_by_shard.setdefault(self.shard_index(change[1]), []).append(change)
+        tokens: Dict[str, int] = {}
+        for index, shard_changes in changes_by_shard.items():
+            tokens.update(self.shards[index].apply_changes(shard_changes))
+        return tokens
+
+
+class _SQLiteTransaction:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error) while holding the connection lock."""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self.conn, self.lock = conn, lock
+
+    def __enter__(self) -> sqlite3.Cursor:
+        self.lock.acquire()
+        try:
+            self.cursor = self.conn.cursor()
+            self.cursor.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self.lock.release()
+            raise
+        return self.cursor
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.cursor.close()
+            self.lock.release()
+        return False
+
+
+class _CachedUser:
+    __slots__ = ("histories", "summary", "rolling_summaries", "token", "generation")
+    _generations = iter(range(1, 1 << 62))
+
+    def __init__(self, histories: Dict[str, Deque[Dict[str, Any]]], summary: Dict[str, Any], rolling_summaries: Dict[str, Dict[str, Any]], token: Optional[Any]):
+        self.histories, self.summary, self.rolling_summaries, self.token = histories, summary, rolling_summaries, token
+        self.generation = next(self._generations) # New on every (re)load, so it doubles as our change token
+
+
+class WriteBehindStorage(MemoryStorage):
+    """Keeps recently active users' working sets in memory - one bounded deque per mode plus the
+    medical and rolling summaries - and writes changes to the backing engine from a background thread. A burst of writes
+    within flush_delay_seconds is flushed as one batch. Reads are served from memory; the backing
+    engine's per-user change_token() is checked first so writes made by other worker processes are
+    picked up. The token apply_changes() returns for a flushed batch is what the cache compares against,
+    so a foreign write that lands right after our flush is still noticed."""
+
+    def __init__(self, backing: MemoryStorage, max_entries: int, flush_delay_seconds: float = 0.5, max_cached_users: int = 1000):
+        self.backing = backing
+        self.max_entries = max_entries
+        self.flush_delay_seconds = flush_delay_seconds
+        self.max_cached_users = max_cached_users
+        self._lock = threading.Lock()       # Guards the working sets and the pending queue
+        self._flush_lock = threading.Lock() # One flush at a time, so batches reach the backing store in order
+        self._users: "OrderedDict[str, _CachedUser]" = OrderedDict() # Least recently used first
+        self._pending: List[Tuple] = []
+        self._in_flight_users: Set[str] = set() # Users in the batch flush() is writing right now
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="medical-memory-flusher", daemon=True)
+        self._flusher.start()
+
+    def _refresh_if_changed(self, user_id: str):
+        # Called without self._lock. Drops a cached user another process has written to since we loaded it.
+        token = self.backing.change_token(user_id)
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is None or cached.token == token:
+                return
+        self.flush() # Our own queued (or in-flight) writes land first, so the reload includes them
+        with self._lock:
+            # A write queued since then would be lost by a reload; keep the entry and retry on the next read
+            if user_id not in self._users_with_unwritten_changes():
+                self._users.pop(user_id, None)
+
+    def _cached_user(self, user_id: str) -> _CachedUser:
+        # Caller holds self._lock. Loads a user once; later reads are served from the ring buffers.
+        cached = self._users.get(user_id)
+        if cached is not None:
+            self._users.move_to_end(user_id)
+            return cached
+        token = self.backing.change_token(user_id) # Taken before reading, so a concurrent write is noticed next time
+        cached = self._users[user_id] = _CachedUser(
+            {mode: deque(self.backing.get_history(user_id, mode, self.max_entries), maxlen=self.max_entries) for mode in CONVERSATION_MODES},
+            self.backing.get_medical_summary(user_id),
+            self.backing.get_rolling_summaries(user_id),
+            token,
+        )
+        self._evict_idle_users()
+        return cached
+
+    def _users_with_unwritten_changes(self) -> Set[str]:
+        # Caller holds self._lock. Their cached entry is the only copy of those changes.
+        return {change[1] for change in self._pending} | self._in_flight_users
+
+    def _evict_idle_users(self):
+        if len(self._users) <= self.max_cached_users:
+            return
+        users_with_unwritten_changes = self._users_with_unwritten_changes()
+        for user_id in list(self._users):
+            if len(self._users) <= self.max_cached_users:
+                break
+            if user_id not in users_with_unwritten_changes:
+                del self._users[user_id]
+
+    def preload(self, user_id: str):
+        with self._lock:
+            self._cached_user(user_id)
+
+    def change_token(self, user_id: str) -> int:
+        # Changes only when the working set is reloaded (another process wrote) or cleared, not on our own appends
+        self._refresh_if_changed(user_id)
+        with self._lock:
+            return self._cached_user(user_id).generation
+
+    def iter_user_ids(self) -> List[str]:
+        self.flush() # Users created since the last flush exist only in memory until then
+        return self.backing.iter_user_ids()
+
+    def _enqueue(self, change: Tuple):
+        self._pending.append(change)
+        self._wake.set()
+
+    def append_interaction(self, user_id: str, mode: str, interaction: Dict[str, Any], max_entries: int):
+        self._refresh_if_changed(user_id)
+        with self._lock:
+            histories = self._cached_user(user_id).histories
+            buffer = histories.get(mode)
+            if buffer is None or buffer.maxlen != max_entries:
+                buffer = histories[mode] = deque(buffer or (), maxlen=max_entries)
+            buffer.append(interaction)
+            self._enqueue(("append", user_id, mode, interaction, max_entries))
+
+    def get_history(self, user_id: str, mode: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        self._refresh_if_changed(user_id)
+        with self._lock:
+            history = list(self._cached_user(user_id).histories.get(mode) or ())
+        return history[-limit:] if limit else history
+
+    def get_medical_summary(self, user_id: str) -> Dict[str, Any]:
+        self._refresh_if_changed(user_id)
+        with self._lock:
+            return copy.deepcopy(self._cached_user(user_id).summary) # Callers mutate it before saving it back
+
+    def save_medical_summary(self, user_id: str, summary: Dict[str, Any]):
+        summary = copy.deepcopy(summary)
+        self._refresh_if_changed(user_id)
+        with self._lock:
+            self._cached_user(user_id).summary = summary
+            self._enqueue(("summary", user_id, summary))
+
+    def update_medical_summary(self, user_id: str, update: SummaryUpdate) -> Dict[str, Any]:
+        # Applied to our copy now and queued as the update itself, not the resulting document: the flush
+        # re-applies it to the stored summary, merging with what other workers wrote meanwhile
+        self._refresh_if_changed(user_id)
+        with self._lock:
+            cached = self._cached_user(user_id)
+            update(cached.summary)
+            self._enqueue(("summary_update", user_id, update))
+            return copy.deepcopy(cached.summary)
+
+    def get_rolling_summaries(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        self._refresh_if_changed(user_id)
+        with self._lock:
+            return copy.deepcopy(self._cached_user(user_id).rolling_summaries)
+
+    def update_rolling_summaries(self, user_id: str, update: SummaryUpdate) -> Dict[str, Dict[str, Any]]:
+        # Queued as the update itself, like update_medical_summary
+        self._refresh_if_changed(user_id)
+        with self._lock:
+            cached = self._cached_user(user_id)
+            update(cached.rolling_summaries)
+            self._enqueue(("rolling_update", user_id, update))
+            return copy.deepcopy(cached.rolling_summaries)
+
+    def clear_user(self, user_id: str):
+        with self._lock:
+            token = self._users[user_id].token if user_id in self._users else None
+            self._users[user_id] = _CachedUser({mode: deque(maxlen=self.max_entries) for mode in CONVERSATION_MODES}, empty_medical_summary(), {}, token)
+            self._enqueue(("clear", user_id))
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait()
+            if self._closed:
+                return
+            time.sleep(self.flush_delay_seconds) # Debounce: let the rest of a burst join this batch
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Writes all queued changes to the backing engine now. Returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                batch_users = {change[1] for change in batch}
+                self._in_flight_users = batch_users
+                entries_written = {user_id: self._users.get(user_id) for user_id in batch_users}
+            if not batch:
+                return 0
+            try:
+                new_tokens = self.backing.apply_changes(batch)
+            except Exception as e:
+                print(f"MEDICAL_MEMORY: ERROR - Flushing {len(batch)} change(s) failed, will retry on the next write: {e}")
+                with self._lock:
+                    self._pending = batch + self._pending
+                    self._in_flight_users = set()
+                return 0
+            # A merged update may have picked up other workers' changes; adopt the stored result
+            merged_summaries = {change[1]: self.backing.get_medical_summary(change[1]) for change in batch if change[0] == "summary_update"}
+            merged_rolling = {change[1]: self.backing.get_rolling_summaries(change[1]) for change in batch if change[0] == "rolling_update"}
+            with self._lock:
+                self._in_flight_users = set()
+                for user_id in batch_users:
+                    cached = self._users.get(user_id)
+                    if cached is None:
+                        continue
+                    if cached is entries_written[user_id]:
+                        cached.token = new_tokens.get(user_id) # Our own writes must not look like another process's on the next read
+                        pending_kinds = {change[0] for change in self._pending if change[1] == user_id}
+                        adopted = False
+                        merged = merged_summaries.get(user_id)
+                        if merged is not None and merged != cached.summary and not pending_kinds & {"summary", "summary_update", "clear"}:
+                            cached.summary, adopted = merged, True
+                        merged = merged_rolling.get(user_id)
+                        if merged is not None and merged != cached.rolling_summaries and not pending_kinds & {"rolling_update", "clear"}:
+                            cached.rolling_summaries, adopted = merged, True
+                        if adopted:
+                            cached.generation = next(_CachedUser._generations) # Callers' derived state (snapshots) is stale
+                    elif user_id not in self._users_with_unwritten_changes():
+                        del self._users[user_id] # Loaded while the batch was in flight; reload it with the batch included
+            return len(batch)
+
+    def close(self):
+        """Stops the flusher thread and writes anything still queued. Called on app shutdown."""
+        self._closed = True
+        self._wake.set()
+        self._flusher.join(timeout=self.flush_delay_seconds + 5)
+        self.flush()
+        with self._lock:
+            unwritten = len(self._pending)
+        if unwritten:
+            print(f"MEDICAL_MEMORY: WARNING - {unwritten} change(s) could not be written on shutdown.")
+        else:
+            print("MEDICAL_MEMORY: All pending changes written on shutdown.")
+
+
+def create_storage(backend: str, sqlite_shards: int = 1) -> MemoryStorage:
+    if backend == "json":
+        return JsonFileStorage()
+    if backend == "sqlite":
+        return ShardedSQLiteStorage(sqlite_shards)
+    raise ValueError(f"Unknown MEDICAL_MEMORY_BACKEND '{backend}'. Expected 'sqlite' or 'json'.")
@@ -0,0 +1,166 @@
+# medical-assistant/utils/memory_transfer.py
+# Bulk export/import of MedicalMemory data as NDJSON (one JSON record per line), for backups and for
+# moving users between nodes or storage backends. Both directions stream: export reads one user at
+# a time and import applies records in fixed-size batches, so memory use doesn't grow with the data
+# and all storage access runs on the blocking-I/O pool.
+#
+# Records, in order:
+#   {"type": "header", "format": "medisonar-medical-memory", "version": 1, "exported_at": ..., "users": N}
+#   {"type": "interaction", "user_id": ..., "mode": "qna" | "symptoms", "interaction": {...}}   (oldest first)
+#   {"type": "medical_summary", "user_id": ..., "medical_summary": {...}}
+#   {"type": "footer", "users": N, "interactions": M}   (lets a reader tell a complete export from a cut-off one)
+# Rolling conversation summaries are not exported: they are derived from the interactions and the
+# summarizer rebuilds them after an import.
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple, get_args
+
+from shared_services.blocking_io import run_io
+from .medical_memory import ConversationMode, MedicalMemory, is_valid_user_id
+from .memory_storage import LEGACY_ROLLING_SUMMARIES_KEY
+
+EXPORT_FORMAT = "medisonar-medical-memory"
+EXPORT_VERSION = 1
+INTERACTION_FIELDS = ("id", "timestamp", "user_message", "ai_response", "file_processed")
+IMPORT_BATCH_RECORDS = 500
+MAX_IMPORT_LINE_BYTES = 1024 * 1024
+MAX_REPORTED_ERRORS = 20
+
+
+class ImportFormatError(ValueError):
+    """The stream is not a medical memory export this version can read; nothing was imported."""
+
+
+def _ndjson_line(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+async def export_ndjson(memory: MedicalMemory, user_ids: List[str]) -> AsyncIterator[bytes]:
+    """Yields the export for user_ids, one chunk per user."""
+    yield _ndjson_line({"type": "header", "format": EXPORT_FORMAT, "version": EXPORT_VERSION,
+                        "exported_at": datetime.utcnow().isoformat() + "Z", "users": len(user_ids)})
+    interaction_count = 0
+    for user_id in user_ids:
+        data = await run_io(memory.get_history_overview, user_id)
+        lines = [
+            _ndjson_line({"type": "interaction", "user_id": user_id, "mode": mode, "interaction": entry})
+            for mode, entries in data["conversation_summaries"].items() for entry in entries
+        ]
+        interaction_count += len(lines)
+        if any(data["medical_summary"].values()):
+            lines.append(_ndjson_line({"type": "medical_summary", "user_id": user_id, "medical_summary": data["medical_summary"]}))
+        if lines:
+            yield b"".join(lines)
+    yield _ndjson_line({"type": "footer", "users": len(user_ids), "interactions": interaction_count})
+
+
+def _parse_record(raw_line: bytes, target_user_id: Optional[str]) -> Optional[Tuple]:
+    """One import line as a MedicalMemory.import_records record; None for header/footer lines."""
+    record = json.loads(raw_line)
+    if not isinstance(record, dict):
+        raise ValueError("record is not a JSON object")
+    record_type = record.get("type")
+    if record_type == "header":
+        if record.get("format") != EXPORT_FORMAT or record.get("version") != EXPORT_VERSION:
+            raise ImportFormatError(f"Unsupported export format {record.get('format')!r} version {record.get('version')!r}; expected {EXPORT_FORMAT!r} version {EXPORT_VERSION}.")
+        return None
+    if record_type == "footer":
+        return None
+    user_id = target_user_id or record.get("user_id")
+    if not isinstance(user_id, str) or not is_valid_user_id(user_id):
+        raise ValueError(f"invalid user_id {record.get('user_id')!r}")
+    if record_type == "interaction":
+        mode, interaction = record.get("mode"), record.get("interaction")
+        if mode not in get_args(ConversationMode):
+            raise ValueError(f"invalid mode {mode!r}")
+        if not isinstance(interaction, dict) or not isinstance(interaction.get("id"), str) or not isinstance(interaction.get("timestamp"), str):
+            raise ValueError("interaction needs string 'id' and 'timestamp' fields")
+        return ("interaction", user_id, mode, {field: interaction[field] for field in INTERACTION_FIELDS if interaction.get(field) is not None})
+    if record_type == "medical_summary":
+        if not isinstance(record.get("medical_summary"), dict):
+            raise ValueError("medical_summary must be an object")
+        # Older exports carried rolling summaries here, pointing at interactions the target may not have
+        summary = {key: value for key, value in record["medical_summary"].items() if key != LEGACY_ROLLING_SUMMARIES_KEY}
+        return ("medical_summary", user_id, summary)
+    raise ValueError(f"unknown record type {record_type!r}")
+
+
+async def import_ndjson(memory: MedicalMemory, chunks: AsyncIterator[bytes], target_user_id: Optional[str] = None,
+                        replace: bool = False) -> Dict[str, Any]:
+    """
+    Reads an export from chunks (e.g. a request body stream) and applies it in batches. With
+    target_user_id, every record goes to that user; otherwise to the user_id on each record. With
+    replace, each user's existing data is cleared before their first record; otherwise records are
+    merged (interactions already present are skipped, a medical summary record replaces the stored one).
+    Bad lines are skipped and reported; ImportFormatError is raised only for a header this version
+    can't read, before anything is applied.
+    """
+    result: Dict[str, Any] = {"lines": 0, "interactions": 0, "duplicates_skipped": 0, "medical_summaries": 0, "users": 0, "error_count": 0, "errors": []}
+    seen_users: Set[str] = set()
+    clear_first: Set[str] = set()
+    batch: List[Tuple] = []
+
+    def record_error(line_number: int, message: str):
+        result["error_count"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"line": line_number, "error": message})
+
+    async def apply_batch():
+        nonlocal batch, clear_first
+        if batch or clear_first:
+            counts = await run_io(memory.import_records, batch, clear_first)
+            for key, value in counts.items():
+                result[key] += value
+        batch, clear_first = [], set()
+
+    async def handle_line(raw_line: bytes):
+        result["lines"] += 1
+        if not raw_line.strip():
+            return
+        try:
+            record = _parse_record(raw_line, target_user_id)
+        except ImportFormatError:
+            if result["lines"] == 1:
+                raise
+            record_error(result["lines"], "header is only allowed on the first line")
+            return
+        except (ValueError, UnicodeDecodeError) as e: # json.JSONDecodeError is a ValueError
+            record_error(result["lines"], str(e))
+            return
+        if record is None:
+            return
+        user_id = record[1]
+        if user_id not in seen_users:
+            seen_users.add(user_id)
+            if replace:
+                clear_first.add(user_id)
+        batch.append(record)
+        if len(batch) >= IMPORT_BATCH_RECORDS:
+            await apply_batch()
+
+    def reject_long_line():
+        result["lines"] += 1
+        record_error(result["lines"], f"line longer than {MAX_IMPORT_LINE_BYTES} bytes")
+
+    buffer = b""
+    skipping_long_line = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for raw_line in lines:
+            if skipping_long_line: # Tail of a line that was already rejected as too long
+                skipping_long_line = False
+                continue
+            if len(raw_line) > MAX_IMPORT_LINE_BYTES: # Arrived whole inside one large chunk
+                reject_long_line()
+                continue
+            await handle_line(raw_line)
+        if len(buffer) > MAX_IMPORT_LINE_BYTES:
+            if not skipping_long_line:
+                reject_long_line()
+            buffer, skipping_long_line = b"", True
+    if buffer and not skipping_long_line:
+        await handle_line(buffer)
+    await apply_batch()
+    result["users"] = len(seen_users)
+    return result
@@ -0,0 +1,99 @@
+# medical-assistant/utils/symptom_cache.py
+# Result cache for /symptoms/analyze. Many submissions are the same complaint listed in a different
+# order or with different case, spacing or duration wording, and each would otherwise cost a full
+# reasoning-model call. Requests are reduced to a canonical key (descriptions as symptom-lexicon
+# concept IDs where the lexicon covers them, else normalized; bucketed duration, severity, region,
+# model) and the parsed analysis is kept for a TTL. Concurrent misses on one key share a single
+# upstream call.
+import hashlib
+import json
+import re
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from shared_services.llm_cache import LRUTTLCache
+from shared_services.singleflight import SingleFlight
+from ..config import settings
+from .symptom_lexicon import get_lexicon
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?|an?|one|two|three|four|five|six|seven|couple(?: of)?|few|several)\s*(min|minute|hr|hour|day|wk|week|month|year)s?\b")
+DURATION_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+                  "couple": 2, "couple of": 2, "few": 3, "several": 4}
+DAYS_PER_UNIT = {"min": 1 / 1440, "minute": 1 / 1440, "hr": 1 / 24, "hour": 1 / 24, "day": 1, "wk": 7, "week": 7, "month": 30, "year": 365}
+# (upper bound in days, bucket) after "under_1_day"; anything longer is "over_1_month"
+DURATION_BUCKETS = ((3, "1_to_3_days"), (7, "4_to_7_days"), (30, "1_to_4_weeks"))
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Lower-cased words only: "  Sore-Throat!" and "sore throat" normalize alike."""
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+def duration_bucket(duration: Optional[str]) -> str:
+    """Coarse bucket for a free-text duration ("2 days", "a few weeks", "since yesterday"). Text
+    without a recognizable amount falls back to its normalized form."""
+    text = normalize_text(duration)
+    match = DURATION_PATTERN.search(text)
+    if match:
+        amount, unit = match.groups()
+        days = (float(amount) if amount[0].isdigit() else DURATION_WORDS[amount]) * DAYS_PER_UNIT[unit]
+    elif text in ("today", "this morning", "tonight", "since this morning"):
+        days = 0
+    elif "yesterday" in text:
+        days = 1
+    else:
+        return text or "unknown"
+    if days < 1:
+        return "under_1_day"
+    for upper_bound, bucket in DURATION_BUCKETS:
+        if days <= upper_bound:
+            return bucket
+    return "over_1_month"
+
+
+def canonical_symptoms(symptoms: Iterable[Any]) -> Tuple[Tuple[str, str, int], ...]:
+    """(description key, duration bucket, severity) per symptom, deduplicated and sorted, from objects
+    with description/duration/severity attributes (ReactSymptomInput). "Head ache" and "headaches"
+    share the concept key "sym.headache"; text the lexicon doesn't fully cover is keyed as normalized words."""
+    lexicon = get_lexicon()
+    return tuple(sorted({(lexicon.canonical_form(s.description) or normalize_text(s.description), duration_bucket(s.duration),
+                          min(3, max(1, int(s.severity or 1)))) for s in symptoms}))
+
+
+class SymptomResultCache:
+    """Analysis results by canonical symptom set. Only results whose prompt carried no per-user history
+    belong here; callers must bypass the cache for users who have history."""
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[int] = None, enabled: Optional[bool] = None):
+        self.ttl_seconds = ttl_seconds or settings.SYMPTOM_CACHE_TTL_SECONDS
+        self.enabled = settings.SYMPTOM_CACHE_ENABLED if enabled is None else enabled
+        self._cache = LRUTTLCache(max_entries or settings.SYMPTOM_CACHE_MAX_ENTRIES) # Only touched on the event loop
+        self._single_flight = SingleFlight("symptom_results")
+        self.stats_counters = {"hits": 0, "misses": 0, "bypassed": 0}
+
+    @staticmethod
+    def make_key(symptoms: Iterable[Any], region: Optional[str], model_name: str) -> str:
+        canonical = json.dumps({"symptoms": canonical_symptoms(symptoms), "region": normalize_text(region), "model": model_name})
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """The cached result for key, or compute()'s result (stored unless it carries an "error").
+        Returns (result, hit)."""
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.stats_counters["hits"] += 1
+            return cached, True
+        self.stats_counters["misses"] += 1
+
+        async def compute_and_store() -> Dict[str, Any]:
+            result = await compute()
+            if not result.get("error"):
+                self._cache.set(key, result, self.ttl_seconds)
+            return result
+
+        return await self._single_flight.do(key, compute_and_store), False
+
+    def record_bypass(self):
+        self.stats_counters["bypassed"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.stats_counters, "entries": len(self._cache), "enabled": self.enabled, "ttl_seconds": self.ttl_seconds}
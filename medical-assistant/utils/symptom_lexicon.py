@@ -0,0 +1,146 @@
+# medical-assistant/utils/symptom_lexicon.py
+# Local symptom/condition vocabulary (data/symptom_lexicon.json) compiled into a word-level
+# Aho-Corasick automaton, so free text maps to canonical concept IDs ("head ache", "Headaches" and
+# "cephalgia" -> "sym.headache") in one pass over its words, with no network call. The IDs key the
+# symptom result cache, deduplicate the medical summary's symptom log and diagnoses, and are indexed
+# alongside the words of each past interaction for retrieval. Since equal IDs are treated as the same
+# complaint, a concept lists only true synonyms: a qualified presentation ("dry cough", "vertigo",
+# "hives") is its own concept, never a synonym of the broader one.
+import json
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..config import settings
+from .history_index import fold_plural
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+CONCEPT_TERM_PREFIX = "concept:" # Index terms for concept IDs; can't collide with word terms
+
+
+def lexicon_tokens(text: Optional[str]) -> List[str]:
+    # No stopword removal here: "feeling cold" and "cold" must stay different phrases
+    return [fold_plural(token) for token in WORD_PATTERN.findall((text or "").lower())]
+
+
+class SymptomLexicon:
+    """Concept lookup over a list of {"id", "label", "kind", "synonyms"} entries. Matching is on
+    whole words, case-insensitive, with plurals folded; overlapping matches resolve leftmost-longest."""
+
+    def __init__(self, concepts: Iterable[Dict[str, Any]] = ()):
+        self.labels: Dict[str, str] = {}
+        self.kinds: Dict[str, str] = {}
+        # The automaton: per state, word -> next state, the failure link, the (length, concept id) of
+        # the phrase ending here (if any) and the nearest state on the failure chain that has one
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._phrase: List[Optional[Tuple[int, str]]] = [None]
+        self._output_link: List[int] = [0]
+        for concept in concepts:
+            concept_id = concept["id"]
+            self.labels[concept_id] = concept.get("label") or concept_id
+            self.kinds[concept_id] = concept.get("kind") or "symptom"
+            for synonym in [concept.get("label") or ""] + list(concept.get("synonyms") or []):
+                self._add_phrase(lexicon_tokens(synonym), concept_id)
+        self._build_failure_links()
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def _add_phrase(self, words: List[str], concept_id: str):
+        if not words:
+            return
+        state = 0
+        for word in words:
+            next_state = self._goto[state].get(word)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][word] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._phrase.append(None)
+                self._output_link.append(0)
+            state = next_state
+        existing = self._phrase[state]
+        if existing is not None and existing[1] != concept_id:
+            print(f"SYMPTOM_LEXICON: WARNING - '{' '.join(words)}' is listed for both '{existing[1]}' and '{concept_id}'; keeping '{existing[1]}'.")
+            return
+        self._phrase[state] = (len(words), concept_id)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            fail_state = self._fail[state]
+            self._output_link[state] = fail_state if self._phrase[fail_state] is not None else self._output_link[fail_state]
+            for word, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = fail_state
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(word, 0)
+
+    def _matches(self, words: List[str]) -> List[Tuple[int, int, str]]:
+        """Every (start, end, concept id) phrase occurrence over words, by end position."""
+        found, state = [], 0
+        for position, word in enumerate(words):
+            while state and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            output_state = state if self._phrase[state] is not None else self._output_link[state]
+            while output_state:
+                length, concept_id = self._phrase[output_state]
+                found.append((position + 1 - length, position + 1, concept_id))
+                output_state = self._output_link[output_state]
+        return found
+
+    def find(self, text: Optional[str]) -> List[Tuple[int, int, str]]:
+        """Non-overlapping (start word, end word, concept id) matches in text, leftmost-longest first."""
+        selected, covered_until = [], 0
+        for start, end, concept_id in sorted(self._matches(lexicon_tokens(text)), key=lambda match: (match[0], -match[1])):
+            if start >= covered_until:
+                selected.append((start, end, concept_id))
+                covered_until = end
+        return selected
+
+    def concept_ids(self, text: Optional[str]) -> List[str]:
+        """Distinct concept IDs mentioned in text, in order of first mention."""
+        return list(dict.fromkeys(concept_id for _, _, concept_id in self.find(text)))
+
+    def canonical_form(self, text: Optional[str]) -> Optional[str]:
+        """Sorted concept IDs joined with "+" when the lexicon accounts for every word of text (so
+        "Head ache" and "headaches" agree); None if any word is left over, since then the text
+        may say more than its concepts do ("headache behind the left eye")."""
+        words = lexicon_tokens(text)
+        matches = self.find(text)
+        if not words or sum(end - start for start, end, _ in matches) != len(words):
+            return None
+        return "+".join(sorted({concept_id for _, _, concept_id in matches}))
+
+    def concept_key(self, text: Optional[str]) -> str:
+        """canonical_form, or the normalized words of text when it has none. Equal keys mean the same complaint."""
+        return self.canonical_form(text) or " ".join(lexicon_tokens(text))
+
+    def concept_terms(self, text: Optional[str]) -> List[str]:
+        """Index terms for the concepts mentioned in text (see BM25Index extra_terms)."""
+        return [CONCEPT_TERM_PREFIX + concept_id for concept_id in self.concept_ids(text)]
+
+
+def load_lexicon(path: str) -> SymptomLexicon:
+    with open(path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    return SymptomLexicon(data.get("concepts") or [])
+
+
+@lru_cache(maxsize=None)
+def get_lexicon() -> SymptomLexicon:
+    """The shared lexicon from SYMPTOM_LEXICON_PATH, loaded on first use. An unreadable file leaves an
+    empty lexicon: nothing is recognized and callers fall back to plain text."""
+    try:
+        lexicon = load_lexicon(settings.SYMPTOM_LEXICON_PATH)
+        print(f"SYMPTOM_LEXICON: Loaded {len(lexicon)} concepts from {settings.SYMPTOM_LEXICON_PATH}.")
+        return lexicon
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"SYMPTOM_LEXICON: WARNING - Could not load {settings.SYMPTOM_LEXICON_PATH} ({e.__class__.__name__}: {e}); concept matching is off.")
+        return SymptomLexicon()
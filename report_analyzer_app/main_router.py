@@ -11,11 +11,12 @@ import shutil
 import uuid
 import json
 import re 
-from openai import OpenAI 
 from pydantic import BaseModel
 from PIL import Image 
 import PyPDF2 
 import base64 
+from shared_services import perplexity_client
+from shared_services.blocking_io import run_io
 
 PROJECT_ROOT_FOR_ENV = Path(__file__).resolve().parent.parent
 DOTENV_PATH = PROJECT_ROOT_FOR_ENV / '.env'
@@ -87,9 +88,6 @@ OPENAI_COMPATIBLE_API_KEY_FOR_REPORTS = os.getenv('PERPLEXITY_API_KEY')
 OPENAI_COMPATIBLE_BASE_URL_FOR_REPORTS = os.getenv('PERPLEXITY_API_BASE_URL', "https://api.perplexity.ai/chat/completions")
 MODEL_FOR_REPORTS_ROUTER_SVC = os.getenv('REPORT_APP_AI_MODEL', "sonar-pro")
 
-openai_client_for_reports = None
-
-
 
 # --- File Processing Functions (Your existing functions: extract_text_from_file, image_to_base64_data_uri) ---
 def extract_text_from_file(file_path: str, file_type: str) -> str:
@@ -361,8 +359,6 @@ async def analyze_report_with_ai(content_input: Any, file_name: str) -> Dict:
              print("ERROR: AI_ANALYZE: Perplexity API key not configured or invalid.")
              raise ValueError("Perplexity API key not configured or invalid.")
 
-        client = OpenAI(api_key=API_KEY, base_url="https://api.perplexity.ai")
-        
         system_prompt = """You are a medical AI assistant. Your primary task is to accurately transcribe and list medical parameters and identify abnormalities from the provided report content (text or image).
 
 TASK:
@@ -396,13 +392,19 @@ Prioritize information directly present in the report.
             raise ValueError(f"Unsupported content_input type: {type(content_input)}")
 
         print(f"DEBUG: AI_ANALYZE: Sending request for {file_name}...")
-        response = client.chat.completions.create(
-            model="sonar-pro", # Using a potentially more capable model
-            messages=messages, 
-            max_tokens=3500, # Increased max tokens
-            temperature=0.1 
-        )
-        ai_full_response_text = response.choices[0].message.content
+        # Async call over the shared pool: the old synchronous OpenAI client blocked the whole
+        # event loop (every other route on this worker) for the length of the vision/LLM call.
+        payload = {
+            "model": "sonar-pro", # Using a potentially more capable model
+            "messages": messages, 
+            "max_tokens": 3500, # Increased max tokens
+            "temperature": 0.1 
+        }
+        response_data = await perplexity_client.create_chat_completion(payload, API_KEY, cache_mode="report", app="report_analyzer")
+        if not response_data.get("choices") or not response_data["choices"][0].get("message"):
+            error_msg = response_data.get("error", {}).get("message", "Unknown API response format.")
+            raise ValueError(f"AI API returned an error: {error_msg}")
+        ai_full_response_text = response_data["choices"][0]["message"]["content"]
         print(f"DEBUG: AI_ANALYZE: Perplexity Full Response (first 1000 chars): {ai_full_response_text[:1000]}...")
 
         structured_data_obj = parse_structured_analysis(ai_full_response_text) 
@@ -422,6 +424,51 @@ Prioritize information directly present in the report.
         )
         return {"summary": f"Error during AI analysis: {str(e_ai)}", "detailed_analysis": f"AI analysis could not be completed. Error: {str(e_ai)}", "structured_data": error_s_data.dict(), "follow_up_recommendations": "Consult provider; AI analysis failed."}
 
+# --- Blocking file helpers (always called through run_io from the async routes below) ---
+def _write_result_file(path: str, data: Dict[str, Any]):
+    with open(path, 'w') as f: json.dump(data, f, indent=2)
+
+def _save_upload(source_file, file_path: str):
+    with open(file_path, "wb") as buffer: shutil.copyfileobj(source_file, buffer)
+
+def _load_result_file(analysis_id: str) -> Optional[Dict[str, Any]]:
+    for path in (os.path.join(RESULTS_DIR, f"{analysis_id}.json"), os.path.join(RESULTS_DIR, f"{analysis_id}_error.json")):
+        if os.path.exists(path):
+            with open(path, 'r') as f: return json.load(f)
+    return None
+
+def _upload_exists(analysis_id: str) -> bool:
+    return any(filename.startswith(analysis_id) for filename in os.listdir(UPLOAD_DIR))
+
+def _load_unseen_result_files(known_ids: set) -> Dict[str, Dict[str, Any]]:
+    """Reads result files for reports not yet in analysis_results (e.g. from before a restart)."""
+    loaded: Dict[str, Dict[str, Any]] = {}
+    for res_file in os.listdir(RESULTS_DIR):
+        if res_file.endswith(".json"):
+            report_id_base = res_file.replace(".json", "").replace("_error", "") 
+            if report_id_base not in known_ids and report_id_base not in loaded: 
+                try:
+                    with open(os.path.join(RESULTS_DIR, res_file), 'r') as f: 
+                        loaded[report_id_base] = json.load(f) 
+                except Exception as e_load: print(f"WARN: LIST_REPORTS: Failed to load {res_file}: {e_load}")
+    return loaded
+
+def _delete_report_files(analysis_id: str) -> bool:
+    deleted_something = False
+    for suffix in [".json", "_error.json"]:
+        res_path = os.path.join(RESULTS_DIR, f"{analysis_id}{suffix}")
+        if os.path.exists(res_path):
+            try: os.remove(res_path); deleted_something = True; print(f"DEBUG: DELETE: Removed result file {res_path}")
+            except Exception as e_del_res: print(f"WARN: DELETE: Could not delete result file {res_path}: {e_del_res}")
+
+    for filename in os.listdir(UPLOAD_DIR):
+        if filename.startswith(analysis_id):
+            try:
+                upload_path = os.path.join(UPLOAD_DIR, filename)
+                os.remove(upload_path); deleted_something = True; print(f"DEBUG: DELETE: Removed upload file {upload_path}"); break 
+            except Exception as e_del_up: print(f"WARN: DELETE: Could not delete upload file {upload_path}: {e_del_up}")
+    return deleted_something
+
 # --- Report Processing Logic (Your existing process_report) ---
 async def process_report(file_path: str, file_name: str, analysis_id: str):
     """Background task to process the report (extract content, then call AI)."""
@@ -429,7 +476,8 @@ async def process_report(file_path: str, file_name: str, analysis_id: str):
     try:
         file_extension = file_name.split('.')[-1].lower() if '.' in file_name else 'txt'
         print(f"DEBUG: PROCESS_REPORT: Extracting content from {file_name}...")
-        extracted_content_or_marker = extract_text_from_file(file_path, file_extension)
+        # PDF parsing and image verification are blocking; keep them off the event loop
+        extracted_content_or_marker = await run_io(extract_text_from_file, file_path, file_extension)
         ai_input_payload: Any = None 
 
         if extracted_content_or_marker.startswith("ERROR:"): 
@@ -438,7 +486,7 @@ async def process_report(file_path: str, file_name: str, analysis_id: str):
         elif extracted_content_or_marker.startswith("IMAGE_FILE:"): 
             image_actual_path = extracted_content_or_marker.split(":", 1)[1]
             print(f"DEBUG: PROCESS_REPORT: Image file identified: {image_actual_path}. Encoding.")
-            base64_image_uri = image_to_base64_data_uri(image_actual_path)
+            base64_image_uri = await run_io(image_to_base64_data_uri, image_actual_path)
             if not base64_image_uri: raise Exception(f"Failed to encode image {image_actual_path} to base64.")
             user_query_for_image = (f"This is a medical report image from file '{file_name}'. Analyze its content thoroughly, extract visible text, parameters, and findings according to the system prompt.")
             ai_input_payload = [{"type": "text", "text": user_query_for_image}, {"type": "image_url", "image_url": {"url": base64_image_uri}}]
@@ -475,7 +523,7 @@ async def process_report(file_path: str, file_name: str, analysis_id: str):
         )
         analysis_results[analysis_id] = result.dict() 
         results_file_path = os.path.join(RESULTS_DIR, f"{analysis_id}.json") 
-        with open(results_file_path, 'w') as f: json.dump(result.dict(), f, indent=2)
+        await run_io(_write_result_file, results_file_path, result.dict())
         print(f"DEBUG: PROCESS_REPORT: Analysis completed for {file_name}. Results saved to {results_file_path}")
     
     except Exception as e_proc: 
@@ -488,7 +536,7 @@ async def process_report(file_path: str, file_name: str, analysis_id: str):
         )
         analysis_results[analysis_id] = error_result_obj.dict() 
         try: 
-            with open(os.path.join(RESULTS_DIR, f"{analysis_id}_error.json"), 'w') as f_err: json.dump(error_result_obj.dict(), f_err, indent=2)
+            await run_io(_write_result_file, os.path.join(RESULTS_DIR, f"{analysis_id}_error.json"), error_result_obj.dict())
         except Exception as ef_write: print(f"ERROR: PROCESS_REPORT: Additionally, failed to write error file: {ef_write}")
 
 # --- CORS Configuration ---
@@ -513,7 +561,7 @@ async def upload_report_endpoint(background_tasks: BackgroundTasks, file: Upload
     file_path = os.path.join(UPLOAD_DIR, f"{analysis_id}_{safe_original_filename}")
     
     try: 
-        with open(file_path, "wb") as buffer: shutil.copyfileobj(file.file, buffer)
+        await run_io(_save_upload, file.file, file_path)
         print(f"DEBUG: UPLOAD: File saved: {file_path}")
     except Exception as e_save: 
         print(f"ERROR: UPLOAD: Could not save file: {e_save}")
@@ -529,23 +577,16 @@ async def get_report_analysis_endpoint(analysis_id: str):
         try: return AnalysisResult(**analysis_results[analysis_id])
         except Exception as e_val: print(f"WARN: GET_REPORT: Pydantic validation error for in-memory result {analysis_id}: {e_val}")
     
-    primary_path = os.path.join(RESULTS_DIR, f"{analysis_id}.json")
-    error_path = os.path.join(RESULTS_DIR, f"{analysis_id}_error.json")
-    target_path = None
-    if os.path.exists(primary_path): target_path = primary_path
-    elif os.path.exists(error_path): target_path = error_path
-
-    if target_path: 
-        with open(target_path, 'r') as f: data = json.load(f)
+    data = await run_io(_load_result_file, analysis_id)
+    if data is not None: 
         analysis_results[analysis_id] = data 
         return AnalysisResult(**data) 
 
-    for filename in os.listdir(UPLOAD_DIR): 
-        if filename.startswith(analysis_id):
-            # File exists in upload, but no result yet. This indicates "in progress"
-            # We can make the frontend poll or wait for this status.
-            # For now, keep HTTPException but with a specific message for the frontend to interpret.
-            raise HTTPException(status_code=202, detail="Analysis is still in progress.") 
+    if await run_io(_upload_exists, analysis_id): 
+        # File exists in upload, but no result yet. This indicates "in progress"
+        # We can make the frontend poll or wait for this status.
+        # For now, keep HTTPException but with a specific message for the frontend to interpret.
+        raise HTTPException(status_code=202, detail="Analysis is still in progress.") 
             
     raise HTTPException(status_code=404, detail="Analysis not found.")
 
@@ -553,18 +594,9 @@ async def get_report_analysis_endpoint(analysis_id: str):
 @router.get("/api/reports", response_model=Dict[str, List[Dict[str, str]]])
 async def list_all_reports_endpoint():
     reports_summary = []
+    analysis_results.update(await run_io(_load_unseen_result_files, set(analysis_results.keys())))
     all_report_ids = set(analysis_results.keys()) 
     
-    for res_file in os.listdir(RESULTS_DIR):
-        if res_file.endswith(".json"):
-            report_id_base = res_file.replace(".json", "").replace("_error", "") 
-            all_report_ids.add(report_id_base)
-            if report_id_base not in analysis_results: 
-                try:
-                    with open(os.path.join(RESULTS_DIR, res_file), 'r') as f: 
-                        analysis_results[report_id_base] = json.load(f) 
-                except Exception as e_load: print(f"WARN: LIST_REPORTS: Failed to load {res_file}: {e_load}")
-    
     for analysis_id_key in sorted(list(all_report_ids)): 
         result_data = analysis_results.get(analysis_id_key)
         if not result_data: continue 
@@ -585,19 +617,7 @@ async def list_all_reports_endpoint():
 async def delete_specific_report_endpoint(analysis_id: str):
     deleted_something = False
     if analysis_id in analysis_results: del analysis_results[analysis_id]; deleted_something = True 
-    
-    for suffix in [".json", "_error.json"]:
-        res_path = os.path.join(RESULTS_DIR, f"{analysis_id}{suffix}")
-        if os.path.exists(res_path):
-            try: os.remove(res_path); deleted_something = True; print(f"DEBUG: DELETE: Removed result file {res_path}")
-            except Exception as e_del_res: print(f"WARN: DELETE: Could not delete result file {res_path}: {e_del_res}")
-
-    for filename in os.listdir(UPLOAD_DIR):
-        if filename.startswith(analysis_id):
-            try:
-                upload_path = os.path.join(UPLOAD_DIR, filename)
-                os.remove(upload_path); deleted_something = True; print(f"DEBUG: DELETE: Removed upload file {upload_path}"); break 
-            except Exception as e_del_up: print(f"WARN: DELETE: Could not delete upload file {upload_path}: {e_del_up}")
+    if await run_io(_delete_report_files, analysis_id): deleted_something = True
 
     if not deleted_something: raise HTTPException(status_code=404, detail="Report or associated files not found for deletion.")
     return {"message": f"Report {analysis_id} and associated files deleted successfully."}
@@ -0,0 +1,63 @@
+# shared_services/blocking_io.py
+# One bounded thread pool for blocking disk work done on behalf of async routes (history storage,
+# report uploads and result files, the response cache's disk tier). Keeping it separate from the
+# default executor means a slow disk can only back up this pool, not the threads FastAPI uses for
+# sync routes and UploadFile reads, and never the event loop itself.
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+MAX_WORKERS = int(os.getenv('BLOCKING_IO_WORKERS', '16'))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_counters_lock = threading.Lock() # Updated from worker threads and the event loop
+_counters: Dict[str, int] = {"submitted": 0, "running": 0, "completed": 0}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="blocking-io")
+    return _executor
+
+
+def _tracked_call(func: Callable[..., Any]) -> Any:
+    with _counters_lock:
+        _counters["running"] += 1
+    try:
+        return func()
+    finally:
+        with _counters_lock:
+            _counters["running"] -= 1
+            _counters["completed"] += 1
+
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Runs func(*args, **kwargs) on the blocking-I/O pool and awaits the result. Context variables
+    (e.g. the telemetry endpoint label) are carried into the worker thread."""
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    with _counters_lock:
+        _counters["submitted"] += 1
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), _tracked_call, call)
+
+
+def stats() -> Dict[str, int]:
+    with _counters_lock:
+        submitted, running, completed = _counters["submitted"], _counters["running"], _counters["completed"]
+    return {"max_workers": MAX_WORKERS, "running": running, "queued": max(0, submitted - completed - running), "completed": completed}
+
+
+def shutdown():
+    """Waits for queued work (e.g. result files being written) and stops the pool."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
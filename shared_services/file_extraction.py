@@ -0,0 +1,195 @@
+# shared_services/file_extraction.py
+# Format-aware text extraction for uploaded files: PDF text layers, text files in common encodings,
+# and images (no OCR here; a downscaled JPEG is prepared for vision-capable models instead). Parsing
+# runs in a small process pool so a large PDF never holds the event loop or the GIL, and results
+# are cached by content hash, so asking about the same file again skips extraction entirely.
+import asyncio
+import base64
+import codecs
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+import PyPDF2
+from PIL import Image
+
+from .blocking_io import run_io
+from .llm_cache import LRUTTLCache
+
+MAX_WORKERS = int(os.getenv('FILE_EXTRACTION_WORKERS', '2'))
+CACHE_MAX_ENTRIES = int(os.getenv('FILE_EXTRACTION_CACHE_ENTRIES', '256'))
+CACHE_TTL_SECONDS = 24 * 3600
+EXTRACTION_TIMEOUT_SECONDS = 60.0
+SPOOL_CHUNK_BYTES = 1024 * 1024
+IMAGE_MAX_SIDE = 1024 # Longest side of the copy sent to the model
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'tiff', 'tif', 'bmp', 'gif', 'webp')
+TEXT_ENCODINGS = ('utf-8', 'cp1252') # latin-1 is the last resort; it decodes anything
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_cache = LRUTTLCache(CACHE_MAX_ENTRIES) # Only touched on the event loop
+_stats_counters = {"cache_hits": 0, "extractions": 0, "errors": 0}
+
+
+def detect_format(head: bytes, file_name: str, content_type: str) -> str:
+    """"pdf", "image", "text" or "binary", from magic bytes first, then extension and content type."""
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith((b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"BM", b"II*\x00", b"MM\x00*")) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP"):
+        return "image"
+    extension = os.path.splitext(file_name or "")[1].lower().lstrip('.')
+    content_type = (content_type or "").lower()
+    if extension == 'pdf' or content_type == 'application/pdf':
+        return "pdf"
+    if extension in IMAGE_EXTENSIONS or content_type.startswith('image/'):
+        return "image"
+    if head.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return "text" # UTF-16 with a byte order mark
+    return "binary" if b"\x00" in head[:8192] else "text"
+
+
+def _extract_pdf(path: str, max_chars: int) -> Dict[str, Any]:
+    reader = PyPDF2.PdfReader(path)
+    if reader.is_encrypted:
+        reader.decrypt("") # Many "encrypted" PDFs only restrict editing and open with an empty password
+    page_count = len(reader.pages)
+    text_parts, length = [], 0
+    for page in reader.pages: # Stop once we have enough text; later pages are never parsed
+        page_text = (page.extract_text() or "").strip()
+        if page_text:
+            text_parts.append(page_text)
+            length += len(page_text)
+        if length > max_chars:
+            break
+    text = "\n".join(text_parts)
+    detail = f"PDF, {page_count} page(s)" if text else f"PDF, {page_count} page(s), no text layer (possibly a scan)"
+    return {"text": text[:max_chars], "truncated": len(text) > max_chars, "detail": detail}
+
+
+def _extract_image(path: str) -> Dict[str, Any]:
+    with Image.open(path) as img:
+        image_format, (width, height) = img.format or "image", img.size
+        img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+        buffer = io.BytesIO()
+        img.convert("RGB").save(buffer, format="JPEG", quality=85)
+    data_uri = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+    return {"text": "", "truncated": False, "detail": f"{image_format} image, {width}x{height}", "image_data_uri": data_uri}
+
+
+def _extract_text(path: str, max_chars: int) -> Dict[str, Any]:
+    with open(path, 'rb') as file:
+        raw = file.read(4 * max_chars + 4) # Enough bytes for max_chars characters in any supported encoding
+        more_data = bool(file.read(1))
+    text = None
+    for bom, encoding in ((b"\xef\xbb\xbf", "utf-8-sig"), (b"\xff\xfe", "utf-16"), (b"\xfe\xff", "utf-16")):
+        if raw.startswith(bom):
+            text = raw.decode(encoding, errors="ignore")
+            break
+    for encoding in TEXT_ENCODINGS if text is None else ():
+        try:
+            # final=False: a multi-byte character cut off by the read limit is not a decode error
+            text = codecs.getincrementaldecoder(encoding)().decode(raw, final=not more_data)
+            break
+        except UnicodeDecodeError:
+            continue
+    if text is None:
+        text, encoding = raw.decode("latin-1"), "latin-1"
+    text = text.strip()
+    return {"text": text[:max_chars], "truncated": more_data or len(text) > max_chars, "detail": f"text ({encoding})" if text else "empty text file"}
+
+
+def extract_file(path: str, file_name: str, content_type: str, max_chars: int) -> Dict[str, Any]:
+    """
+    Extracts up to max_chars of text from the file at path. Runs in a worker process. Returns
+    {"format", "text", "truncated", "detail"} plus "image_data_uri" for images or "error" on failure.
+    """
+    with open(path, 'rb') as file:
+        file_format = detect_format(file.read(8192), file_name, content_type)
+    try:
+        if file_format == "pdf":
+            result = _extract_pdf(path, max_chars)
+        elif file_format == "image":
+            result = _extract_image(path)
+        elif file_format == "text":
+            result = _extract_text(path, max_chars)
+        else:
+            result = {"text": "", "truncated": False, "detail": "binary file, no text content"}
+    except Exception as e:
+        result = {"text": "", "truncated": False, "detail": f"unreadable {file_format} file", "error": f"{e.__class__.__name__}: {e}"}
+    result["format"] = file_format
+    return result
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn: workers don't inherit the server's threads and locks (and it is what Windows uses anyway)
+                _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _spool_to_temp_file(fileobj: BinaryIO, suffix: str) -> Tuple[str, str]:
+    # One sequential copy that also hashes the content; the worker process reads the copy by path
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, prefix="upload-") as spool:
+        while chunk := fileobj.read(SPOOL_CHUNK_BYTES):
+            digest.update(chunk)
+            spool.write(chunk)
+    return spool.name, digest.hexdigest()
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def extract_upload(fileobj: BinaryIO, file_name: str, content_type: str, max_chars: int) -> Dict[str, Any]:
+    """Extracts text from an uploaded file object (e.g. UploadFile.file) without blocking the event
+    loop. Same result shape as extract_file, plus "sha256" and "cached"."""
+    path, digest = await run_io(_spool_to_temp_file, fileobj, os.path.splitext(file_name or "")[1][:16])
+    try:
+        cache_key = f"{digest}:{max_chars}"
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            _stats_counters["cache_hits"] += 1
+            return {**cached, "sha256": digest, "cached": True}
+        _stats_counters["extractions"] += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(_get_executor(), extract_file, path, file_name, content_type, max_chars)
+            result = await asyncio.wait_for(future, EXTRACTION_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, BrokenProcessPool) as e:
+            _stats_counters["errors"] += 1
+            print(f"FILE_EXTRACTION: ERROR - Extraction of '{file_name}' failed: {e.__class__.__name__} {e}")
+            if isinstance(e, BrokenProcessPool):
+                shutdown(wait=False) # A worker died (e.g. out of memory); start a fresh pool next time
+            return {"format": "unknown", "text": "", "truncated": False, "detail": "extraction failed", "error": e.__class__.__name__, "sha256": digest, "cached": False}
+        if "error" in result:
+            _stats_counters["errors"] += 1
+        else:
+            _cache.set(cache_key, result, CACHE_TTL_SECONDS) # Failures are not cached, so a retry can succeed
+        return {**result, "sha256": digest, "cached": False}
+    finally:
+        await run_io(_remove_quietly, path)
+
+
+def stats() -> Dict[str, int]:
+    return {**_stats_counters, "cache_entries": len(_cache), "max_workers": MAX_WORKERS}
+
+
+def shutdown(wait: bool = True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
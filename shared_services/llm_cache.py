@@ -0,0 +1,186 @@
+# shared_services/llm_cache.py
+# Content-addressed cache for Perplexity chat completions. Identical prompts (same model,
+# system prompt, user prompt, temperature and max_tokens) are answered from an in-memory LRU
+# tier, then from an on-disk tier that survives restarts, before going upstream.
+# Disk entries hold the prompt's answer in plaintext, so only modes whose prompts carry no
+# personal or health data (LLM_CACHE_DISK_MODES) are written there; the rest stay in memory.
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+from .blocking_io import run_io
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+CACHE_DIR = Path(os.getenv('LLM_CACHE_DIR', str(PROJECT_ROOT / '.llm_cache')))
+CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MEMORY_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '512'))
+
+# Seconds a cached answer stays valid, per calling mode. Advisories go stale quickly;
+# general medical QnA and finished research reports do not. Override with LLM_CACHE_TTL_<MODE>.
+DEFAULT_MODE_TTLS: Dict[str, int] = {
+    "qna": 24 * 3600,
+    "symptoms": 6 * 3600,
+    "advisories": 30 * 60,
+    "report": 24 * 3600,
+    "survey_report": 7 * 24 * 3600,
+    "survey_follow_up": 24 * 3600,
+}
+FALLBACK_TTL_SECONDS = 3600
+
+# Modes persisted to the disk tier. Chat QnA, symptom analyses and medical reports are about a
+# specific person and are never written to disk, whatever this is set to.
+PERSONAL_MODES = frozenset({"qna", "symptoms", "report"})
+DISK_MODES = frozenset(
+    mode.strip() for mode in os.getenv('LLM_CACHE_DISK_MODES', 'advisories,survey_report,survey_follow_up').split(',')
+    if mode.strip() and mode.strip() not in PERSONAL_MODES
+)
+
+
+def get_ttl_for_mode(mode: str) -> int:
+    env_value = os.getenv("LLM_CACHE_TTL_" + mode.upper())
+    if env_value and env_value.isdigit():
+        return int(env_value)
+    return DEFAULT_MODE_TTLS.get(mode, FALLBACK_TTL_SECONDS)
+
+
+def make_cache_key(model_name: str, system_prompt: str, user_prompt: Any, temperature: Optional[float], max_tokens: Optional[int]) -> str:
+    # user_prompt may be a list of content parts (text + image_url) for vision requests
+    canonical = json.dumps(
+        {"model": model_name, "system": system_prompt, "user": user_prompt, "temperature": temperature, "max_tokens": max_tokens},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def make_cache_key_for_payload(payload: Dict[str, Any]) -> str:
+    system_prompt = "\n".join(m["content"] for m in payload.get("messages", []) if m.get("role") == "system" and isinstance(m.get("content"), str))
+    user_parts = [m.get("content") for m in payload.get("messages", []) if m.get("role") == "user"]
+    user_prompt = user_parts[0] if len(user_parts) == 1 else user_parts
+    return make_cache_key(payload.get("model", ""), system_prompt, user_prompt, payload.get("temperature"), payload.get("max_tokens"))
+
+
+class LRUTTLCache:
+    """Small in-memory LRU map whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: float, expires_at: Optional[float] = None):
+        self._entries[key] = (expires_at or time.time() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LLMResponseCache:
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_memory_entries: int = MEMORY_MAX_ENTRIES, disk_modes=DISK_MODES):
+        self.cache_dir = cache_dir
+        self.disk_modes = frozenset(disk_modes) - PERSONAL_MODES
+        self.memory = LRUTTLCache(max_memory_entries)
+        self.stats_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if entry.get("expires_at", 0) <= time.time():
+            try: os.remove(path)
+            except OSError: pass
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]):
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path) # Atomic, so readers never see a half-written entry
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats_counters["memory_hits"] += 1
+            return value
+        entry = await run_io(self._read_disk, key)
+        if entry is not None:
+            self.stats_counters["disk_hits"] += 1
+            self.memory.set(key, entry["response"], 0, expires_at=entry["expires_at"])
+            return entry["response"]
+        self.stats_counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, response_data: Dict[str, Any], mode: str):
+        ttl_seconds = get_ttl_for_mode(mode)
+        expires_at = time.time() + ttl_seconds
+        self.memory.set(key, response_data, ttl_seconds, expires_at=expires_at)
+        self.stats_counters["stores"] += 1
+        if mode not in self.disk_modes:
+            return
+        try:
+            await run_io(self._write_disk, key, {"mode": mode, "expires_at": expires_at, "response": response_data})
+        except OSError as e_write:
+            print(f"LLM_CACHE: WARNING - Could not persist cache entry {key[:12]}: {e_write}")
+
+    def prune_expired_disk_entries(self) -> int:
+        """Removes expired disk entries and any whose mode is not in disk_modes. Returns how many went."""
+        removed = 0
+        now = time.time()
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                # Entries for modes no longer persisted (e.g. personal ones written by older versions) go too
+                stale = entry.get("expires_at", 0) <= now or entry.get("mode") not in self.disk_modes
+            except (OSError, json.JSONDecodeError, AttributeError):
+                stale = True
+            if stale:
+                try: os.remove(path); removed += 1
+                except OSError: pass
+        return removed
+
+    def clear(self):
+        self.memory.clear()
+        for path in self.cache_dir.glob("*.json"):
+            try: os.remove(path)
+            except OSError: pass
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.stats_counters["memory_hits"] + self.stats_counters["disk_hits"]
+        lookups = hits + self.stats_counters["misses"]
+        return {
+            **self.stats_counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+        }
+
+
+llm_response_cache = LLMResponseCache()
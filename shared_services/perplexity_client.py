@@ -0,0 +1,243 @@
+# shared_services/perplexity_client.py
+# One pooled, keep-alive HTTP client per Perplexity model, shared by the chat assistant
+# and every sub-application. Creating an httpx.AsyncClient per request meant a fresh
+# DNS lookup, TCP connect and TLS handshake on every call.
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Any, Optional, List, AsyncIterator
+
+import httpx
+
+from . import llm_cache, resilience, telemetry
+from .blocking_io import run_io
+from .upstream_scheduler import upstream_scheduler, PRIORITY_STANDARD
+
+PERPLEXITY_API_BASE_URL = os.getenv('PERPLEXITY_API_BASE_URL', "https://api.perplexity.ai/chat/completions")
+DEFAULT_TIMEOUT_SECONDS = 180.0
+
+# HTTP/2 needs the optional 'h2' package (pip install httpx[http2]); fall back to HTTP/1.1 without it.
+HTTP2_REQUESTED = os.getenv('PERPLEXITY_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Max open connections per model. Long-running deep research calls get a small pool so they
+# cannot hog sockets; short interactive models get more. Override with
+# PERPLEXITY_POOL_LIMIT_<MODEL> (e.g. PERPLEXITY_POOL_LIMIT_SONAR_PRO=30).
+DEFAULT_MODEL_POOL_LIMITS: Dict[str, int] = {
+    "sonar": 20,
+    "sonar-pro": 20,
+    "sonar-reasoning-pro": 10,
+    "sonar-deep-research": 4,
+}
+FALLBACK_POOL_LIMIT = 10
+KEEPALIVE_EXPIRY_SECONDS = 60.0
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_pool_limit(model_name: str) -> int:
+    env_key = "PERPLEXITY_POOL_LIMIT_" + model_name.upper().replace("-", "_")
+    env_value = os.getenv(env_key)
+    if env_value and env_value.isdigit():
+        return int(env_value)
+    return DEFAULT_MODEL_POOL_LIMITS.get(model_name, FALLBACK_POOL_LIMIT)
+
+
+def _build_limits(model_name: str) -> httpx.Limits:
+    max_connections = get_pool_limit(model_name)
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def get_client(model_name: str) -> httpx.AsyncClient:
+    """Returns the shared async client for a model, creating it on first use."""
+    client = _clients.get(model_name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=HTTP2_REQUESTED and HTTP2_AVAILABLE,
+            limits=_build_limits(model_name),
+            timeout=DEFAULT_TIMEOUT_SECONDS,
+        )
+        _clients[model_name] = client
+    return client
+
+
+def build_headers(api_key: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
+
+
+async def create_chat_completion(
+    payload: Dict[str, Any],
+    api_key: str,
+    timeout: Optional[float] = None,
+    cache_mode: Optional[str] = None,
+    priority: str = PRIORITY_STANDARD,
+    app: str = "default",
+    hedge: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """
+    POSTs a chat completion payload over the pooled client for payload['model'] and returns the
+    decoded JSON body. httpx errors (HTTPStatusError, TimeoutException, RequestError) propagate
+    unchanged so callers keep their existing error handling.
+
+    When cache_mode is given (e.g. "qna", "advisories"), successful responses are cached under a
+    hash of the prompt and reused for that mode's TTL.
+
+    Cache misses wait for an upstream slot for the model; priority is one of the
+    upstream_scheduler lanes and app is the calling sub-app (used for fair queuing).
+
+    Upstream calls go through the resilience layer: timeout is only a ceiling on the model's
+    adaptive per-attempt timeout, failures are retried with backoff, hedge=True (or a model in
+    resilience.HEDGED_MODELS) hedges slow calls, and resilience.CircuitOpenError is raised
+    while the model's circuit is open.
+    """
+    cache_key = None
+    if cache_mode and llm_cache.CACHE_ENABLED:
+        cache_key = llm_cache.make_cache_key_for_payload(payload)
+        cached_response = await llm_cache.llm_response_cache.get(cache_key)
+        telemetry.record_cache_lookup(app, payload["model"], hit=cached_response is not None)
+        if cached_response is not None:
+            print(f"PERPLEXITY_CLIENT: Cache hit ({cache_mode}, model: {payload['model']}).")
+            return cached_response
+
+    client = get_client(payload["model"])
+
+    async def attempt(attempt_timeout: float) -> Dict[str, Any]:
+        response = await client.post(
+            PERPLEXITY_API_BASE_URL,
+            json=payload,
+            headers=build_headers(api_key),
+            timeout=attempt_timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    started = time.monotonic()
+    try:
+        response_data = await resilience.execute(payload["model"], attempt, timeout=timeout, hedge=hedge, priority=priority, app=app)
+    except Exception as e:
+        telemetry.record_call(app, payload["model"], time.monotonic() - started, error=e)
+        raise
+    telemetry.record_call(app, payload["model"], time.monotonic() - started, usage=response_data.get("usage"))
+
+    # Only cache real answers, never error bodies
+    if cache_key and response_data.get("choices") and response_data["choices"][0].get("message"):
+        await llm_cache.llm_response_cache.set(cache_key, response_data, cache_mode)
+    return response_data
+
+
+async def stream_chat_completion(
+    payload: Dict[str, Any],
+    api_key: str,
+    timeout: Optional[float] = None,
+    cache_mode: Optional[str] = None,
+    priority: str = PRIORITY_STANDARD,
+    app: str = "default",
+) -> AsyncIterator[str]:
+    """
+    Streams a chat completion (stream=true) and yields the content deltas as they arrive.
+    Raises the same httpx errors as create_chat_completion. A cached answer is yielded as a
+    single chunk; a completed stream is stored in the cache in the non-streaming response shape.
+    The upstream slot (see create_chat_completion) is held until the stream ends. Failures are
+    retried like create_chat_completion, but only until the first delta has been yielded.
+    """
+    cache_key = None
+    if cache_mode and llm_cache.CACHE_ENABLED:
+        cache_key = llm_cache.make_cache_key_for_payload(payload)
+        cached_response = await llm_cache.llm_response_cache.get(cache_key)
+        telemetry.record_cache_lookup(app, payload["model"], hit=cached_response is not None)
+        if cached_response is not None:
+            print(f"PERPLEXITY_CLIENT: Cache hit for stream ({cache_mode}, model: {payload['model']}).")
+            yield cached_response["choices"][0]["message"]["content"]
+            return
+
+    client = get_client(payload["model"])
+    content_parts: List[str] = []
+    last_chunk: Dict[str, Any] = {}
+    attempt_timeout = resilience.get_timeout(payload["model"], timeout)
+    attempt_number = 0
+    started = time.monotonic()
+    while True:
+        try:
+            resilience.check_circuit(payload["model"])
+            async with upstream_scheduler.slot(payload["model"], priority, app):
+                async with client.stream(
+                    "POST",
+                    PERPLEXITY_API_BASE_URL,
+                    json={**payload, "stream": True},
+                    headers={**build_headers(api_key), "Accept": "text/event-stream"},
+                    timeout=attempt_timeout,
+                ) as response:
+                    if response.is_error:
+                        await response.aread() # So callers can inspect the error body like a normal response
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data_str = line[len("data:"):].strip()
+                        if not data_str or data_str == "[DONE]":
+                            continue
+                        try:
+                            chunk = json.loads(data_str)
+                        except json.JSONDecodeError:
+                            print(f"PERPLEXITY_CLIENT: Skipping malformed stream chunk: {data_str[:100]}")
+                            continue
+                        last_chunk = chunk
+                        choices = chunk.get("choices") or [{}]
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if delta:
+                            content_parts.append(delta)
+                            yield delta
+        except Exception as e:
+            resilience.record_outcome(payload["model"], e)
+            if content_parts or not resilience.should_retry(e, attempt_number, attempt_timeout):
+                telemetry.record_call(app, payload["model"], time.monotonic() - started, kind="stream", error=e)
+                raise
+            delay = resilience.backoff_delay(attempt_number, e)
+            attempt_number += 1
+            print(f"PERPLEXITY_CLIENT: Stream for {payload['model']} failed before any output ({e.__class__.__name__}); retry {attempt_number} in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+            continue
+        resilience.record_outcome(payload["model"]) # Stream durations are not fed into the latency percentiles
+        telemetry.record_call(app, payload["model"], time.monotonic() - started, kind="stream", usage=last_chunk.get("usage"))
+        break
+
+    if cache_key and content_parts:
+        full_response = {
+            "id": last_chunk.get("id"),
+            "model": last_chunk.get("model", payload["model"]),
+            "usage": last_chunk.get("usage"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(content_parts)}, "finish_reason": "stop"}],
+        }
+        await llm_cache.llm_response_cache.set(cache_key, full_response, cache_mode)
+
+
+async def startup():
+    if HTTP2_REQUESTED and not HTTP2_AVAILABLE:
+        print("PERPLEXITY_CLIENT: WARNING - PERPLEXITY_HTTP2 is set but the 'h2' package is not installed. Using HTTP/1.1.")
+    # Warm the pools for the configured default models so the first request skips client setup.
+    for model_name in DEFAULT_MODEL_POOL_LIMITS:
+        get_client(model_name)
+    print(f"PERPLEXITY_CLIENT: Connection pools ready (HTTP/2: {HTTP2_REQUESTED and HTTP2_AVAILABLE}).")
+    if llm_cache.CACHE_ENABLED:
+        removed = await run_io(llm_cache.llm_response_cache.prune_expired_disk_entries)
+        print(f"PERPLEXITY_CLIENT: Response cache enabled ({removed} expired disk entries pruned).")
+
+
+async def shutdown():
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
+    print("PERPLEXITY_CLIENT: Connection pools closed.")
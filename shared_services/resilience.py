@@ -0,0 +1,295 @@
+# shared_services/resilience.py
+# Tail-latency controls for Perplexity calls: per-model timeouts derived from observed latency,
+# retries with exponential backoff and jitter, hedged requests for short calls, and a circuit
+# breaker that fails fast while the upstream is erroring instead of piling up sockets and waiters.
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import httpx
+
+from .upstream_scheduler import upstream_scheduler, PRIORITY_STANDARD
+
+# Upper bound on a single attempt, per model. Observed latency can only shrink the timeout below
+# this. Override with PERPLEXITY_TIMEOUT_<MODEL> (e.g. PERPLEXITY_TIMEOUT_SONAR_PRO=120).
+DEFAULT_MODEL_TIMEOUTS: Dict[str, float] = {
+    "sonar": 60.0,
+    "sonar-pro": 180.0,
+    "sonar-reasoning-pro": 180.0,
+    "sonar-deep-research": 900.0,
+}
+FALLBACK_TIMEOUT_SECONDS = 180.0
+MIN_TIMEOUT_SECONDS = float(os.getenv('PERPLEXITY_MIN_TIMEOUT_SECONDS', '20'))
+TIMEOUT_P99_MULTIPLIER = 2.0 # Adaptive timeout = p99 latency x this, clamped to [MIN, model ceiling]
+LATENCY_WINDOW = 200         # Recent successful calls kept per model
+MIN_LATENCY_SAMPLES = 20     # Below this, use the model ceiling and don't hedge on percentiles
+
+MAX_RETRIES = int(os.getenv('PERPLEXITY_MAX_RETRIES', '2'))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# A timed-out attempt is only retried when its timeout was short; re-running a 15 minute
+# deep-research wait just doubles the damage.
+RETRY_TIMEOUTS_UP_TO_SECONDS = 120.0
+
+# Models whose non-streaming calls are hedged: a duplicate request is sent if the first has not
+# answered after the model's p95 latency, and whichever finishes first wins. A hedge is only sent
+# when an upstream slot is free at that moment; under saturation it would just queue behind others.
+HEDGED_MODELS = {m.strip() for m in os.getenv('PERPLEXITY_HEDGED_MODELS', 'sonar').split(',') if m.strip()}
+HEDGE_DEFAULT_DELAY_SECONDS = 10.0 # Used until enough latency samples exist
+HEDGE_MIN_DELAY_SECONDS = 0.5
+
+CIRCUIT_WINDOW = 20              # Recent outcomes considered per model
+CIRCUIT_MIN_CALLS = 10           # Don't judge the upstream on fewer calls than this
+CIRCUIT_FAILURE_RATIO = 0.5      # Open when at least this share of recent calls failed
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv('PERPLEXITY_CIRCUIT_COOLDOWN_SECONDS', '30'))
+
+
+class CircuitOpenError(httpx.RequestError):
+    """Raised without calling upstream while a model's circuit is open. Subclasses
+    httpx.RequestError so existing 'network issue' error handling covers it."""
+
+
+def get_timeout_ceiling(model_name: str) -> float:
+    env_value = os.getenv("PERPLEXITY_TIMEOUT_" + model_name.upper().replace("-", "_"))
+    try:
+        if env_value: return float(env_value)
+    except ValueError:
+        pass
+    return DEFAULT_MODEL_TIMEOUTS.get(model_name, FALLBACK_TIMEOUT_SECONDS)
+
+
+class LatencyTracker:
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+    def timeout(self, ceiling: float) -> float:
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return ceiling
+        return min(ceiling, max(MIN_TIMEOUT_SECONDS, self.percentile(99) * TIMEOUT_P99_MULTIPLIER))
+
+    def hedge_delay(self) -> float:
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_SECONDS
+        return max(HEDGE_MIN_DELAY_SECONDS, self.percentile(95))
+
+
+class CircuitBreaker:
+    """closed -> open after too many recent failures; open -> half_open after the cooldown, when a
+    single trial call is let through; the trial's outcome closes or re-opens the circuit."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.state = "closed"
+        self.outcomes: Deque[bool] = deque(maxlen=CIRCUIT_WINDOW) # True = failure
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+        self.times_opened = 0
+
+    def before_call(self):
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < CIRCUIT_COOLDOWN_SECONDS:
+                raise CircuitOpenError(f"Circuit open for model {self.model_name}; upstream is failing, not calling it for now.")
+            self.state = "half_open"
+            self.trial_started_at = 0.0
+        if self.state == "half_open":
+            # One trial at a time; a trial that hangs past the cooldown frees the slot for another
+            if self.trial_started_at and now - self.trial_started_at < CIRCUIT_COOLDOWN_SECONDS:
+                raise CircuitOpenError(f"Circuit half-open for model {self.model_name}; waiting on a trial call.")
+            self.trial_started_at = now
+
+    def record(self, failed: bool):
+        if self.state == "half_open":
+            if failed:
+                self._open()
+            else:
+                self.state = "closed"
+                self.outcomes.clear()
+                print(f"RESILIENCE: Circuit closed again for model {self.model_name}.")
+            return
+        self.outcomes.append(failed)
+        if self.state == "closed" and len(self.outcomes) >= CIRCUIT_MIN_CALLS and sum(self.outcomes) / len(self.outcomes) >= CIRCUIT_FAILURE_RATIO:
+            self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        print(f"RESILIENCE: Circuit OPEN for model {self.model_name} for {CIRCUIT_COOLDOWN_SECONDS}s.")
+
+
+_latency_trackers: Dict[str, LatencyTracker] = {}
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+stats_counters: Dict[str, Dict[str, int]] = {}
+
+
+def _model_counters(model_name: str) -> Dict[str, int]:
+    return stats_counters.setdefault(model_name, {"calls": 0, "failures": 0, "retries": 0, "hedges_sent": 0, "hedges_skipped": 0, "hedge_wins": 0, "fast_failed": 0})
+
+
+def get_latency_tracker(model_name: str) -> LatencyTracker:
+    return _latency_trackers.setdefault(model_name, LatencyTracker())
+
+
+def get_circuit_breaker(model_name: str) -> CircuitBreaker:
+    breaker = _circuit_breakers.get(model_name)
+    if breaker is None:
+        breaker = _circuit_breakers[model_name] = CircuitBreaker(model_name)
+    return breaker
+
+
+def get_timeout(model_name: str, ceiling: Optional[float] = None) -> float:
+    """Per-attempt timeout for a model: adaptive from recent latency, never above the ceiling."""
+    return get_latency_tracker(model_name).timeout(ceiling if ceiling is not None else get_timeout_ceiling(model_name))
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Errors that say the upstream is unhealthy (as opposed to a bad request on our side)."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+def check_circuit(model_name: str):
+    try:
+        get_circuit_breaker(model_name).before_call()
+    except CircuitOpenError:
+        _model_counters(model_name)["fast_failed"] += 1
+        raise
+
+
+def record_outcome(model_name: str, error: Optional[Exception] = None, latency_seconds: Optional[float] = None):
+    if isinstance(error, CircuitOpenError):
+        return # Never reached the upstream; already counted as fast_failed
+    counters = _model_counters(model_name)
+    counters["calls"] += 1
+    failed = error is not None and is_upstream_failure(error)
+    if failed:
+        counters["failures"] += 1
+    if error is None and latency_seconds is not None:
+        get_latency_tracker(model_name).record(latency_seconds)
+    get_circuit_breaker(model_name).record(failed)
+
+
+def should_retry(error: Exception, attempt_number: int, attempt_timeout: float) -> bool:
+    if attempt_number >= MAX_RETRIES or not is_upstream_failure(error):
+        return False
+    if isinstance(error, httpx.TimeoutException) and not isinstance(error, httpx.ConnectTimeout):
+        return attempt_timeout <= RETRY_TIMEOUTS_UP_TO_SECONDS
+    return True
+
+
+def backoff_delay(attempt_number: int, error: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff; honours a 429's Retry-After when it is reasonable."""
+    if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+        retry_after = error.response.headers.get("Retry-After", "")
+        if retry_after.isdigit() and int(retry_after) <= BACKOFF_MAX_SECONDS * 4:
+            return float(retry_after) + random.uniform(0, BACKOFF_BASE_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt_number)))
+
+
+async def _hedged_attempt(model_name: str, attempt: Callable[[float], Awaitable[Any]], attempt_timeout: float, priority: str) -> Any:
+    """Runs attempt in the slot the caller already holds; the hedge, if sent, holds its own."""
+    primary = asyncio.ensure_future(attempt(attempt_timeout))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=get_latency_tracker(model_name).hedge_delay())
+        if done:
+            return primary.result()
+        if not upstream_scheduler.try_acquire(model_name, priority):
+            _model_counters(model_name)["hedges_skipped"] += 1
+            return await primary
+        _model_counters(model_name)["hedges_sent"] += 1
+        hedge = asyncio.ensure_future(attempt(attempt_timeout))
+        # Released from a callback: a task cancelled before it first runs never reaches a finally
+        hedge.add_done_callback(lambda _: upstream_scheduler.release(model_name))
+        tasks.append(hedge)
+        pending = set(tasks)
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        _model_counters(model_name)["hedge_wins"] += 1
+                    return task.result()
+                first_error = first_error or task.exception()
+        raise first_error
+    finally:
+        for task in tasks:
+            task.cancel() # No-op for finished tasks; stops the losing request
+
+
+async def execute(
+    model_name: str,
+    attempt: Callable[[float], Awaitable[Any]],
+    timeout: Optional[float] = None,
+    hedge: Optional[bool] = None,
+    priority: str = PRIORITY_STANDARD,
+    app: str = "default",
+) -> Any:
+    """
+    Runs attempt(timeout_seconds) with the model's adaptive timeout, retrying upstream failures
+    with backoff. attempt must be safe to repeat (chat completions are). Each try first waits for
+    an upstream_scheduler slot (priority lane, calling app); that wait is not counted as upstream
+    latency, so it never inflates the adaptive timeout or hedge delay. hedge defaults to whether
+    the model is in HEDGED_MODELS. Raises CircuitOpenError without calling upstream while the
+    model's circuit is open; otherwise the last attempt's error propagates.
+    """
+    attempt_timeout = get_timeout(model_name, timeout)
+    if hedge is None:
+        hedge = model_name in HEDGED_MODELS
+    attempt_number = 0
+    while True:
+        check_circuit(model_name)
+        try:
+            async with upstream_scheduler.slot(model_name, priority, app):
+                started = time.monotonic()
+                if hedge and get_circuit_breaker(model_name).state == "closed":
+                    result = await _hedged_attempt(model_name, attempt, attempt_timeout, priority)
+                else:
+                    result = await attempt(attempt_timeout)
+                latency_seconds = time.monotonic() - started
+        except Exception as e:
+            record_outcome(model_name, e)
+            if not should_retry(e, attempt_number, attempt_timeout):
+                raise
+            delay = backoff_delay(attempt_number, e)
+            attempt_number += 1
+            _model_counters(model_name)["retries"] += 1
+            print(f"RESILIENCE: {model_name} call failed ({e.__class__.__name__}); retry {attempt_number}/{MAX_RETRIES} in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+            continue
+        record_outcome(model_name, latency_seconds=latency_seconds)
+        return result
+
+
+def stats() -> Dict[str, Any]:
+    result = {}
+    for model_name in set(stats_counters) | set(_latency_trackers):
+        tracker = get_latency_tracker(model_name)
+        result[model_name] = {
+            **_model_counters(model_name),
+            "circuit_state": get_circuit_breaker(model_name).state,
+            "circuit_times_opened": get_circuit_breaker(model_name).times_opened,
+            "latency_p50": tracker.percentile(50),
+            "latency_p95": tracker.percentile(95),
+            "latency_p99": tracker.percentile(99),
+            "current_timeout": get_timeout(model_name),
+        }
+    return result
@@ -0,0 +1,97 @@
+# shared_services/singleflight.py
+# In-flight request coalescing: concurrent callers asking for the same key await one shared
+# upstream task instead of each starting their own (expensive) Perplexity call.
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+class _Broadcast:
+    """Items produced so far by one shared stream, plus a wake-up for callers waiting on the next."""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._in_flight_streams: Dict[str, _Broadcast] = {}
+        self._stream_tasks: Dict[str, asyncio.Task] = {} # Keeps the pump tasks referenced while they run
+        self.stats_counters = {"leaders": 0, "coalesced": 0}
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception() # Mark as retrieved even if every waiter went away
+
+    async def do(self, key: str, coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs coro_factory() once per key at a time. Callers arriving while it is running get the
+        same result (or exception). The shared task is shielded, so one disconnected client does
+        not cancel the work the others are waiting on.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda finished_task, k=key: self._forget(k, finished_task))
+            self.stats_counters["leaders"] += 1
+        else:
+            self.stats_counters["coalesced"] += 1
+            print(f"SINGLEFLIGHT ({self.name}): Joining in-flight request for key {key}.")
+        return await asyncio.shield(task)
+
+    async def _pump(self, key: str, broadcast: _Broadcast, stream_factory: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for item in stream_factory():
+                broadcast.items.append(item)
+                broadcast.notify()
+        except asyncio.CancelledError:
+            broadcast.error = RuntimeError(f"Shared stream for key {key} was cancelled.")
+            raise
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.finished = True
+            broadcast.notify()
+            if self._in_flight_streams.get(key) is broadcast:
+                del self._in_flight_streams[key]
+            self._stream_tasks.pop(key, None)
+
+    async def stream(self, key: str, stream_factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        do() for async iterators: stream_factory() is iterated once per key at a time and every
+        caller gets all of its items, from the first one (callers who join late are replayed what
+        was already produced), then its exception if it fails. The shared iteration runs in its own
+        task, so one disconnected client does not stop it for the others.
+        """
+        broadcast = self._in_flight_streams.get(key)
+        if broadcast is None:
+            broadcast = self._in_flight_streams[key] = _Broadcast()
+            self._stream_tasks[key] = asyncio.ensure_future(self._pump(key, broadcast, stream_factory))
+            self.stats_counters["leaders"] += 1
+        else:
+            self.stats_counters["coalesced"] += 1
+            print(f"SINGLEFLIGHT ({self.name}): Joining in-flight stream for key {key}.")
+        position = 0
+        while True:
+            while position < len(broadcast.items):
+                position += 1
+                yield broadcast.items[position - 1]
+            if broadcast.finished:
+                if broadcast.error is not None:
+                    raise broadcast.error
+                return
+            await broadcast.changed.wait()
+
+    def in_flight_count(self) -> int:
+        return len(self._in_flight) + len(self._in_flight_streams)
@@ -0,0 +1,178 @@
+# shared_services/telemetry.py
+# In-process metrics for upstream LLM calls (latency, tokens, estimated cost, errors, cache hits),
+# labelled by sub-app, endpoint and model, rendered in the Prometheus text exposition format for
+# the main app's /metrics route. Kept dependency-free; everything runs on the event loop.
+import contextvars
+import os
+from typing import Dict, List, Optional, Tuple
+
+# Set per request by the main app's middleware so calls deep inside services know which route
+# they serve. Calls outside a request (startup, background jobs) are labelled "-".
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="-")
+
+
+class EndpointLabelMiddleware:
+    """Plain ASGI middleware that sets current_endpoint to the request path for the whole request,
+    including background tasks and streamed bodies."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = current_endpoint.set(scope["path"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_endpoint.reset(token)
+
+
+LATENCY_BUCKETS_SECONDS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 900.0)
+
+# USD per 1M tokens (input, output), for the estimated-cost counter. Override with
+# PERPLEXITY_PRICE_<MODEL>="input,output" (e.g. PERPLEXITY_PRICE_SONAR_PRO="3,15").
+DEFAULT_MODEL_PRICES_PER_MILLION: Dict[str, Tuple[float, float]] = {
+    "sonar": (1.0, 1.0),
+    "sonar-pro": (3.0, 15.0),
+    "sonar-reasoning-pro": (2.0, 8.0),
+    "sonar-deep-research": (2.0, 8.0),
+}
+
+LabelValues = Tuple[str, ...]
+
+
+def get_model_prices(model_name: str) -> Tuple[float, float]:
+    env_value = os.getenv("PERPLEXITY_PRICE_" + model_name.upper().replace("-", "_"))
+    if env_value:
+        try:
+            input_price, output_price = (float(p) for p in env_value.split(","))
+            return input_price, output_price
+        except ValueError:
+            print(f"TELEMETRY: WARNING - Ignoring malformed price override for {model_name}: {env_value}")
+    return DEFAULT_MODEL_PRICES_PER_MILLION.get(model_name, (0.0, 0.0))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name, self.help_text, self.label_names = name, help_text, label_names
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, label_values: LabelValues, amount: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...] = LATENCY_BUCKETS_SECONDS):
+        self.name, self.help_text, self.label_names, self.buckets = name, help_text, label_names, buckets
+        self.series: Dict[LabelValues, List[float]] = {} # per-bucket counts (non-cumulative), then +Inf, sum, count
+
+    def observe(self, label_values: LabelValues, value: float):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0.0] * (len(self.buckets) + 3)
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                series[index] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0.0
+            for index, upper_bound in enumerate(self.buckets):
+                cumulative += series[index]
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, ('le', f'{upper_bound:g}'))} {cumulative:g}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, ('le', '+Inf'))} {series[-1]:g}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {series[-1]:g}")
+        return lines
+
+
+CALL_LABELS = ("app", "endpoint", "model")
+
+upstream_latency = Histogram("perplexity_request_duration_seconds", "Wall time of upstream Perplexity calls, including retries and hedges.", CALL_LABELS + ("kind",))
+upstream_requests = Counter("perplexity_requests_total", "Upstream Perplexity calls by outcome.", CALL_LABELS + ("kind", "outcome"))
+upstream_errors = Counter("perplexity_errors_total", "Failed upstream Perplexity calls by error class.", CALL_LABELS + ("error_class",))
+prompt_tokens = Counter("perplexity_prompt_tokens_total", "Prompt tokens reported by the upstream usage block.", CALL_LABELS)
+completion_tokens = Counter("perplexity_completion_tokens_total", "Completion tokens reported by the upstream usage block.", CALL_LABELS)
+estimated_cost = Counter("perplexity_estimated_cost_usd_total", "Estimated token cost in USD from per-model prices.", CALL_LABELS)
+cache_lookups = Counter("llm_cache_lookups_total", "Response cache lookups by result.", CALL_LABELS + ("result",))
+
+ALL_METRICS = (upstream_latency, upstream_requests, upstream_errors, prompt_tokens, completion_tokens, estimated_cost, cache_lookups)
+
+
+def call_labels(app: str, model_name: str) -> LabelValues:
+    return (app, current_endpoint.get(), model_name)
+
+
+def record_cache_lookup(app: str, model_name: str, hit: bool):
+    cache_lookups.inc(call_labels(app, model_name) + ("hit" if hit else "miss",))
+
+
+def record_call(app: str, model_name: str, duration_seconds: float, kind: str = "completion",
+                usage: Optional[Dict[str, int]] = None, error: Optional[BaseException] = None):
+    labels = call_labels(app, model_name)
+    upstream_latency.observe(labels + (kind,), duration_seconds)
+    upstream_requests.inc(labels + (kind, "error" if error is not None else "ok"))
+    if error is not None:
+        upstream_errors.inc(labels + (error.__class__.__name__,))
+    if usage:
+        prompt_count = usage.get("prompt_tokens") or 0
+        completion_count = usage.get("completion_tokens") or 0
+        prompt_tokens.inc(labels, prompt_count)
+        completion_tokens.inc(labels, completion_count)
+        input_price, output_price = get_model_prices(model_name)
+        estimated_cost.inc(labels, (prompt_count * input_price + completion_count * output_price) / 1_000_000)
+
+
+def _gauge(name: str, help_text: str, samples: List[Tuple[str, float]]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{labels} {value:g}" for labels, value in samples)
+    return lines
+
+
+def render_prometheus(cache_stats: Optional[Dict] = None, scheduler_stats: Optional[Dict] = None, resilience_stats: Optional[Dict] = None,
+                      blocking_io_stats: Optional[Dict] = None) -> str:
+    """Renders all counters plus point-in-time gauges from the cache, scheduler, resilience and blocking-I/O layers."""
+    lines: List[str] = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    if cache_stats is not None:
+        lines.extend(_gauge("llm_cache_hit_ratio", "Share of response cache lookups served from memory or disk.", [("", cache_stats.get("hit_ratio", 0.0))]))
+        lines.extend(_gauge("llm_cache_memory_entries", "Entries in the in-memory response cache tier.", [("", cache_stats.get("memory_entries", 0))]))
+    if scheduler_stats is not None:
+        lines.extend(_gauge("upstream_scheduler_active_slots", "Upstream calls currently holding a slot.",
+                            [(f'{{model="{_escape(m)}"}}', s["active"]) for m, s in sorted(scheduler_stats.items())]))
+        lines.extend(_gauge("upstream_scheduler_queue_depth", "Calls waiting for an upstream slot.",
+                            [(f'{{model="{_escape(m)}",lane="{lane}"}}', depth) for m, s in sorted(scheduler_stats.items()) for lane, depth in s["queue_depth"].items()]))
+    if resilience_stats is not None:
+        lines.extend(_gauge("perplexity_circuit_open", "1 while a model's circuit breaker is not closed.",
+                            [(f'{{model="{_escape(m)}"}}', 0 if s["circuit_state"] == "closed" else 1) for m, s in sorted(resilience_stats.items())]))
+        lines.extend(_gauge("perplexity_current_timeout_seconds", "Adaptive per-attempt timeout currently applied.",
+                            [(f'{{model="{_escape(m)}"}}', s["current_timeout"]) for m, s in sorted(resilience_stats.items())]))
+    if blocking_io_stats is not None:
+        lines.extend(_gauge("blocking_io_running", "Disk operations running on the blocking-I/O thread pool.", [("", blocking_io_stats["running"])]))
+        lines.extend(_gauge("blocking_io_queued", "Disk operations waiting for a blocking-I/O thread.", [("", blocking_io_stats["queued"])]))
+    return "\n".join(lines) + "\n"
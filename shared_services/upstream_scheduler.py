@@ -0,0 +1,173 @@
+# shared_services/upstream_scheduler.py
+# Central admission control for Perplexity calls. Every sub-app asks for a slot before going
+# upstream; slots are capped per model and handed out by priority lane (interactive chat first,
+# batch research last), round-robin across apps within a lane so one app cannot starve another.
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Deque, Tuple
+
+PRIORITY_INTERACTIVE = "interactive" # A user is waiting on the answer (chat, symptoms, follow-ups)
+PRIORITY_STANDARD = "standard"       # Page loads that can tolerate some queueing (reports, advisories)
+PRIORITY_BATCH = "batch"             # Long-running jobs (deep research reports)
+PRIORITY_LANES = (PRIORITY_INTERACTIVE, PRIORITY_STANDARD, PRIORITY_BATCH)
+
+# Max concurrent upstream calls per model. Override with UPSTREAM_CONCURRENCY_<MODEL>
+# (e.g. UPSTREAM_CONCURRENCY_SONAR_DEEP_RESEARCH=3).
+DEFAULT_MODEL_CONCURRENCY: Dict[str, int] = {
+    "sonar": 8,
+    "sonar-pro": 8,
+    "sonar-reasoning-pro": 6,
+    "sonar-deep-research": 2,
+}
+FALLBACK_CONCURRENCY = 4
+# Slots per model that only interactive work may use, so a burst of batch/standard work always
+# leaves room for chat. Ignored for models whose cap is 1.
+INTERACTIVE_RESERVED_SLOTS = int(os.getenv('UPSTREAM_INTERACTIVE_RESERVED_SLOTS', '1'))
+
+
+def get_concurrency_limit(model_name: str) -> int:
+    env_value = os.getenv("UPSTREAM_CONCURRENCY_" + model_name.upper().replace("-", "_"))
+    if env_value and env_value.isdigit() and int(env_value) > 0:
+        return int(env_value)
+    return DEFAULT_MODEL_CONCURRENCY.get(model_name, FALLBACK_CONCURRENCY)
+
+
+class _ModelQueue:
+    """Slots and waiting callers for one model."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.limit = get_concurrency_limit(model_name)
+        self.active = 0
+        # lane -> app -> FIFO of (future, enqueued_at). OrderedDict order is the round-robin order.
+        self.waiters: Dict[str, "OrderedDict[str, Deque[Tuple[asyncio.Future, float]]]"] = {lane: OrderedDict() for lane in PRIORITY_LANES}
+        self.stats_counters = {"granted": 0, "queued": 0, "cancelled_while_queued": 0, "max_queue_depth": 0, "total_wait_seconds": 0.0}
+
+    def lane_capacity(self, lane: str) -> int:
+        if lane == PRIORITY_INTERACTIVE or self.limit <= 1:
+            return self.limit
+        return max(1, self.limit - INTERACTIVE_RESERVED_SLOTS)
+
+    def queue_depth(self, lane: str = None) -> int:
+        lanes = [lane] if lane else PRIORITY_LANES
+        return sum(len(app_queue) for l in lanes for app_queue in self.waiters[l].values())
+
+    def has_waiters_ahead(self, lane: str) -> bool:
+        # Anyone queued in this lane or a higher-priority one goes first
+        for l in PRIORITY_LANES[:PRIORITY_LANES.index(lane) + 1]:
+            if self.queue_depth(l):
+                return True
+        return False
+
+    def enqueue(self, lane: str, app: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[lane].setdefault(app, deque()).append((future, time.monotonic()))
+        self.stats_counters["queued"] += 1
+        self.stats_counters["max_queue_depth"] = max(self.stats_counters["max_queue_depth"], self.queue_depth())
+        return future
+
+    def remove_waiter(self, lane: str, app: str, future: asyncio.Future):
+        app_queue = self.waiters[lane].get(app)
+        if not app_queue:
+            return
+        for entry in list(app_queue):
+            if entry[0] is future:
+                app_queue.remove(entry)
+                break
+        if not app_queue:
+            del self.waiters[lane][app]
+
+    def dispatch(self):
+        """Grants free slots to waiters: highest lane first, round-robin over apps within a lane."""
+        for lane in PRIORITY_LANES:
+            lane_waiters = self.waiters[lane]
+            while lane_waiters and self.active < self.lane_capacity(lane):
+                app, app_queue = next(iter(lane_waiters.items()))
+                future, enqueued_at = app_queue.popleft()
+                if app_queue:
+                    lane_waiters.move_to_end(app) # This app goes to the back of the rotation
+                else:
+                    del lane_waiters[app]
+                if future.done(): # Waiter was cancelled
+                    continue
+                self.active += 1
+                self.stats_counters["granted"] += 1
+                self.stats_counters["total_wait_seconds"] += time.monotonic() - enqueued_at
+                future.set_result(None)
+            if lane_waiters:
+                return # Lower lanes never jump ahead of a blocked higher lane
+
+    def stats(self) -> Dict[str, Any]:
+        queued = self.stats_counters["queued"]
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_depth": {lane: self.queue_depth(lane) for lane in PRIORITY_LANES},
+            **{k: v for k, v in self.stats_counters.items() if k != "total_wait_seconds"},
+            "avg_queue_wait_seconds": round(self.stats_counters["total_wait_seconds"] / queued, 4) if queued else 0.0,
+        }
+
+
+class UpstreamScheduler:
+    def __init__(self):
+        self._models: Dict[str, _ModelQueue] = {}
+
+    def _queue_for(self, model_name: str) -> _ModelQueue:
+        model_queue = self._models.get(model_name)
+        if model_queue is None:
+            model_queue = _ModelQueue(model_name)
+            self._models[model_name] = model_queue
+        return model_queue
+
+    async def acquire(self, model_name: str, priority: str = PRIORITY_STANDARD, app: str = "default"):
+        if priority not in PRIORITY_LANES:
+            raise ValueError(f"Unknown priority '{priority}'. Expected one of {PRIORITY_LANES}.")
+        model_queue = self._queue_for(model_name)
+        if model_queue.active < model_queue.lane_capacity(priority) and not model_queue.has_waiters_ahead(priority):
+            model_queue.active += 1
+            model_queue.stats_counters["granted"] += 1
+            return
+
+        future = model_queue.enqueue(priority, app)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(model_name) # Slot was granted just as we were cancelled; hand it on
+            else:
+                model_queue.remove_waiter(priority, app, future)
+                model_queue.stats_counters["cancelled_while_queued"] += 1
+            raise
+
+    def try_acquire(self, model_name: str, priority: str = PRIORITY_STANDARD) -> bool:
+        """Takes a slot only if one is free right now with nobody queued ahead; never waits.
+        A successful call must be paired with release()."""
+        model_queue = self._queue_for(model_name)
+        if model_queue.active < model_queue.lane_capacity(priority) and not model_queue.has_waiters_ahead(priority):
+            model_queue.active += 1
+            model_queue.stats_counters["granted"] += 1
+            return True
+        return False
+
+    def release(self, model_name: str):
+        model_queue = self._queue_for(model_name)
+        model_queue.active = max(0, model_queue.active - 1)
+        model_queue.dispatch()
+
+    @asynccontextmanager
+    async def slot(self, model_name: str, priority: str = PRIORITY_STANDARD, app: str = "default"):
+        """Holds one upstream slot for model_name for the duration of the block."""
+        await self.acquire(model_name, priority, app)
+        try:
+            yield
+        finally:
+            self.release(model_name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {model_name: model_queue.stats() for model_name, model_queue in self._models.items()}
+
+
+upstream_scheduler = UpstreamScheduler()
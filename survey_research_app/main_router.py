@@ -1,6 +1,6 @@
 # medical-assistant/survey_research_app/main_router.py
 from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from typing import Dict
 import os
 import json # For model_dump_json for logging if needed
@@ -15,9 +15,11 @@ from .schemas import (
 )
 from .services import (
     conduct_deep_research as conduct_survey_deep_research, # Aliased to avoid name clash if main app has similar
+    stream_deep_research as stream_survey_deep_research, # Aliased
     answer_follow_up_question as answer_survey_follow_up, # Aliased
     generate_report_id as generate_survey_report_id # Aliased
 )
+from shared_services.singleflight import SingleFlight
 
 router = APIRouter(
     prefix="/survey-research", 
@@ -28,9 +30,9 @@ APP_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(APP_BASE_DIR, "static") # For this app's own static files
 
 survey_generated_reports_cache: Dict[str, SurveyReportResponse] = {}
+survey_research_flights = SingleFlight("survey_research")
 
-@router.post("/api/research", response_model=SurveyReportResponse)
-async def create_survey_research_report_endpoint(research_request: SurveyResearchRequest):
+def _validate_research_request(research_request: SurveyResearchRequest):
     if not research_request.area1:
         raise HTTPException(status_code=400, detail="Area 1 (Primary Area) cannot be empty.")
 
@@ -40,6 +42,13 @@ async def create_survey_research_report_endpoint(research_request: SurveyResearc
     if research_request.report_type == ReportTypeEnum.DISEASE_FOCUS and not research_request.disease_focus:
         raise HTTPException(status_code=400, detail="Disease/Condition is required for disease focus reports.")
 
+def _format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/api/research", response_model=SurveyReportResponse)
+async def create_survey_research_report_endpoint(research_request: SurveyResearchRequest):
+    _validate_research_request(research_request)
+
     print(f"SURVEY_APP: Received research request: {research_request.model_dump_json(indent=2)}")
 
     report_id_params = research_request.model_dump(exclude_none=True, exclude_defaults=False)
@@ -49,7 +58,7 @@ async def create_survey_research_report_endpoint(research_request: SurveyResearc
         print(f"SURVEY_APP: Returning cached report. ID: {report_id}")
         return survey_generated_reports_cache[report_id]
 
-    try:
+    async def _generate_report() -> SurveyReportResponse:
         # conduct_survey_deep_research is from this app's services.py
         # It should return a dictionary matching SurveyReportResponse fields
         report_dict_data = await conduct_survey_deep_research(research_request)
@@ -64,6 +73,10 @@ async def create_survey_research_report_endpoint(research_request: SurveyResearc
         survey_generated_reports_cache[report_id] = response_model
         print(f"SURVEY_APP: Research complete. Report ID: {response_model.report_id}, Area: {response_model.area_name}")
         return response_model
+
+    try:
+        # Identical requests arriving while this report is still being generated share one upstream call
+        return await survey_research_flights.do(report_id, _generate_report)
     except Exception as e:
         print(f"SURVEY_APP: Error during research for request '{research_request.model_dump_json()}': {e}")
         import traceback
@@ -71,6 +84,50 @@ async def create_survey_research_report_endpoint(research_request: SurveyResearc
         # Consider if a more specific error from the service layer should be passed
         raise HTTPException(status_code=500, detail=f"Failed to conduct survey/research: {str(e)}")
 
+@router.post("/api/research/stream")
+async def stream_survey_research_report_endpoint(research_request: SurveyResearchRequest):
+    """
+    Server-Sent Events variant of /api/research. Emits a "section" event per finished '## ' section,
+    a "chart" event as soon as each chart's data is parsed, then "complete" with the full
+    SurveyReportResponse (or "error" if generation fails).
+    """
+    _validate_research_request(research_request)
+    print(f"SURVEY_APP: Received streamed research request: {research_request.model_dump_json(indent=2)}")
+
+    report_id_params = research_request.model_dump(exclude_none=True, exclude_defaults=False)
+    report_id = generate_survey_report_id(report_id_params)
+
+    async def report_events():
+        # Runs once per report_id at a time; every subscriber gets these (event, data) pairs
+        async for event in stream_survey_deep_research(research_request):
+            if event["event"] != "complete":
+                yield event["event"], event["data"]
+                continue
+            report_dict_data = event["data"]
+            report_dict_data["report_id"] = report_id # Ensure consistency with the cache key
+            response_model = SurveyReportResponse(**report_dict_data)
+            if not response_model.full_report_markdown.startswith("Error:"):
+                survey_generated_reports_cache[report_id] = response_model
+            print(f"SURVEY_APP: Streamed research complete. Report ID: {report_id}, Area: {response_model.area_name}")
+            yield "complete", response_model.model_dump(mode="json")
+
+    async def event_stream():
+        cached_report = survey_generated_reports_cache.get(report_id)
+        if cached_report is not None:
+            print(f"SURVEY_APP: Returning cached report over stream. ID: {report_id}")
+            yield _format_sse("complete", cached_report.model_dump(mode="json"))
+            return
+        try:
+            # Identical requests streaming at the same time share one upstream stream; late joiners
+            # are replayed the sections and charts already sent before following it live
+            async for event_name, data in survey_research_flights.stream(report_id, report_events):
+                yield _format_sse(event_name, data)
+        except Exception as e:
+            print(f"SURVEY_APP: Error during streamed research for request '{research_request.model_dump_json()}': {e}")
+            yield _format_sse("error", {"detail": f"Failed to conduct survey/research: {str(e)}"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @router.post("/api/ask", response_model=SurveyAnswerResponse)
 async def ask_survey_follow_up_endpoint(question_request: SurveyQuestionRequest):
     report_id = question_request.report_id
@@ -12,6 +12,8 @@ from pathlib import Path
 
 # Corrected imports:
 from .schemas import SurveyResearchRequest, ReportTypeEnum 
+from shared_services import perplexity_client, resilience
+from shared_services.upstream_scheduler import PRIORITY_INTERACTIVE, PRIORITY_BATCH
 PROJECT_ROOT_FOR_ENV = Path(__file__).resolve().parent.parent
 DOTENV_PATH = PROJECT_ROOT_FOR_ENV / '.env'
 
@@ -22,7 +24,7 @@ if not PERPLEXITY_API_KEY:
     # In a real app, consider raising an exception or logging more severely
     print("SURVEY_RESEARCH_SERVICES: CRITICAL ERROR - PERPLEXITY_API_KEY not found via shared config.")
 
-API_BASE_URL = 'https://api.perplexity.ai/chat/completions'
+API_BASE_URL = perplexity_client.PERPLEXITY_API_BASE_URL
 # Use the specific model name for this app from the shared config
 RESEARCH_MODEL_NAME = 'sonar-deep-research'
 FOLLOW_UP_MODEL_NAME = 'sonar'
@@ -170,88 +172,92 @@ def _get_focus_points_disease(area_name: str, disease_name: str, time_range: Opt
     return disease_section_guide, disease_focus_points
 
 
-async def get_perplexity_response(prompt_content: str, model_name: str, system_prompt_content: str = None, max_tokens: int = 8192, temperature: float = 0.3) -> str:
+REPORT_WRITER_SYSTEM_PROMPT = (
+    "You are an AI report writing machine. Your SOLE function is to produce the report text EXACTLY as requested by the user's prompt structure. "
+    "DO NOT include ANY conversational phrases, introductory remarks, summaries of your understanding, self-corrections, or ANY text whatsoever that is not part of the direct report content. "
+    "If you have any internal planning, thoughts, or meta-commentary about the generation process, you MUST enclose this information in <think>Your thought here</think> tags. These tags and their content will be programmatically removed and MUST NOT appear in the final report body. "
+    "Your final output, after these <think> tags are notionally removed, MUST begin *EXACTLY* with the specified report title (e.g., 'Comprehensive Report on Healthcare in...')."
+)
+
+async def get_perplexity_response(prompt_content: str, model_name: str, system_prompt_content: str = None, max_tokens: int = 8192, temperature: float = 0.3, cache_mode: Optional[str] = None, priority: str = PRIORITY_BATCH) -> str:
     # ... (get_perplexity_response function remains largely the same as provided in the problem description)
     # ... (ensure the latest version of this function, especially the <think> tag stripping, is used)
     if not PERPLEXITY_API_KEY:
         return "Error: API Key is not configured on the server."
 
     if system_prompt_content is None:
-        system_prompt_content = (
-            "You are an AI report writing machine. Your SOLE function is to produce the report text EXACTLY as requested by the user's prompt structure. "
-            "DO NOT include ANY conversational phrases, introductory remarks, summaries of your understanding, self-corrections, or ANY text whatsoever that is not part of the direct report content. "
-            "If you have any internal planning, thoughts, or meta-commentary about the generation process, you MUST enclose this information in <think>Your thought here</think> tags. These tags and their content will be programmatically removed and MUST NOT appear in the final report body. "
-            "Your final output, after these <think> tags are notionally removed, MUST begin *EXACTLY* with the specified report title (e.g., 'Comprehensive Report on Healthcare in...')."
-        )
+        system_prompt_content = REPORT_WRITER_SYSTEM_PROMPT
     
     messages = [{"role": "system", "content": system_prompt_content}, {"role": "user", "content": prompt_content}]
     payload = {"model": model_name, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
-    headers = {"Authorization": f"Bearer {PERPLEXITY_API_KEY}", "Content-Type": "application/json", "Accept": "application/json"}
-    timeout_duration = 900.0 # 15 minutes
+    timeout_duration = resilience.get_timeout(model_name) # Adaptive per-model timeout (deep research allows up to 15 minutes)
 
     try:
-        async with httpx.AsyncClient(timeout=timeout_duration) as client:
-            print(f"Sending prompt to Perplexity (model: {model_name}, prompt length: {len(prompt_content)} chars). Expecting a long response.")
-            response = await client.post(API_BASE_URL, json=payload, headers=headers)
-            response.raise_for_status()
-            response_data = response.json()
+        print(f"Sending prompt to Perplexity (model: {model_name}, prompt length: {len(prompt_content)} chars). Expecting a long response.")
+        response_data = await perplexity_client.create_chat_completion(payload, PERPLEXITY_API_KEY, cache_mode=cache_mode, priority=priority, app="survey_research")
 
         if response_data.get("choices") and response_data["choices"][0].get("message"):
             raw_content = response_data["choices"][0]["message"]["content"]
             print(f"Raw response received from {model_name} (length: {len(raw_content)} chars).")
-
-            content_without_thoughts = re.sub(r"<think>.*?</think>", "", raw_content, flags=re.DOTALL | re.IGNORECASE).strip()
-            print(f"Content after stripping <think> tags (length: {len(content_without_thoughts)} chars).")
-            
-            # Determine expected report start based on prompt (this needs to be passed or inferred)
-            # For now, we'll use a generic part of the title. This could be improved by passing the exact expected title.
-            # A simple heuristic: find the first "##" which should be the main title.
-            first_h2_match = re.search(r"##\s*.+", content_without_thoughts)
-            cleaned_content = content_without_thoughts
-            if first_h2_match:
-                actual_start_index = first_h2_match.start()
-                if actual_start_index > 0:
-                    print(f"WARNING: Untagged preamble detected before the first H2 title. Stripping {actual_start_index} characters.")
-                    cleaned_content = content_without_thoughts[actual_start_index:]
-                else: # actual_start_index == 0
-                    print("Report starts correctly with an H2 heading after <think> tag removal.")
-            else:
-                # Fallback to "Comprehensive Report on" or similar if H2 not found at start.
-                # This part is tricky because the title itself is dynamic.
-                # The instruction is to start EXACTLY with the title. If it doesn't, it's an AI deviation.
-                # We rely on the AI following "MUST begin *EXACTLY* with the specified report title".
-                # The current logic checks for "Comprehensive Report on Healthcare in". This will fail for new titles.
-                # The BEST approach is if the AI *always* starts with "## Title". Then stripping up to the first "##" is robust.
-                # For now, the existing logic in the problem description for title finding is okay, but less robust for dynamic titles.
-                # The key is the system prompt enforcing the AI starts correctly.
-                # Let's assume the current system prompt + <think> tag stripping is the primary cleaning mechanism.
-                # The prompt itself will specify the exact starting title.
-                print(f"Report content after <think> stripping (length: {len(cleaned_content)} chars). Further title-specific stripping might be needed if AI deviates.")
-
-
-            return cleaned_content.strip()
+            return _clean_report_content(raw_content)
         else:
             error_msg = response_data.get("error", {}).get("message", "Unknown API response format.")
             print(f"API Error (model: {model_name}): {error_msg} Full response: {json.dumps(response_data, indent=2)}")
             return f"Error: AI API returned an error: {error_msg}"
-    except httpx.HTTPStatusError as http_err:
+    except Exception as e:
+        return _format_api_error(e, model_name, timeout_duration)
+
+def _format_api_error(error: Exception, model_name: str, timeout_duration: float) -> str:
+    """Maps an exception from a Perplexity call to the 'Error: ...' string the callers check for."""
+    if isinstance(error, httpx.HTTPStatusError):
         error_content = "Unknown error"
         try:
-            error_details = http_err.response.json()
-            error_content = error_details.get("error", {}).get("message", http_err.response.text)
-        except json.JSONDecodeError: error_content = http_err.response.text
-        print(f"HTTP error (model: {model_name}): {http_err} - Details: {error_content}")
-        return f"Error: AI API request failed (HTTP {http_err.response.status_code}). Details: {error_content}"
-    except httpx.TimeoutException:
+            error_details = error.response.json()
+            error_content = error_details.get("error", {}).get("message", error.response.text)
+        except json.JSONDecodeError: error_content = error.response.text
+        print(f"HTTP error (model: {model_name}): {error} - Details: {error_content}")
+        return f"Error: AI API request failed (HTTP {error.response.status_code}). Details: {error_content}"
+    if isinstance(error, httpx.TimeoutException):
         print(f"API request timed out for model {model_name} after {timeout_duration}s.")
         return "Error: The AI API request timed out. This can happen with very long report requests. Please try a more focused area or try again later."
-    except httpx.RequestError as req_err:
-        print(f"Request error (model: {model_name}): {req_err}")
-        return f"Error: AI API request failed due to a network issue: {str(req_err)}"
-    except Exception as e:
-        print(f"Generic error in get_perplexity_response (model: {model_name}): {e.__class__.__name__} - {e}")
-        import traceback; traceback.print_exc()
-        return f"Error: An unexpected error occurred: {str(e)}"
+    if isinstance(error, httpx.RequestError):
+        print(f"Request error (model: {model_name}): {error}")
+        return f"Error: AI API request failed due to a network issue: {str(error)}"
+    print(f"Generic error in get_perplexity_response (model: {model_name}): {error.__class__.__name__} - {error}")
+    import traceback; traceback.print_exception(error)
+    return f"Error: An unexpected error occurred: {str(error)}"
+
+def _clean_report_content(raw_content: str) -> str:
+    content_without_thoughts = re.sub(r"<think>.*?</think>", "", raw_content, flags=re.DOTALL | re.IGNORECASE).strip()
+    print(f"Content after stripping <think> tags (length: {len(content_without_thoughts)} chars).")
+    
+    # Determine expected report start based on prompt (this needs to be passed or inferred)
+    # For now, we'll use a generic part of the title. This could be improved by passing the exact expected title.
+    # A simple heuristic: find the first "##" which should be the main title.
+    first_h2_match = re.search(r"##\s*.+", content_without_thoughts)
+    cleaned_content = content_without_thoughts
+    if first_h2_match:
+        actual_start_index = first_h2_match.start()
+        if actual_start_index > 0:
+            print(f"WARNING: Untagged preamble detected before the first H2 title. Stripping {actual_start_index} characters.")
+            cleaned_content = content_without_thoughts[actual_start_index:]
+        else: # actual_start_index == 0
+            print("Report starts correctly with an H2 heading after <think> tag removal.")
+    else:
+        # Fallback to "Comprehensive Report on" or similar if H2 not found at start.
+        # This part is tricky because the title itself is dynamic.
+        # The instruction is to start EXACTLY with the title. If it doesn't, it's an AI deviation.
+        # We rely on the AI following "MUST begin *EXACTLY* with the specified report title".
+        # The current logic checks for "Comprehensive Report on Healthcare in". This will fail for new titles.
+        # The BEST approach is if the AI *always* starts with "## Title". Then stripping up to the first "##" is robust.
+        # For now, the existing logic in the problem description for title finding is okay, but less robust for dynamic titles.
+        # The key is the system prompt enforcing the AI starts correctly.
+        # Let's assume the current system prompt + <think> tag stripping is the primary cleaning mechanism.
+        # The prompt itself will specify the exact starting title.
+        print(f"Report content after <think> stripping (length: {len(cleaned_content)} chars). Further title-specific stripping might be needed if AI deviates.")
+
+
+    return cleaned_content.strip()
 
 def _build_report_prompt(params: SurveyResearchRequest) -> str:
     current_date_str = datetime.now().strftime("%B %Y")
@@ -439,20 +445,14 @@ Use ONLY certified and official sources of data. AIM TO INCLUDE SEVERAL RELEVANT
     return full_prompt
 
 
-async def conduct_deep_research(research_params: SurveyResearchRequest):
+def _describe_research_request(research_params: SurveyResearchRequest) -> str:
     request_desc = f"type={research_params.report_type.value}, area1={research_params.area1}"
     if research_params.area2: request_desc += f", area2={research_params.area2}"
     if research_params.disease_focus: request_desc += f", disease={research_params.disease_focus}"
     if research_params.time_range: request_desc += f", time_range={research_params.time_range}"
-    
-    print(f"Starting HEALTH ANALYSIS for: {request_desc} using {RESEARCH_MODEL_NAME}")
-    
-    # Generate a unique ID based on all relevant parameters of the request
-    # The model_dump should exclude Nones by default if not set otherwise.
-    # exclude_defaults=True ensures that if report_type is the default, it's still included if it affects the prompt.
-    # However, generate_report_id in app.py already handles this. We need to ensure consistency.
-    # The report_id passed to the ReportResponse model should be the one generated based on the request.
-    
+    return request_desc
+
+def _new_report_data(research_params: SurveyResearchRequest) -> dict:
     # Construct a user-friendly "area_name" for the report response based on the request
     report_title_display_name = research_params.area1
     if research_params.report_type == ReportTypeEnum.COMPARE_AREAS and research_params.area2:
@@ -473,8 +473,7 @@ async def conduct_deep_research(research_params: SurveyResearchRequest):
     # For simplicity, we'll use the passed research_params to construct it.
     current_report_id = generate_report_id(research_params.model_dump(exclude_none=True, exclude_defaults=False))
 
-
-    report_data = {
+    return {
         "report_id": current_report_id,
         "area_name": report_title_display_name, # This is for display in UI
         "full_report_markdown": "",
@@ -482,6 +481,106 @@ async def conduct_deep_research(research_params: SurveyResearchRequest):
         "full_text_for_follow_up": ""
     }
 
+# Pattern needs to be robust, title can now contain "vs." etc.
+CHART_DATA_PATTERN = re.compile(r'CHART_DATA:\s*TYPE=(?P<type>\w+)\s*TITLE="(?P<title>[^"]+)"\s*LABELS=(?P<labels>\[[^\]]*\])\s*DATA=(?P<data>\[[^\]]*\])(?:\s*SOURCE="(?P<source>[^"]+)")?')
+
+def _parse_chart_directive(chart_match_item: re.Match, request_desc: str, match_idx_chart: int) -> Optional[dict]:
+    """Turns one CHART_DATA match into a chart dict (ChartData shape), or None if it is unusable."""
+    try:
+        chart_dict = chart_match_item.groupdict()
+        chart_type = chart_dict['type'].lower()
+        # Allow more characters in title, including those relevant for comparisons like 'vs.'
+        chart_title = re.sub(r'[^\w\s\-\(\)%.,:&vs]', '', chart_dict['title']).strip() # Added .,:&vs
+        labels_str = chart_dict['labels']
+        data_str = chart_dict['data']
+        chart_source = chart_dict.get('source')
+
+        try: labels = json.loads(labels_str)
+        except json.JSONDecodeError: labels = ast.literal_eval(labels_str)
+        
+        # Handle potentially nested data for multi-series charts if AI provides it that way
+        # For now, assuming simple list of numbers or list of lists for data.
+        # The schema expects `datasets: List[ChartDataset]` where each dataset has `data: List[Union[int, float]]`.
+        # The simplest AI output is one CHART_DATA per dataset.
+        # If AI outputs `DATA=[[10,20],[15,25]]` and `LABELS=["A","B"]`, this means 2 series.
+        # Our current parsing logic is for a single series per CHART_DATA directive.
+        # This part needs to be more robust if the AI is to generate multi-series data in one DATA field.
+        # For now, we'll process as if DATA is a single list of numbers.
+        
+        try: raw_data_points_or_series = json.loads(data_str)
+        except json.JSONDecodeError: raw_data_points_or_series = ast.literal_eval(data_str)
+
+        # Check if it's a multi-series chart (list of lists)
+        is_multi_series = isinstance(raw_data_points_or_series, list) and \
+                          all(isinstance(sublist, list) for sublist in raw_data_points_or_series) and \
+                          len(raw_data_points_or_series) > 0
+
+        datasets_for_chart = []
+
+        if is_multi_series:
+            # This is a crude way to handle it. AI might not provide labels for each series.
+            # TODO: The CHART_DATA format needs to be extended for multi-series (e.g. DATASET_1_LABEL, DATASET_1_DATA etc.)
+            # For now, assume generic labels for series if AI provides list of lists for DATA.
+            print(f"Chart '{chart_title}' detected as multi-series from DATA structure. This is experimental parsing.")
+            num_series = len(raw_data_points_or_series)
+            # Ensure all series have same length as labels
+            if not all(len(series_data) == len(labels) for series_data in raw_data_points_or_series):
+                print(f"Multi-series chart data length mismatch for '{chart_title}'. Skipping.")
+                return None
+
+            for i, series_data_raw in enumerate(raw_data_points_or_series):
+                numeric_data_points, valid = _parse_chart_data_points(series_data_raw, chart_title)
+                if valid and numeric_data_points:
+                     datasets_for_chart.append({"label": f"Series {i+1} for {chart_title}", "data": numeric_data_points})
+                else:
+                    print(f"Failed to parse series {i+1} for multi-series chart '{chart_title}'. Skipping entire chart.")
+                    datasets_for_chart = [] # Invalidate chart
+                    break 
+        else: # Single series
+            raw_data_points = raw_data_points_or_series
+            if not (isinstance(labels, list) and isinstance(raw_data_points, list) and len(labels) == len(raw_data_points) and len(labels) > 0):
+                print(f"Chart data format/length mismatch for '{chart_title}' (Match {match_idx_chart}). Labels: {len(labels)}, Data: {len(raw_data_points)}. Skipping.")
+                return None
+            
+            numeric_data_points, valid = _parse_chart_data_points(raw_data_points, chart_title)
+            if valid and numeric_data_points:
+                chart_dataset_label = chart_title 
+                if chart_source: chart_dataset_label += f" (Source: {chart_source})" # Add source to dataset label for single series
+                datasets_for_chart.append({"label": chart_dataset_label, "data": numeric_data_points})
+        
+        if not datasets_for_chart: # No valid datasets were processed
+            return None
+
+        if len(labels) > 15: # Increased limit slightly
+            print(f"Warning: Chart '{chart_title}' has {len(labels)} labels, truncating to 15 for display.")
+            labels = labels[:15]
+            # Datasets must also be truncated
+            for ds in datasets_for_chart:
+                ds["data"] = ds["data"][:15]
+
+        print(f"Successfully parsed chart: '{chart_title}' with {len(datasets_for_chart)} dataset(s) for {request_desc}")
+        return {
+            "type": chart_type, "title": chart_title, "labels": [str(l) for l in labels],
+            "datasets": datasets_for_chart,
+            "source": chart_source
+        }
+
+    except Exception as e_chart_parse:
+        print(f"Error parsing CHART_DATA (Match {match_idx_chart}): {e_chart_parse}. Raw: {chart_match_item.group(0)}")
+        return None
+
+async def conduct_deep_research(research_params: SurveyResearchRequest):
+    request_desc = _describe_research_request(research_params)
+    
+    print(f"Starting HEALTH ANALYSIS for: {request_desc} using {RESEARCH_MODEL_NAME}")
+    
+    # Generate a unique ID based on all relevant parameters of the request
+    # The model_dump should exclude Nones by default if not set otherwise.
+    # exclude_defaults=True ensures that if report_type is the default, it's still included if it affects the prompt.
+    # However, generate_report_id in app.py already handles this. We need to ensure consistency.
+    # The report_id passed to the ReportResponse model should be the one generated based on the request.
+    report_data = _new_report_data(research_params)
+
     mega_prompt = _build_report_prompt(research_params)
 
     estimated_tokens = len(mega_prompt) / 3.7 
@@ -491,7 +590,8 @@ async def conduct_deep_research(research_params: SurveyResearchRequest):
         prompt_content=mega_prompt,
         model_name=RESEARCH_MODEL_NAME,
         max_tokens=8192, 
-        temperature=0.3 
+        temperature=0.3,
+        cache_mode="survey_report"
     )
 
     report_data["full_report_markdown"] = full_report_markdown_content
@@ -503,92 +603,11 @@ async def conduct_deep_research(research_params: SurveyResearchRequest):
         return report_data 
     
     # Chart parsing logic
-    # Pattern needs to be robust, title can now contain "vs." etc.
-    chart_pattern_str = r'CHART_DATA:\s*TYPE=(?P<type>\w+)\s*TITLE="(?P<title>[^"]+)"\s*LABELS=(?P<labels>\[[^\]]*\])\s*DATA=(?P<data>\[[^\]]*\])(?:\s*SOURCE="(?P<source>[^"]+)")?'
-    chart_matches = re.finditer(chart_pattern_str, full_report_markdown_content)
     temp_charts_list = []
-
-    for match_idx_chart, chart_match_item in enumerate(chart_matches):
-        try:
-            chart_dict = chart_match_item.groupdict()
-            chart_type = chart_dict['type'].lower()
-            # Allow more characters in title, including those relevant for comparisons like 'vs.'
-            chart_title = re.sub(r'[^\w\s\-\(\)%.,:&vs]', '', chart_dict['title']).strip() # Added .,:&vs
-            labels_str = chart_dict['labels']
-            data_str = chart_dict['data']
-            chart_source = chart_dict.get('source')
-
-            try: labels = json.loads(labels_str)
-            except json.JSONDecodeError: labels = ast.literal_eval(labels_str)
-            
-            # Handle potentially nested data for multi-series charts if AI provides it that way
-            # For now, assuming simple list of numbers or list of lists for data.
-            # The schema expects `datasets: List[ChartDataset]` where each dataset has `data: List[Union[int, float]]`.
-            # The simplest AI output is one CHART_DATA per dataset.
-            # If AI outputs `DATA=[[10,20],[15,25]]` and `LABELS=["A","B"]`, this means 2 series.
-            # Our current parsing logic is for a single series per CHART_DATA directive.
-            # This part needs to be more robust if the AI is to generate multi-series data in one DATA field.
-            # For now, we'll process as if DATA is a single list of numbers.
-            
-            try: raw_data_points_or_series = json.loads(data_str)
-            except json.JSONDecodeError: raw_data_points_or_series = ast.literal_eval(data_str)
-
-            # Check if it's a multi-series chart (list of lists)
-            is_multi_series = isinstance(raw_data_points_or_series, list) and \
-                              all(isinstance(sublist, list) for sublist in raw_data_points_or_series) and \
-                              len(raw_data_points_or_series) > 0
-
-            datasets_for_chart = []
-
-            if is_multi_series:
-                # This is a crude way to handle it. AI might not provide labels for each series.
-                # TODO: The CHART_DATA format needs to be extended for multi-series (e.g. DATASET_1_LABEL, DATASET_1_DATA etc.)
-                # For now, assume generic labels for series if AI provides list of lists for DATA.
-                print(f"Chart '{chart_title}' detected as multi-series from DATA structure. This is experimental parsing.")
-                num_series = len(raw_data_points_or_series)
-                # Ensure all series have same length as labels
-                if not all(len(series_data) == len(labels) for series_data in raw_data_points_or_series):
-                    print(f"Multi-series chart data length mismatch for '{chart_title}'. Skipping.")
-                    continue
-
-                for i, series_data_raw in enumerate(raw_data_points_or_series):
-                    numeric_data_points, valid = _parse_chart_data_points(series_data_raw, chart_title)
-                    if valid and numeric_data_points:
-                         datasets_for_chart.append({"label": f"Series {i+1} for {chart_title}", "data": numeric_data_points})
-                    else:
-                        print(f"Failed to parse series {i+1} for multi-series chart '{chart_title}'. Skipping entire chart.")
-                        datasets_for_chart = [] # Invalidate chart
-                        break 
-            else: # Single series
-                raw_data_points = raw_data_points_or_series
-                if not (isinstance(labels, list) and isinstance(raw_data_points, list) and len(labels) == len(raw_data_points) and len(labels) > 0):
-                    print(f"Chart data format/length mismatch for '{chart_title}' (Match {match_idx_chart}). Labels: {len(labels)}, Data: {len(raw_data_points)}. Skipping.")
-                    continue
-                
-                numeric_data_points, valid = _parse_chart_data_points(raw_data_points, chart_title)
-                if valid and numeric_data_points:
-                    chart_dataset_label = chart_title 
-                    if chart_source: chart_dataset_label += f" (Source: {chart_source})" # Add source to dataset label for single series
-                    datasets_for_chart.append({"label": chart_dataset_label, "data": numeric_data_points})
-            
-            if datasets_for_chart: # If any valid datasets were processed
-                if len(labels) > 15: # Increased limit slightly
-                    print(f"Warning: Chart '{chart_title}' has {len(labels)} labels, truncating to 15 for display.")
-                    labels = labels[:15]
-                    # Datasets must also be truncated
-                    for ds in datasets_for_chart:
-                        ds["data"] = ds["data"][:15]
-
-
-                temp_charts_list.append({
-                    "type": chart_type, "title": chart_title, "labels": [str(l) for l in labels],
-                    "datasets": datasets_for_chart,
-                    "source": chart_source
-                })
-                print(f"Successfully parsed chart: '{chart_title}' with {len(datasets_for_chart)} dataset(s) for {request_desc}")
-
-        except Exception as e_chart_parse:
-            print(f"Error parsing CHART_DATA (Match {match_idx_chart}): {e_chart_parse}. Raw: {chart_match_item.group(0)}")
+    for match_idx_chart, chart_match_item in enumerate(CHART_DATA_PATTERN.finditer(full_report_markdown_content)):
+        parsed_chart = _parse_chart_directive(chart_match_item, request_desc, match_idx_chart)
+        if parsed_chart:
+            temp_charts_list.append(parsed_chart)
     
     report_data["charts"] = temp_charts_list
     print(f"Total charts parsed and ready for rendering: {len(report_data['charts'])}")
@@ -596,6 +615,120 @@ async def conduct_deep_research(research_params: SurveyResearchRequest):
     print(f"Finished HEALTH ANALYSIS for: {request_desc}.")
     return report_data
 
+class _ThinkFilter:
+    """Drops <think>...</think> content from a line-by-line stream, even when a block spans lines."""
+
+    def __init__(self):
+        self.in_think = False
+
+    def visible_part(self, line: str) -> str:
+        visible = ""
+        position = 0
+        lowered = line.lower()
+        while position < len(line):
+            if self.in_think:
+                end_index = lowered.find("</think>", position)
+                if end_index == -1:
+                    return visible
+                self.in_think = False
+                position = end_index + len("</think>")
+            else:
+                start_index = lowered.find("<think>", position)
+                if start_index == -1:
+                    return visible + line[position:]
+                visible += line[position:start_index]
+                self.in_think = True
+                position = start_index + len("<think>")
+        return visible
+
+async def stream_deep_research(research_params: SurveyResearchRequest):
+    """
+    Streaming variant of conduct_deep_research. Yields events as the model writes:
+      {"event": "section", "data": {"index", "heading", "markdown"}}  - each completed '## ' section
+      {"event": "chart", "data": <ChartData dict>}                     - as soon as a CHART_DATA line is complete
+      {"event": "complete", "data": <report_data dict>}                - same shape conduct_deep_research returns
+    Upstream failures end the stream with a "complete" event whose markdown is the usual "Error: ..." string.
+    """
+    request_desc = _describe_research_request(research_params)
+    print(f"Starting STREAMED HEALTH ANALYSIS for: {request_desc} using {RESEARCH_MODEL_NAME}")
+    report_data = _new_report_data(research_params)
+    mega_prompt = _build_report_prompt(research_params)
+
+    if not PERPLEXITY_API_KEY:
+        report_data["full_report_markdown"] = report_data["full_text_for_follow_up"] = "Error: API Key is not configured on the server."
+        yield {"event": "complete", "data": report_data}
+        return
+
+    payload = {
+        "model": RESEARCH_MODEL_NAME,
+        "messages": [{"role": "system", "content": REPORT_WRITER_SYSTEM_PROMPT}, {"role": "user", "content": mega_prompt}],
+        "max_tokens": 8192,
+        "temperature": 0.3
+    }
+    timeout_duration = resilience.get_timeout(RESEARCH_MODEL_NAME) # Per read; the stream itself may run longer
+
+    think_filter = _ThinkFilter()
+    report_lines = []         # Visible report lines, starting at the first '##' heading
+    section_lines = []        # Lines of the section currently being written
+    section_index = 0
+    pending_text = ""
+    charts = []
+
+    def handle_line(line: str):
+        """Processes one complete line; returns the events it produces."""
+        nonlocal section_lines, section_index
+        events = []
+        visible_line = think_filter.visible_part(line)
+        if not report_lines and not visible_line.lstrip().startswith("##"):
+            return events # Untagged preamble before the title, stripped like the non-streamed path
+        is_h2 = visible_line.startswith("## ")
+        if is_h2 and section_lines:
+            events.append(_section_event(section_index, section_lines))
+            section_index += 1
+            section_lines = []
+        report_lines.append(visible_line)
+        section_lines.append(visible_line)
+        chart_match = CHART_DATA_PATTERN.search(visible_line)
+        if chart_match:
+            parsed_chart = _parse_chart_directive(chart_match, request_desc, len(charts))
+            if parsed_chart:
+                charts.append(parsed_chart)
+                events.append({"event": "chart", "data": parsed_chart})
+        return events
+
+    try:
+        async for delta in perplexity_client.stream_chat_completion(
+            payload, PERPLEXITY_API_KEY, cache_mode="survey_report",
+            priority=PRIORITY_BATCH, app="survey_research"
+        ):
+            pending_text += delta
+            *complete_lines, pending_text = pending_text.split("\n")
+            for line in complete_lines:
+                for event in handle_line(line):
+                    yield event
+        if pending_text:
+            for event in handle_line(pending_text):
+                yield event
+        if section_lines:
+            yield _section_event(section_index, section_lines)
+    except Exception as e:
+        error_text = _format_api_error(e, RESEARCH_MODEL_NAME, timeout_duration)
+        print(f"Streamed report generation failed for {request_desc}. API Error: {error_text}")
+        report_data["full_report_markdown"] = report_data["full_text_for_follow_up"] = error_text
+        yield {"event": "complete", "data": report_data}
+        return
+
+    full_report_markdown_content = "\n".join(report_lines).strip()
+    report_data["full_report_markdown"] = full_report_markdown_content
+    report_data["full_text_for_follow_up"] = full_report_markdown_content
+    report_data["charts"] = charts
+    print(f"Finished STREAMED HEALTH ANALYSIS for: {request_desc}. Sections: {section_index + 1}, charts: {len(charts)}.")
+    yield {"event": "complete", "data": report_data}
+
+def _section_event(section_index: int, section_lines: list) -> dict:
+    heading = section_lines[0].lstrip("#").strip() if section_lines else ""
+    return {"event": "section", "data": {"index": section_index, "heading": heading, "markdown": "\n".join(section_lines).strip()}}
+
 def _parse_chart_data_points(raw_points_list: list, chart_title_for_log: str) -> tuple[list, bool]:
     """Helper to parse a list of raw data points into numeric, returns (data_list, is_valid)"""
     numeric_data = []
@@ -647,5 +780,7 @@ async def answer_follow_up_question(question: str, report_context: str) -> str:
         model_name=FOLLOW_UP_MODEL_NAME,
         system_prompt_content=system_prompt_content, 
         max_tokens=1024,
-        temperature=0.3
+        temperature=0.3,
+        cache_mode="survey_follow_up",
+        priority=PRIORITY_INTERACTIVE # A user is waiting on follow-up answers
     )
\ No newline at end of file
@@ -0,0 +1,25 @@
+# The apps are imported as top-level packages from the project root (as uvicorn runs them)
+import importlib
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+@pytest.fixture
+def chat_memory(tmp_path, monkeypatch):
+    """A fresh MedicalMemory (SQLite, no write-behind thread) stored under tmp_path, used by the chat
+    routes in place of the app's own for the duration of a test."""
+    chat_router = importlib.import_module("medical-assistant.api.chat_router")
+    medical_memory = importlib.import_module("medical-assistant.utils.medical_memory")
+    memory_storage = importlib.import_module("medical-assistant.utils.memory_storage")
+    monkeypatch.chdir(tmp_path) # Storage paths are relative to the working directory
+    os.makedirs(memory_storage.DATA_DIR_RELATIVE_TO_PROJECT_ROOT)
+    monkeypatch.setattr(medical_memory.settings, "MEDICAL_MEMORY_WRITE_BEHIND", False)
+    memory = medical_memory.MedicalMemory(backend="sqlite")
+    monkeypatch.setattr(chat_router, "memory_handler", memory)
+    return memory
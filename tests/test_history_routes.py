@@ -0,0 +1,130 @@
+# History API: cursor pagination, since filtering, field projection and conditional GETs.
+import base64
+import importlib
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+main_app = importlib.import_module("medical-assistant.main").app
+
+HISTORY_URL = "/api/v1/history/qna"
+
+
+def _interaction(n, **extra):
+    return {"id": f"id-{n:02d}", "timestamp": f"2026-03-01T10:{n:02d}:00Z", "user_message": f"question {n}", "ai_response": f"answer {n}", **extra}
+
+
+def _seed(memory, user_id, count, mode="qna"):
+    memory.import_records([("interaction", user_id, mode, _interaction(n)) for n in range(count)])
+
+
+@pytest.fixture
+def client(chat_memory):
+    return TestClient(main_app)
+
+
+def _ids(entries):
+    return [entry["id"] for entry in entries]
+
+
+def test_cursor_pages_cover_the_history_without_duplicates_or_gaps(chat_memory, client):
+    _seed(chat_memory, "alice", 7)
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = client.get(HISTORY_URL, params=params, headers={"X-User-ID": "alice"})
+        assert response.status_code == 200
+        pages.append(_ids(response.json()))
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    # Newest page first, each page oldest-first
+    assert pages == [["id-04", "id-05", "id-06"], ["id-01", "id-02", "id-03"], ["id-00"]]
+
+
+def test_cursor_stays_put_when_newer_interactions_arrive(chat_memory, client):
+    _seed(chat_memory, "alice", 4)
+    first_page = client.get(HISTORY_URL, params={"limit": 2}, headers={"X-User-ID": "alice"})
+    chat_memory.import_records([("interaction", "alice", "qna", _interaction(30))])
+
+    second_page = client.get(HISTORY_URL, params={"limit": 2, "cursor": first_page.headers["X-Next-Cursor"]}, headers={"X-User-ID": "alice"})
+    assert _ids(first_page.json()) == ["id-02", "id-03"]
+    assert _ids(second_page.json()) == ["id-00", "id-01"]
+    assert "X-Next-Cursor" not in second_page.headers
+
+
+def test_invalid_cursor_is_rejected(chat_memory, client):
+    garbage = base64.urlsafe_b64encode(b"not json").decode()
+    assert client.get(HISTORY_URL, params={"cursor": garbage}).status_code == 400
+
+
+def test_since_returns_only_later_interactions(chat_memory, client):
+    _seed(chat_memory, "alice", 5)
+    response = client.get(HISTORY_URL, params={"since": "2026-03-01T10:02:00Z"}, headers={"X-User-ID": "alice"})
+    assert _ids(response.json()) == ["id-03", "id-04"]
+
+    offset_form = client.get(HISTORY_URL, params={"since": "2026-03-01T12:02:00+02:00"}, headers={"X-User-ID": "alice"})
+    assert _ids(offset_form.json()) == ["id-03", "id-04"]
+    assert client.get(HISTORY_URL, params={"since": "yesterday"}).status_code == 400
+
+
+def test_since_applies_to_the_summary_route(chat_memory, client):
+    _seed(chat_memory, "alice", 3)
+    _seed(chat_memory, "alice", 3, mode="symptoms")
+    overview = client.get("/api/v1/history/summary/all", params={"since": "2026-03-01T10:01:00Z"}, headers={"X-User-ID": "alice"}).json()
+    assert {mode: _ids(entries) for mode, entries in overview["conversation_summaries"].items()} == {"qna": ["id-02"], "symptoms": ["id-02"]}
+
+
+def test_fields_projects_each_entry(chat_memory, client):
+    _seed(chat_memory, "alice", 2)
+    response = client.get(HISTORY_URL, params={"fields": "id,user_message"}, headers={"X-User-ID": "alice"})
+    assert response.json() == [{"id": "id-00", "user_message": "question 0"}, {"id": "id-01", "user_message": "question 1"}]
+
+    response = client.get(HISTORY_URL, params={"fields": "id,password"}, headers={"X-User-ID": "alice"})
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+
+
+def test_matching_if_none_match_gets_a_bodiless_304(chat_memory, client):
+    _seed(chat_memory, "alice", 2)
+    first = client.get(HISTORY_URL, headers={"X-User-ID": "alice"})
+    etag = first.headers["ETag"]
+
+    unchanged = client.get(HISTORY_URL, headers={"X-User-ID": "alice", "If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["ETag"] == etag
+
+    chat_memory.import_records([("interaction", "alice", "qna", _interaction(9))])
+    changed = client.get(HISTORY_URL, headers={"X-User-ID": "alice", "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert _ids(changed.json())[-1] == "id-09"
+
+
+def test_etag_differs_per_user_and_never_matches_across_users(chat_memory, client):
+    _seed(chat_memory, "alice", 2)
+    chat_memory.import_records([("interaction", "bob", "qna", _interaction(5))])
+    alice = client.get(HISTORY_URL, headers={"X-User-ID": "alice"})
+    bob = client.get(HISTORY_URL, headers={"X-User-ID": "bob"})
+
+    assert alice.headers["ETag"] != bob.headers["ETag"]
+    assert "X-User-ID" in alice.headers["Vary"] # Shared caches must not serve one user's page to another
+    assert alice.headers["Cache-Control"] == "private, no-cache"
+    bob_with_alices_tag = client.get(HISTORY_URL, headers={"X-User-ID": "bob", "If-None-Match": alice.headers["ETag"]})
+    assert bob_with_alices_tag.status_code == 200
+    assert _ids(bob_with_alices_tag.json()) == ["id-05"]
+
+
+def test_search_covers_only_the_retained_history(chat_memory, client):
+    retained = importlib.import_module("medical-assistant.utils.medical_memory").MAX_HISTORY_ENTRIES_PER_MODE
+    oldest = {**_interaction(0), "user_message": "question about wheezing"}
+    chat_memory.import_records([("interaction", "alice", "qna", oldest)])
+    assert client.get("/api/v1/history/search", params={"q": "wheezing"}, headers={"X-User-ID": "alice"}).json()["total"] == 1
+
+    # Once newer turns push it out of the retained window it is gone from storage, and so from search
+    chat_memory.import_records([("interaction", "alice", "qna", {**_interaction(n), "id": f"newer-{n}"}) for n in range(1, retained + 1)])
+    assert len(chat_memory.get_conversation_history("qna", user_id="alice")) == retained
+    assert client.get("/api/v1/history/search", params={"q": "wheezing"}, headers={"X-User-ID": "alice"}).json()["total"] == 0
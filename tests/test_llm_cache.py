@@ -0,0 +1,46 @@
+# LLM response cache: answers to personal prompts (chat QnA, symptoms, reports) never reach the
+# plaintext disk tier; only the non-personal modes are persisted across restarts.
+import asyncio
+import json
+import time
+
+from shared_services.llm_cache import LLMResponseCache, DISK_MODES
+
+RESPONSE = {"choices": [{"index": 0, "message": {"role": "assistant", "content": "answer"}}]}
+
+
+def test_personal_modes_are_cached_in_memory_only(tmp_path):
+    cache = LLMResponseCache(cache_dir=tmp_path)
+
+    async def scenario():
+        for mode in ("qna", "symptoms", "report"):
+            await cache.set(f"key-{mode}", RESPONSE, mode)
+        return [await cache.get(f"key-{mode}") for mode in ("qna", "symptoms", "report")]
+
+    assert asyncio.run(scenario()) == [RESPONSE] * 3
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_non_personal_modes_survive_a_restart(tmp_path):
+    asyncio.run(LLMResponseCache(cache_dir=tmp_path).set("key-advisories", RESPONSE, "advisories"))
+
+    restarted = LLMResponseCache(cache_dir=tmp_path)
+    assert asyncio.run(restarted.get("key-advisories")) == RESPONSE
+    assert restarted.stats_counters["disk_hits"] == 1
+
+
+def test_personal_modes_cannot_be_configured_onto_disk(tmp_path):
+    assert not {"qna", "symptoms", "report"} & DISK_MODES
+    cache = LLMResponseCache(cache_dir=tmp_path, disk_modes={"qna", "advisories"})
+    asyncio.run(cache.set("key-qna", RESPONSE, "qna"))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_prune_removes_personal_entries_left_by_older_versions(tmp_path):
+    expires_at = time.time() + 3600
+    for key, mode in (("old-qna", "qna"), ("old-advisories", "advisories")):
+        (tmp_path / f"{key}.json").write_text(json.dumps({"mode": mode, "expires_at": expires_at, "response": RESPONSE}))
+
+    cache = LLMResponseCache(cache_dir=tmp_path)
+    assert cache.prune_expired_disk_entries() == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["old-advisories.json"]
@@ -0,0 +1,114 @@
+# MedicalMemory storage engines: the one-time JSON -> SQLite migration, per-mode trimming and
+# atomic batches.
+import importlib
+import json
+import os
+
+import pytest
+
+memory_storage = importlib.import_module("medical-assistant.utils.memory_storage")
+
+@pytest.fixture(autouse=True)
+def isolated_data_dir(tmp_path, monkeypatch):
+    # The engines resolve the legacy JSON files and users/ relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(memory_storage.DATA_DIR_RELATIVE_TO_PROJECT_ROOT)
+
+
+def _interaction(interaction_id):
+    return {"id": interaction_id, "timestamp": f"2026-01-01T00:00:{interaction_id:0>2}Z", "user_message": f"q{interaction_id}", "ai_response": f"a{interaction_id}"}
+
+
+def _ids(history):
+    return [interaction["id"] for interaction in history]
+
+
+def _write_legacy_files(conversations, summaries):
+    with open(memory_storage.CONVERSATIONS_FILE, "w") as f: json.dump(conversations, f)
+    with open(memory_storage.MEDICAL_SUMMARY_FILE, "w") as f: json.dump(summaries, f)
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "json":
+        return memory_storage.JsonFileStorage(str(tmp_path / "users"))
+    return memory_storage.SQLiteStorage(str(tmp_path / "memory.db"))
+
+
+def test_sqlite_migrates_legacy_json_exactly_once(tmp_path):
+    _write_legacy_files(
+        {"alice": {"qna": [_interaction("1"), _interaction("2")], "symptoms": [_interaction("3")], "report": [_interaction("4")]}},
+        {"alice": {"allergies": ["penicillin"], "rolling_summaries": {"qna": {"text": "old"}}}},
+    )
+    db_path = str(tmp_path / "memory.db")
+    storage = memory_storage.SQLiteStorage(db_path)
+
+    assert _ids(storage.get_history("alice", "qna")) == ["1", "2"]
+    assert _ids(storage.get_history("alice", "symptoms")) == ["3"]
+    summary = storage.get_medical_summary("alice")
+    assert summary["allergies"] == ["penicillin"]
+    assert "rolling_summaries" not in summary # Legacy derived data is not carried over
+
+    # A restart (or a second worker) with the legacy files still present must not import them again
+    _write_legacy_files({"alice": {"qna": [_interaction("5")]}, "bob": {"qna": [_interaction("6")]}}, {})
+    reopened = memory_storage.SQLiteStorage(db_path)
+    assert _ids(reopened.get_history("alice", "qna")) == ["1", "2"]
+    assert reopened.get_history("bob", "qna") == []
+
+
+def test_sharded_migration_puts_each_user_in_their_own_shard(tmp_path):
+    _write_legacy_files({user_id: {"qna": [_interaction(str(i))]} for i, user_id in enumerate(["alice", "bob", "carol", "dave"])}, {})
+    storage = memory_storage.ShardedSQLiteStorage(shard_count=2, db_path=str(tmp_path / "memory.db"))
+
+    for user_id in ("alice", "bob", "carol", "dave"):
+        own_shard = storage.shard_index(user_id)
+        assert len(storage.shards[own_shard].get_history(user_id, "qna")) == 1
+        assert storage.shards[1 - own_shard].get_history(user_id, "qna") == []
+
+
+def test_append_trims_each_mode_to_max_entries(storage):
+    for i in range(1, 6):
+        storage.append_interaction("alice", "qna", _interaction(str(i)), 3)
+    storage.append_interaction("alice", "symptoms", _interaction("9"), 3)
+    storage.append_interaction("bob", "qna", _interaction("7"), 3)
+
+    assert _ids(storage.get_history("alice", "qna")) == ["3", "4", "5"]
+    assert _ids(storage.get_history("alice", "qna", limit=2)) == ["4", "5"]
+    assert _ids(storage.get_history("alice", "symptoms")) == ["9"]
+    assert _ids(storage.get_history("bob", "qna")) == ["7"]
+
+
+def test_apply_changes_applies_in_order_and_returns_current_tokens(storage):
+    tokens = storage.apply_changes([
+        ("append", "alice", "qna", _interaction("1"), 50),
+        ("clear", "alice"),
+        ("append", "alice", "qna", _interaction("2"), 50),
+        ("summary", "alice", {**memory_storage.empty_medical_summary(), "allergies": ["latex"]}),
+        ("summary_update", "alice", lambda summary: summary["allergies"].append("pollen")),
+        ("append", "bob", "symptoms", _interaction("3"), 50),
+    ])
+
+    assert _ids(storage.get_history("alice", "qna")) == ["2"]
+    assert storage.get_medical_summary("alice")["allergies"] == ["latex", "pollen"]
+    assert tokens == {"alice": storage.change_token("alice"), "bob": storage.change_token("bob")}
+
+
+def test_sqlite_apply_changes_is_all_or_nothing(tmp_path):
+    storage = memory_storage.SQLiteStorage(str(tmp_path / "memory.db"))
+    storage.append_interaction("alice", "qna", _interaction("1"), 50)
+    token_before = storage.change_token("alice")
+
+    def failing_update(summary):
+        raise ValueError("update failed")
+
+    with pytest.raises(ValueError):
+        storage.apply_changes([
+            ("append", "alice", "qna", _interaction("2"), 50),
+            ("append", "bob", "qna", _interaction("3"), 50),
+            ("summary_update", "alice", failing_update),
+        ])
+
+    assert _ids(storage.get_history("alice", "qna")) == ["1"]
+    assert storage.get_history("bob", "qna") == []
+    assert storage.change_token("alice") == token_before
+    assert storage.change_token("bob") == 0
@@ -0,0 +1,148 @@
+# NDJSON export/import of MedicalMemory: round trips, the per-line size cap, merge vs replace, and
+# the admin token that all_users requires.
+import asyncio
+import importlib
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+main_app = importlib.import_module("medical-assistant.main").app
+chat_router = importlib.import_module("medical-assistant.api.chat_router")
+memory_transfer = importlib.import_module("medical-assistant.utils.memory_transfer")
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+def _interaction(n):
+    return {"id": f"id-{n:02d}", "timestamp": f"2026-03-01T10:{n:02d}:00Z", "user_message": f"question {n}", "ai_response": f"answer {n}"}
+
+
+def _summary(allergy):
+    return {"symptoms_log": [], "key_diagnoses_mentioned": [], "allergies": [allergy], "medications_log": []}
+
+
+def _ids(memory, user_id, mode="qna"):
+    return [entry["id"] for entry in memory.get_conversation_history(mode, user_id=user_id)]
+
+
+def _records(body):
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+def _ndjson(*records):
+    return "".join(json.dumps(record) + "\n" for record in records).encode()
+
+
+HEADER = {"type": "header", "format": memory_transfer.EXPORT_FORMAT, "version": memory_transfer.EXPORT_VERSION}
+
+
+def _interaction_record(user_id, n, mode="qna"):
+    return {"type": "interaction", "user_id": user_id, "mode": mode, "interaction": _interaction(n)}
+
+
+@pytest.fixture
+def client(chat_memory):
+    return TestClient(main_app)
+
+
+@pytest.fixture
+def admin_token(monkeypatch):
+    monkeypatch.setattr(chat_router.settings, "MEDICAL_MEMORY_ADMIN_TOKEN", ADMIN_TOKEN)
+    return ADMIN_TOKEN
+
+
+def test_export_then_import_round_trips_a_user(chat_memory, client):
+    chat_memory.import_records([
+        ("interaction", "alice", "qna", _interaction(1)),
+        ("interaction", "alice", "qna", _interaction(2)),
+        ("interaction", "alice", "symptoms", _interaction(3)),
+        ("medical_summary", "alice", _summary("penicillin")),
+    ])
+    export = client.get("/api/v1/memory/export", headers={"X-User-ID": "alice"})
+    assert export.status_code == 200
+    assert export.headers["content-type"] == "application/x-ndjson"
+    records = _records(export.text)
+    assert [record["type"] for record in records] == ["header", "interaction", "interaction", "interaction", "medical_summary", "footer"]
+    assert records[-1] == {"type": "footer", "users": 1, "interactions": 3}
+
+    imported = client.post("/api/v1/memory/import", content=export.content, headers={"X-User-ID": "bob"})
+    assert imported.status_code == 200
+    assert imported.json()["interactions"] == 3 and imported.json()["error_count"] == 0
+    for mode in ("qna", "symptoms"):
+        assert chat_memory.get_conversation_history(mode, user_id="bob") == chat_memory.get_conversation_history(mode, user_id="alice")
+    assert chat_memory.get_medical_summary("bob") == chat_memory.get_medical_summary("alice")
+
+    # Importing the same export again changes nothing
+    again = client.post("/api/v1/memory/import", content=export.content, headers={"X-User-ID": "bob"}).json()
+    assert (again["interactions"], again["duplicates_skipped"]) == (0, 3)
+    assert _ids(chat_memory, "bob") == ["id-01", "id-02"]
+
+
+def test_merge_keeps_existing_data_and_replace_clears_it_first(chat_memory, client):
+    body = _ndjson(HEADER, _interaction_record("ignored", 2), _interaction_record("ignored", 3))
+
+    chat_memory.import_records([("interaction", "bob", "qna", _interaction(1)), ("interaction", "bob", "symptoms", _interaction(9))])
+    merged = client.post("/api/v1/memory/import", content=body, headers={"X-User-ID": "bob"}).json()
+    assert merged["interactions"] == 2
+    assert _ids(chat_memory, "bob") == ["id-01", "id-02", "id-03"]
+    assert _ids(chat_memory, "bob", "symptoms") == ["id-09"]
+
+    replaced = client.post("/api/v1/memory/import", params={"strategy": "replace"}, content=body, headers={"X-User-ID": "bob"}).json()
+    assert (replaced["interactions"], replaced["duplicates_skipped"]) == (2, 0)
+    assert _ids(chat_memory, "bob") == ["id-02", "id-03"]
+    assert _ids(chat_memory, "bob", "symptoms") == [] # Replace clears the whole user, not just the imported modes
+
+
+def test_bad_lines_are_reported_and_an_unreadable_header_imports_nothing(chat_memory, client):
+    body = _ndjson(HEADER, _interaction_record("x", 1), {"type": "interaction", "mode": "report", "interaction": _interaction(2)}) + b"{not json\n"
+    result = client.post("/api/v1/memory/import", content=body, headers={"X-User-ID": "bob"}).json()
+    assert result["interactions"] == 1
+    assert [error["line"] for error in result["errors"]] == [3, 4]
+
+    foreign = _ndjson({"type": "header", "format": "something-else", "version": 1}, _interaction_record("x", 5))
+    response = client.post("/api/v1/memory/import", content=foreign, headers={"X-User-ID": "carol"})
+    assert response.status_code == 400
+    assert chat_memory.iter_user_ids() == ["bob"]
+
+
+@pytest.mark.parametrize("chunk_size", [64 * 1024, 4 * 1024 * 1024], ids=["split-across-chunks", "whole-in-one-chunk"])
+def test_lines_over_the_size_cap_are_rejected_without_losing_the_rest(chat_memory, chunk_size):
+    oversized = _interaction_record("bob", 2)
+    oversized["interaction"]["ai_response"] = "x" * (memory_transfer.MAX_IMPORT_LINE_BYTES + 1)
+    body = _ndjson(HEADER, _interaction_record("bob", 1), oversized, _interaction_record("bob", 3))
+
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    result = asyncio.run(memory_transfer.import_ndjson(chat_memory, chunks(), "bob"))
+    assert result["lines"] == 4
+    assert result["errors"] == [{"line": 3, "error": f"line longer than {memory_transfer.MAX_IMPORT_LINE_BYTES} bytes"}]
+    assert _ids(chat_memory, "bob") == ["id-01", "id-03"]
+
+
+def test_all_users_is_refused_unless_an_admin_token_is_configured_and_sent(chat_memory, client, monkeypatch):
+    chat_memory.import_records([("interaction", "alice", "qna", _interaction(1))])
+    assert client.get("/api/v1/memory/export", params={"all_users": "true"}, headers={"X-Admin-Token": "anything"}).status_code == 403
+
+    monkeypatch.setattr(chat_router.settings, "MEDICAL_MEMORY_ADMIN_TOKEN", ADMIN_TOKEN)
+    assert client.get("/api/v1/memory/export", params={"all_users": "true"}).status_code == 403
+    assert client.get("/api/v1/memory/export", params={"all_users": "true"}, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    body = _ndjson(HEADER, _interaction_record("mallory", 1))
+    assert client.post("/api/v1/memory/import", params={"all_users": "true"}, content=body, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert "mallory" not in chat_memory.iter_user_ids()
+
+
+def test_all_users_with_the_admin_token_exports_and_imports_every_user(chat_memory, client, admin_token):
+    chat_memory.import_records([("interaction", "alice", "qna", _interaction(1)), ("interaction", "bob", "symptoms", _interaction(2))])
+    export = client.get("/api/v1/memory/export", params={"all_users": "true"}, headers={"X-Admin-Token": admin_token})
+    assert export.status_code == 200
+    assert {record.get("user_id") for record in _records(export.text) if record["type"] == "interaction"} == {"alice", "bob"}
+
+    chat_memory.clear_all_user_data("alice")
+    chat_memory.clear_all_user_data("bob")
+    imported = client.post("/api/v1/memory/import", params={"all_users": "true"}, content=export.content, headers={"X-Admin-Token": admin_token})
+    assert imported.json()["users"] == 2
+    assert _ids(chat_memory, "alice") == ["id-01"]
+    assert _ids(chat_memory, "bob", "symptoms") == ["id-02"]
@@ -0,0 +1,96 @@
+# Regression tests: report analysis never blocks the event loop, neither while the LLM call is
+# pending nor while a file is being parsed, so the rest of the suite keeps answering meanwhile.
+import asyncio
+import importlib
+import time
+
+import httpx
+
+import report_analyzer_app.main_router as report_analyzer_router
+from shared_services import perplexity_client
+
+main_app = importlib.import_module("medical-assistant.main").app
+
+SLOW_STEP_SECONDS = 1.0
+MAX_HEALTH_LATENCY_SECONDS = 0.3
+AI_RESPONSE_TEXT = """GENERAL_SUMMARY: All values are within normal limits.
+IDENTIFIED_PARAMETERS:
+Hemoglobin: 13.5 g/dL (13.00-17.00 g/dL) - Normal
+OBSERVED_ABNORMALITIES:
+None.
+GENERAL_RECOMMENDATIONS:
+Routine follow-up."""
+
+
+def _chat_completion_response(content):
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+
+def _poll_health_during(analysis_coro):
+    """Runs analysis_coro as a task and polls /api/v1/health until it finishes. Returns the health latencies."""
+    async def scenario():
+        analysis = asyncio.create_task(analysis_coro)
+        latencies = []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main_app), base_url="http://test") as client:
+            await asyncio.sleep(0.05) # Let the analysis reach its slow step
+            while not analysis.done():
+                started = time.perf_counter()
+                response = await client.get("/api/v1/health")
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200
+                await asyncio.sleep(0.05)
+        await analysis
+        return latencies
+
+    return asyncio.run(scenario())
+
+
+def _assert_responsive(latencies):
+    assert len(latencies) >= 5, "health was not polled while the analysis ran"
+    assert max(latencies) < MAX_HEALTH_LATENCY_SECONDS, f"health check blocked for {max(latencies):.2f}s during analysis"
+
+
+def test_health_stays_responsive_while_report_llm_call_is_pending(monkeypatch, tmp_path):
+    upstream_calls = []
+
+    async def slow_create_chat_completion(payload, api_key, **kwargs):
+        upstream_calls.append(payload)
+        await asyncio.sleep(SLOW_STEP_SECONDS) # A slow upstream answer, awaited like the real pooled client
+        return _chat_completion_response(AI_RESPONSE_TEXT)
+
+    monkeypatch.setattr(perplexity_client, "create_chat_completion", slow_create_chat_completion)
+    monkeypatch.setattr(report_analyzer_router, "API_KEY", "pplx-test")
+    monkeypatch.setattr(report_analyzer_router, "RESULTS_DIR", tmp_path)
+    report_path = tmp_path / "report.txt"
+    report_path.write_text("Complete blood count. Hemoglobin 13.5 g/dL, reference 13.00-17.00 g/dL.")
+
+    analysis_id = "responsiveness-llm"
+    latencies = _poll_health_during(report_analyzer_router.process_report(str(report_path), "report.txt", analysis_id))
+    result = report_analyzer_router.analysis_results.pop(analysis_id)
+
+    _assert_responsive(latencies)
+    assert len(upstream_calls) == 1
+    assert "Hemoglobin 13.5" in upstream_calls[0]["messages"][-1]["content"]
+    assert result["summary"] == "All values are within normal limits."
+    assert result["structured_data"]["parameters"][0]["name"] == "Hemoglobin"
+
+
+def test_health_stays_responsive_during_report_extraction(monkeypatch, tmp_path):
+    def slow_extract_text_from_file(file_path, file_type):
+        time.sleep(SLOW_STEP_SECONDS) # Stands in for parsing a large PDF: blocking, CPU/disk bound
+        return "Haemoglobin 13.5 g/dL, within the reference range."
+
+    async def fast_create_chat_completion(payload, api_key, **kwargs):
+        return _chat_completion_response(AI_RESPONSE_TEXT)
+
+    monkeypatch.setattr(report_analyzer_router, "extract_text_from_file", slow_extract_text_from_file)
+    monkeypatch.setattr(perplexity_client, "create_chat_completion", fast_create_chat_completion)
+    monkeypatch.setattr(report_analyzer_router, "API_KEY", "pplx-test")
+    monkeypatch.setattr(report_analyzer_router, "RESULTS_DIR", tmp_path)
+
+    analysis_id = "responsiveness-extraction"
+    latencies = _poll_health_during(report_analyzer_router.process_report(str(tmp_path / "report.pdf"), "report.pdf", analysis_id))
+    result = report_analyzer_router.analysis_results.pop(analysis_id)
+
+    _assert_responsive(latencies)
+    assert result["summary"] == "All values are within normal limits."
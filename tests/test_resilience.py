@@ -0,0 +1,93 @@
+# Resilience layer: time spent queued for an upstream slot is not upstream latency, and hedges
+# only go out once the primary request is actually upstream and a spare slot is free.
+import asyncio
+
+import pytest
+
+from shared_services import resilience
+from shared_services.upstream_scheduler import UpstreamScheduler
+
+MODEL = "test-model"
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(resilience, "_latency_trackers", {})
+    monkeypatch.setattr(resilience, "_circuit_breakers", {})
+    monkeypatch.setattr(resilience, "stats_counters", {})
+    monkeypatch.setattr(resilience, "HEDGE_DEFAULT_DELAY_SECONDS", 0.05)
+    fresh_scheduler = UpstreamScheduler()
+    monkeypatch.setattr(resilience, "upstream_scheduler", fresh_scheduler)
+
+    def with_limit(limit):
+        monkeypatch.setenv("UPSTREAM_CONCURRENCY_TEST_MODEL", str(limit))
+        return fresh_scheduler
+    return with_limit
+
+
+def _attempt_log(*durations):
+    """An attempt callable whose n-th call sleeps durations[n]; returns (attempt, calls)."""
+    calls = []
+
+    async def attempt(attempt_timeout):
+        calls.append(attempt_timeout)
+        call_number = len(calls)
+        await asyncio.sleep(durations[call_number - 1])
+        return {"call": call_number}
+    return attempt, calls
+
+
+async def _hold_slot(scheduler, seconds):
+    async with scheduler.slot(MODEL):
+        await asyncio.sleep(seconds)
+
+
+def test_queue_wait_is_not_recorded_as_upstream_latency(scheduler):
+    upstream = scheduler(1)
+    attempt, calls = _attempt_log(0.05)
+
+    async def scenario():
+        holder = asyncio.create_task(_hold_slot(upstream, 0.3))
+        await asyncio.sleep(0) # The holder takes the only slot first
+        result = await resilience.execute(MODEL, attempt, hedge=False)
+        await holder
+        return result
+
+    assert asyncio.run(scenario()) == {"call": 1}
+    samples = list(resilience.get_latency_tracker(MODEL).samples)
+    assert len(samples) == 1 and samples[0] < 0.2, f"latency sample {samples} includes the 0.3s queue wait"
+
+
+def test_no_hedge_while_the_primary_is_still_queued(scheduler):
+    upstream = scheduler(1)
+    attempt, calls = _attempt_log(0.02)
+
+    async def scenario():
+        holder = asyncio.create_task(_hold_slot(upstream, 0.3)) # Far longer than the 0.05s hedge delay
+        await asyncio.sleep(0)
+        await resilience.execute(MODEL, attempt, hedge=True)
+        await holder
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+    assert resilience.stats_counters[MODEL]["hedges_sent"] == 0
+
+
+def test_hedge_is_skipped_when_no_slot_is_free(scheduler):
+    upstream = scheduler(1)
+    attempt, calls = _attempt_log(0.2)
+
+    assert asyncio.run(resilience.execute(MODEL, attempt, hedge=True)) == {"call": 1}
+    assert len(calls) == 1
+    assert resilience.stats_counters[MODEL]["hedges_skipped"] == 1
+    assert upstream.stats()[MODEL]["active"] == 0
+
+
+def test_hedge_uses_a_free_slot_and_releases_it(scheduler):
+    upstream = scheduler(3) # One slot stays reserved for interactive work; standard calls get two
+    attempt, calls = _attempt_log(0.5, 0.01) # Slow primary, fast hedge
+
+    assert asyncio.run(resilience.execute(MODEL, attempt, hedge=True)) == {"call": 2}
+    counters = resilience.stats_counters[MODEL]
+    assert (counters["hedges_sent"], counters["hedge_wins"]) == (1, 1)
+    assert upstream.stats()[MODEL]["active"] == 0 # Both the primary's and the hedge's slots are back
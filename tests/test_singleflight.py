@@ -0,0 +1,166 @@
+# SingleFlight: concurrent identical requests share one upstream call (or stream), errors reach every
+# waiter, and one caller going away does not cancel the work the others are waiting on.
+import asyncio
+import gc
+
+import pytest
+
+from shared_services.singleflight import SingleFlight
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def _counting(result=None, error=None, delay=0.05):
+    """A coroutine factory that counts its calls; returns (factory, calls)."""
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+    return call, calls
+
+
+def test_concurrent_calls_for_a_key_share_one_upstream_call():
+    flights = SingleFlight("test")
+    report, report_calls = _counting({"report": "Kerala"})
+    other, other_calls = _counting({"report": "Goa"})
+
+    async def scenario():
+        results = await asyncio.gather(*[flights.do("kerala", report) for _ in range(5)], flights.do("goa", other))
+        assert flights.in_flight_count() == 0
+        results.append(await flights.do("kerala", report)) # Finished keys run again
+        return results
+
+    results = asyncio.run(scenario())
+    assert results == [{"report": "Kerala"}] * 5 + [{"report": "Goa"}, {"report": "Kerala"}]
+    assert (len(report_calls), len(other_calls)) == (2, 1)
+    assert flights.stats_counters == {"leaders": 3, "coalesced": 4}
+
+
+def test_an_error_reaches_every_waiter_and_is_not_kept():
+    flights = SingleFlight("test")
+    error = UpstreamError("HTTP 503")
+    failing, calls = _counting(error=error)
+
+    async def scenario():
+        outcomes = await asyncio.gather(*[flights.do("key", failing) for _ in range(3)], return_exceptions=True)
+        retry, _ = _counting("recovered")
+        return outcomes, await flights.do("key", retry)
+
+    outcomes, retried = asyncio.run(scenario())
+    assert outcomes == [error] * 3
+    assert len(calls) == 1
+    assert retried == "recovered"
+
+
+def test_cancelling_the_leader_does_not_cancel_the_shared_call():
+    flights = SingleFlight("test")
+    slow, calls = _counting("done", delay=0.1)
+
+    async def scenario():
+        leader = asyncio.create_task(flights.do("key", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("key", slow))
+        await asyncio.sleep(0.02)
+        leader.cancel() # e.g. the first client disconnected
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == "done"
+    assert len(calls) == 1
+
+
+def test_the_shared_call_finishes_even_if_every_caller_goes_away():
+    flights = SingleFlight("test")
+    finished = []
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        raise UpstreamError("nobody is listening") # Must not surface as "exception was never retrieved"
+
+    async def scenario():
+        unhandled = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        caller = asyncio.create_task(flights.do("key", slow))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0.1)
+        gc.collect() # The loop reports unretrieved task exceptions when the task is collected
+        return flights.in_flight_count(), unhandled
+
+    assert asyncio.run(scenario()) == (0, [])
+    assert finished == [1]
+
+
+def _counting_stream(items, error=None, delay=0.02):
+    calls = []
+
+    async def stream():
+        calls.append(1)
+        for item in items:
+            await asyncio.sleep(delay)
+            yield item
+        if error is not None:
+            raise error
+    return stream, calls
+
+
+async def _collect(flights, key, stream, start_delay=0.0):
+    await asyncio.sleep(start_delay)
+    return [item async for item in flights.stream(key, stream)]
+
+
+def test_streams_are_shared_and_late_joiners_are_replayed_earlier_items():
+    flights = SingleFlight("test")
+    stream, calls = _counting_stream(["section-1", "section-2", "section-3", "complete"])
+
+    async def scenario():
+        return await asyncio.gather(_collect(flights, "key", stream), _collect(flights, "key", stream, start_delay=0.05))
+
+    first, late = asyncio.run(scenario())
+    assert first == late == ["section-1", "section-2", "section-3", "complete"]
+    assert len(calls) == 1
+    assert flights.in_flight_count() == 0
+
+
+def test_a_stream_error_reaches_every_subscriber_after_the_items_before_it():
+    flights = SingleFlight("test")
+    error = UpstreamError("upstream closed the stream")
+    stream, calls = _counting_stream(["section-1"], error=error)
+
+    async def subscriber(start_delay):
+        received = []
+        with pytest.raises(UpstreamError) as raised:
+            await asyncio.sleep(start_delay)
+            async for item in flights.stream("key", stream):
+                received.append(item)
+        return received, raised.value
+
+    async def scenario():
+        return await asyncio.gather(subscriber(0), subscriber(0.01))
+
+    results = asyncio.run(scenario())
+    assert results == [(["section-1"], error)] * 2
+    assert len(calls) == 1
+
+
+def test_a_subscriber_leaving_does_not_stop_the_stream_for_the_others():
+    flights = SingleFlight("test")
+    stream, calls = _counting_stream(["a", "b", "c"])
+
+    async def leaves_after_first_item():
+        async for item in flights.stream("key", stream):
+            return item # Closes this subscriber's generator, like a disconnected SSE client
+
+    async def scenario():
+        return await asyncio.gather(leaves_after_first_item(), _collect(flights, "key", stream))
+
+    assert asyncio.run(scenario()) == ["a", ["a", "b", "c"]]
+    assert len(calls) == 1
@@ -0,0 +1,134 @@
+# Symptom result cache: canonical keys, error results never cached, and the bypass for users whose
+# prompt would carry their own symptom history.
+import asyncio
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+main_app = importlib.import_module("medical-assistant.main").app
+chat_router = importlib.import_module("medical-assistant.api.chat_router")
+symptom_cache = importlib.import_module("medical-assistant.utils.symptom_cache")
+models = importlib.import_module("medical-assistant.api.models")
+
+MODEL = "sonar-reasoning-pro"
+
+
+def _symptoms(*triples):
+    return [models.ReactSymptomInput(description=description, duration=duration, severity=severity) for description, duration, severity in triples]
+
+
+def _key(*triples, region="Kerala", model=MODEL):
+    return symptom_cache.SymptomResultCache.make_key(_symptoms(*triples), region, model)
+
+
+def test_key_ignores_order_case_spacing_and_punctuation():
+    assert _key(("Fever", "2 days", 2), ("Sore throat", "1 day", 1)) == _key(("  sore-THROAT! ", "1 day", 1), ("fever", "2 days", 2))
+    assert _key(("fever", "2 days", 2), region="Kerala") == _key(("fever", "2 days", 2), region="  kerala ")
+
+
+def test_key_uses_lexicon_concepts_for_descriptions():
+    assert _key(("Head ache", "1 day", 2)) == _key(("headaches", "1 day", 2))
+    assert _key(("high temperature", "1 day", 2)) == _key(("fever", "1 day", 2))
+    assert _key(("headache", "1 day", 2)) != _key(("fever", "1 day", 2))
+
+
+@pytest.mark.parametrize("duration, bucket", [
+    ("3 hours", "under_1_day"),
+    ("since this morning", "under_1_day"),
+    ("since yesterday", "1_to_3_days"),
+    ("2 days", "1_to_3_days"),
+    ("a couple of days", "1_to_3_days"),
+    ("48 hrs", "1_to_3_days"),
+    ("5 days", "4_to_7_days"),
+    ("one week", "4_to_7_days"),
+    ("a few weeks", "1_to_4_weeks"),
+    ("2 months", "over_1_month"),
+    ("on and off", "on and off"),
+    ("", "unknown"),
+])
+def test_duration_buckets(duration, bucket):
+    assert symptom_cache.duration_bucket(duration) == bucket
+
+
+def test_key_buckets_durations_but_keeps_severity_region_and_model_apart():
+    assert _key(("cough", "2 days", 2)) == _key(("cough", "a couple of days", 2))
+    assert _key(("cough", "2 days", 2)) != _key(("cough", "2 weeks", 2))
+    assert _key(("cough", "2 days", 2)) != _key(("cough", "2 days", 3))
+    assert _key(("cough", "2 days", 2)) != _key(("cough", "2 days", 2), region="Goa")
+    assert _key(("cough", "2 days", 2)) != _key(("cough", "2 days", 2), model="sonar-pro")
+    assert _key(("cough", "2 days", 2), ("Cough", "48 hours", 2)) == _key(("cough", "2 days", 2)) # Duplicates collapse
+
+
+def test_error_results_are_returned_but_not_cached():
+    cache = symptom_cache.SymptomResultCache(max_entries=10, ttl_seconds=60, enabled=True)
+    results = [{"error": "AI backend issue: HTTP 503"}, {"answer": "Rest and fluids."}]
+
+    async def compute():
+        return results.pop(0)
+
+    async def scenario():
+        return [await cache.get_or_compute("key", compute) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == [
+        ({"error": "AI backend issue: HTTP 503"}, False),
+        ({"answer": "Rest and fluids."}, False),
+        ({"answer": "Rest and fluids."}, True),
+    ]
+    assert cache.stats()["entries"] == 1
+
+
+def test_concurrent_misses_share_one_computation():
+    cache = symptom_cache.SymptomResultCache(max_entries=10, ttl_seconds=60, enabled=True)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": "Rest and fluids."}
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute("key", compute) for _ in range(5)))
+
+    assert [result for result, _ in asyncio.run(scenario())] == [{"answer": "Rest and fluids."}] * 5
+    assert len(calls) == 1
+
+
+@pytest.fixture
+def analyze_calls(chat_memory, monkeypatch):
+    """Stubs the upstream symptom analysis; returns the list of symptom descriptions it was asked about."""
+    calls = []
+
+    async def fake_analyze_personal_symptoms(symptoms_description, history_context, user_region=None):
+        calls.append(symptoms_description)
+        return {"answer": "Rest, fluids, and consult a doctor if it persists.", "disease_identification": "Common cold", "next_steps_list": []}
+
+    monkeypatch.setattr(chat_router.ai_handler, "analyze_personal_symptoms", fake_analyze_personal_symptoms)
+    monkeypatch.setattr(chat_router, "symptom_cache", symptom_cache.SymptomResultCache(max_entries=10, ttl_seconds=60, enabled=True))
+    monkeypatch.setattr(chat_router.summarizer, "enabled", False)
+    return calls
+
+
+def _analyze(client, user_id, *triples, **extra):
+    body = {"symptoms": [{"description": d, "duration": t, "severity": s} for d, t, s in triples], **extra}
+    response = client.post("/api/v1/symptoms/analyze", json=body, headers={"X-User-ID": user_id})
+    assert response.status_code == 200
+    return response.headers["X-Symptom-Cache"]
+
+
+def test_cache_is_shared_only_between_users_without_symptom_history(analyze_calls):
+    client = TestClient(main_app)
+    assert _analyze(client, "alice", ("Fever", "2 days", 2), ("Cough", "1 day", 1)) == "miss"
+    assert _analyze(client, "bob", ("cough", "1 day", 1), ("fever", "two days", 2)) == "hit"
+    assert len(analyze_calls) == 1
+
+    # Each now has symptom history, which their prompt includes, so the shared result no longer applies
+    assert _analyze(client, "alice", ("Fever", "2 days", 2), ("Cough", "1 day", 1)) == "bypass"
+    assert len(analyze_calls) == 2
+
+
+def test_bypass_cache_flag_forces_a_fresh_analysis(analyze_calls):
+    client = TestClient(main_app)
+    assert _analyze(client, "alice", ("Fever", "2 days", 2)) == "miss"
+    assert _analyze(client, "bob", ("Fever", "2 days", 2), bypass_cache=True) == "bypass"
+    assert len(analyze_calls) == 2
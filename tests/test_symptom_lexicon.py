@@ -0,0 +1,105 @@
+# Symptom lexicon: the word-level Aho-Corasick matcher (overlaps, word boundaries, agreement with a
+# brute-force scan) and the shipped vocabulary keeping only true synonyms in each concept.
+import importlib
+import json
+import random
+
+import pytest
+
+symptom_lexicon = importlib.import_module("medical-assistant.utils.symptom_lexicon")
+settings = importlib.import_module("medical-assistant.config").settings
+
+SymptomLexicon, lexicon_tokens = symptom_lexicon.SymptomLexicon, symptom_lexicon.lexicon_tokens
+
+
+def _lexicon(**synonyms_by_id):
+    return SymptomLexicon({"id": concept_id, "synonyms": synonyms} for concept_id, synonyms in synonyms_by_id.items())
+
+
+def test_overlapping_matches_resolve_leftmost_longest():
+    lexicon = _lexicon(pain=["pain"], chest_pain=["chest pain"], chest_pain_on_breathing=["chest pain on breathing"], breathing=["breathing"])
+    assert lexicon.find("chest pain on breathing") == [(0, 4, "chest_pain_on_breathing")]
+    assert lexicon.find("chest pain on exertion") == [(0, 2, "chest_pain")] # The longer phrase fails at its last word
+    assert lexicon.find("pain, then chest pain while breathing") == [(0, 1, "pain"), (2, 4, "chest_pain"), (5, 6, "breathing")]
+
+
+def test_phrases_sharing_words_are_all_found_through_failure_links():
+    lexicon = _lexicon(abc=["a b c"], bcd=["b c d"], c=["c"])
+    assert lexicon._matches(lexicon_tokens("a b c d")) == [(0, 3, "abc"), (2, 3, "c"), (1, 4, "bcd")]
+    assert lexicon.find("a b c d") == [(0, 3, "abc")] # bcd overlaps the leftmost match
+    assert lexicon.find("x b c d") == [(1, 4, "bcd")]
+
+
+def test_matching_is_on_whole_words_case_insensitive_with_plurals_folded():
+    lexicon = _lexicon(cough=["cough"], sore_throat=["sore throat"])
+    assert lexicon.concept_ids("Hiccough, coughdrop and cough-syrup") == ["cough"] # Only the standalone word
+    assert lexicon.concept_ids("COUGHS and a Sore-Throat") == ["cough", "sore_throat"]
+    assert lexicon.concept_ids("sore throats") == ["sore_throat"]
+    assert lexicon.concept_ids("sore, raw throat") == [] # Words must be adjacent
+
+
+def test_canonical_form_needs_every_word_accounted_for():
+    lexicon = _lexicon(headache=["headache", "head ache"], fever=["fever"])
+    assert lexicon.canonical_form("Head ache") == lexicon.canonical_form("headaches") == "headache"
+    assert lexicon.canonical_form("fever headache") == lexicon.canonical_form("headache fever") == "fever+headache"
+    assert lexicon.canonical_form("headache behind the left eye") is None
+    assert lexicon.concept_key("headache behind the left eye") == "headache behind the left eye"
+
+
+def test_a_phrase_listed_under_two_concepts_keeps_the_first(capsys):
+    lexicon = _lexicon(first=["shared phrase"], second=["shared phrase", "other"])
+    assert lexicon.concept_ids("shared phrase") == ["first"]
+    assert "listed for both 'first' and 'second'" in capsys.readouterr().out
+
+
+def test_matcher_agrees_with_a_brute_force_scan():
+    rng = random.Random(25)
+    vocabulary = ["a", "b", "c", "d", "e"]
+    phrases = {" ".join(rng.choices(vocabulary, k=rng.randint(1, 3))) for _ in range(20)}
+    lexicon = _lexicon(**{f"c{i}": [phrase] for i, phrase in enumerate(sorted(phrases))})
+    concept_for = {tuple(phrase.split()): f"c{i}" for i, phrase in enumerate(sorted(phrases))}
+
+    for _ in range(200):
+        words = rng.choices(vocabulary, k=rng.randint(0, 12))
+        expected = {(start, end, concept_for[tuple(words[start:end])])
+                    for start in range(len(words)) for end in range(start + 1, len(words) + 1) if tuple(words[start:end]) in concept_for}
+        assert set(lexicon._matches(words)) == expected
+
+
+@pytest.fixture(scope="module")
+def shipped_concepts():
+    with open(settings.SYMPTOM_LEXICON_PATH, encoding="utf-8") as file:
+        return json.load(file)["concepts"]
+
+
+def test_shipped_lexicon_lists_each_phrase_under_one_concept(shipped_concepts):
+    owners = {}
+    for concept in shipped_concepts:
+        for phrase in [concept["label"]] + concept["synonyms"]:
+            owners.setdefault(tuple(lexicon_tokens(phrase)), set()).add(concept["id"])
+    assert {phrase: ids for phrase, ids in owners.items() if len(ids) > 1} == {}
+
+
+@pytest.mark.parametrize("broader, qualified", [
+    ("cough", "dry cough"),
+    ("cough", "productive cough"),
+    ("dizzy", "vertigo"),
+    ("dizzy", "lightheaded"),
+    ("rash", "hives"),
+    ("joint pain", "swollen joints"),
+    ("runny nose", "blocked nose"),
+    ("chills", "rigors"),
+    ("fatigue", "weakness"),
+    ("palpitations", "irregular heartbeat"),
+    ("weight loss", "unexplained weight loss"),
+    ("diabetes", "type 2 diabetes"),
+])
+def test_shipped_lexicon_keeps_qualified_presentations_apart(broader, qualified):
+    lexicon = symptom_lexicon.get_lexicon()
+    assert lexicon.canonical_form(broader) is not None and lexicon.canonical_form(qualified) is not None
+    assert lexicon.canonical_form(broader) != lexicon.canonical_form(qualified)
+
+
+@pytest.mark.parametrize("ambiguous", ["cold", "congestion", "blackout", "fits"])
+def test_shipped_lexicon_leaves_ambiguous_words_unmapped(ambiguous):
+    assert symptom_lexicon.get_lexicon().concept_ids(ambiguous) == []
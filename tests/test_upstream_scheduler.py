@@ -0,0 +1,119 @@
+# Upstream scheduler: lane priority, per-model caps with a slot kept for interactive work, fair
+# round-robin across apps within a lane, and cancellation while queued.
+import asyncio
+
+import pytest
+
+from shared_services.upstream_scheduler import (
+    UpstreamScheduler, PRIORITY_INTERACTIVE, PRIORITY_STANDARD, PRIORITY_BATCH
+)
+
+MODEL = "test-model"
+OTHER_MODEL = "other-model"
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    def with_limits(limit, other_limit=1):
+        monkeypatch.setenv("UPSTREAM_CONCURRENCY_TEST_MODEL", str(limit))
+        monkeypatch.setenv("UPSTREAM_CONCURRENCY_OTHER_MODEL", str(other_limit))
+        return UpstreamScheduler()
+    return with_limits
+
+
+def _grant_order(scheduler, waiters):
+    """Holds MODEL's only slot while (name, priority, app) waiters queue up in list order, then
+    releases it; returns the order in which the waiters were granted the slot."""
+    async def scenario():
+        granted = []
+
+        async def wait_for_slot(name, priority, app):
+            async with scheduler.slot(MODEL, priority, app):
+                granted.append(name)
+
+        await scheduler.acquire(MODEL, PRIORITY_INTERACTIVE)
+        tasks = []
+        for waiter in waiters:
+            tasks.append(asyncio.create_task(wait_for_slot(*waiter)))
+            await asyncio.sleep(0) # Queue in this order
+        scheduler.release(MODEL)
+        await asyncio.gather(*tasks)
+        return granted
+
+    return asyncio.run(scenario())
+
+
+def test_higher_lanes_are_served_first(scheduler):
+    order = _grant_order(scheduler(1), [
+        ("batch", PRIORITY_BATCH, "survey"),
+        ("standard", PRIORITY_STANDARD, "advisories"),
+        ("interactive", PRIORITY_INTERACTIVE, "chat"),
+    ])
+    assert order == ["interactive", "standard", "batch"]
+
+
+def test_apps_take_turns_within_a_lane(scheduler):
+    order = _grant_order(scheduler(1), [
+        ("survey-1", PRIORITY_BATCH, "survey"),
+        ("survey-2", PRIORITY_BATCH, "survey"),
+        ("survey-3", PRIORITY_BATCH, "survey"),
+        ("outbreaks-1", PRIORITY_BATCH, "outbreaks"),
+        ("outbreaks-2", PRIORITY_BATCH, "outbreaks"),
+    ])
+    assert order == ["survey-1", "outbreaks-1", "survey-2", "outbreaks-2", "survey-3"]
+
+
+def test_caps_are_per_model_and_one_slot_is_kept_for_interactive_work(scheduler):
+    upstream = scheduler(3, other_limit=1)
+
+    async def scenario():
+        for _ in range(2):
+            await upstream.acquire(MODEL, PRIORITY_STANDARD)
+        assert not upstream.try_acquire(MODEL, PRIORITY_BATCH) # Standard and batch share limit - 1 slots
+        queued_batch = asyncio.create_task(upstream.acquire(MODEL, PRIORITY_BATCH))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(upstream.acquire(MODEL, PRIORITY_INTERACTIVE), 1) # The reserved slot
+        assert not upstream.try_acquire(MODEL, PRIORITY_INTERACTIVE) # Cap reached
+
+        await asyncio.wait_for(upstream.acquire(OTHER_MODEL, PRIORITY_BATCH), 1) # Other models are unaffected
+        assert not upstream.try_acquire(OTHER_MODEL, PRIORITY_BATCH)
+        assert not queued_batch.done()
+        stats = upstream.stats()[MODEL]
+
+        upstream.release(MODEL) # Frees the interactive slot: still no room in the batch lane
+        await asyncio.sleep(0)
+        assert not queued_batch.done()
+        upstream.release(MODEL) # Frees a standard slot
+        await asyncio.wait_for(queued_batch, 1)
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert (stats["limit"], stats["active"], stats["queue_depth"][PRIORITY_BATCH]) == (3, 3, 1)
+
+
+def test_a_model_capped_at_one_slot_is_usable_by_every_lane(scheduler):
+    upstream = scheduler(1)
+    assert asyncio.run(asyncio.wait_for(upstream.acquire(MODEL, PRIORITY_BATCH), 1)) is None
+
+
+def test_cancelled_waiters_leave_the_queue_and_never_hold_a_slot(scheduler):
+    upstream = scheduler(1)
+
+    async def scenario():
+        await upstream.acquire(MODEL, PRIORITY_STANDARD)
+        abandoned = asyncio.create_task(upstream.acquire(MODEL, PRIORITY_STANDARD, "advisories"))
+        patient = asyncio.create_task(upstream.acquire(MODEL, PRIORITY_STANDARD, "reports"))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        await asyncio.sleep(0)
+        upstream.release(MODEL)
+        await asyncio.wait_for(patient, 1)
+        return upstream.stats()[MODEL]
+
+    stats = asyncio.run(scenario())
+    assert (stats["active"], stats["cancelled_while_queued"], stats["queue_depth"][PRIORITY_STANDARD]) == (1, 1, 0)
+
+
+def test_unknown_priority_is_rejected(scheduler):
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler(1).acquire(MODEL, "urgent"))
@@ -0,0 +1,114 @@
+# WriteBehindStorage: queued changes reach the backing engine in order, a failed batch is retried,
+# and users whose only copy of a change is in memory are never evicted.
+import importlib
+import os
+import threading
+
+import pytest
+
+memory_storage = importlib.import_module("medical-assistant.utils.memory_storage")
+
+NO_BACKGROUND_FLUSH_SECONDS = 60 # Tests flush explicitly; the flusher thread never gets to run
+
+
+@pytest.fixture(autouse=True)
+def isolated_data_dir(tmp_path, monkeypatch):
+    # The engines resolve the legacy JSON files and users/ relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(memory_storage.DATA_DIR_RELATIVE_TO_PROJECT_ROOT)
+
+
+def _interaction(interaction_id):
+    return {"id": interaction_id, "timestamp": f"2026-01-01T00:00:{interaction_id:0>2}Z", "user_message": f"q{interaction_id}", "ai_response": f"a{interaction_id}"}
+
+
+def _ids(history):
+    return [interaction["id"] for interaction in history]
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "json":
+        return memory_storage.JsonFileStorage(str(tmp_path / "users"))
+    return memory_storage.SQLiteStorage(str(tmp_path / "memory.db"))
+
+
+def _write_behind(backing, max_cached_users=1000):
+    return memory_storage.WriteBehindStorage(backing, 50, flush_delay_seconds=NO_BACKGROUND_FLUSH_SECONDS, max_cached_users=max_cached_users)
+
+
+def test_write_behind_flushes_changes_in_the_order_they_were_made(storage):
+    cache = _write_behind(storage)
+    cache.append_interaction("alice", "qna", _interaction("1"), 50)
+    cache.clear_user("alice")
+    cache.append_interaction("alice", "qna", _interaction("2"), 50)
+    cache.update_medical_summary("alice", lambda summary: summary["allergies"].append("latex"))
+    assert storage.get_history("alice", "qna") == [] # Nothing written until the flush
+
+    assert cache.flush() == 4
+    cache.append_interaction("alice", "qna", _interaction("3"), 50)
+    assert cache.flush() == 1
+
+    assert _ids(storage.get_history("alice", "qna")) == ["2", "3"]
+    assert storage.get_medical_summary("alice")["allergies"] == ["latex"]
+    assert _ids(cache.get_history("alice", "qna")) == ["2", "3"]
+
+
+def test_write_behind_requeues_a_failed_batch_ahead_of_newer_changes(tmp_path):
+    backing = memory_storage.SQLiteStorage(str(tmp_path / "memory.db"))
+    cache = _write_behind(backing)
+    cache.append_interaction("alice", "qna", _interaction("1"), 50)
+
+    def failing_apply_changes(changes):
+        raise OSError("disk full")
+
+    backing.apply_changes = failing_apply_changes
+    assert cache.flush() == 0
+    del backing.apply_changes # Back to the real method
+
+    cache.append_interaction("alice", "qna", _interaction("2"), 50)
+    assert cache.flush() == 2
+    assert _ids(backing.get_history("alice", "qna")) == ["1", "2"]
+
+
+def test_eviction_keeps_users_with_pending_writes(storage):
+    cache = _write_behind(storage, max_cached_users=1)
+    cache.append_interaction("alice", "qna", _interaction("1"), 50)
+    cache.get_history("bob", "qna")
+    cache.get_history("carol", "qna")
+
+    assert "alice" in cache._users # Its cached entry is the only copy of the unflushed append
+    assert _ids(cache.get_history("alice", "qna")) == ["1"]
+    cache.flush()
+    cache.get_history("bob", "qna")
+    assert "alice" not in cache._users # Evictable once written
+    assert _ids(cache.get_history("alice", "qna")) == ["1"]
+
+
+def test_eviction_keeps_users_whose_batch_is_in_flight(tmp_path):
+    backing = memory_storage.SQLiteStorage(str(tmp_path / "memory.db"))
+    write_started, release_write = threading.Event(), threading.Event()
+    apply_changes = backing.apply_changes
+
+    def slow_apply_changes(changes):
+        write_started.set()
+        release_write.wait(5)
+        return apply_changes(changes)
+
+    backing.apply_changes = slow_apply_changes
+    cache = _write_behind(backing, max_cached_users=1)
+    cache.append_interaction("alice", "qna", _interaction("1"), 50)
+    flusher = threading.Thread(target=cache.flush)
+    flusher.start()
+    assert write_started.wait(5)
+
+    cache.get_history("bob", "qna")
+    cache.get_history("carol", "qna")
+    assert "alice" in cache._users # Dropping it now would reload alice from storage without the batch
+    release_write.set()
+    flusher.join(5)
+
+    cache.append_interaction("alice", "qna", _interaction("2"), 50)
+    cache.flush()
+    assert _ids(cache.get_history("alice", "qna")) == ["1", "2"]
+    assert _ids(backing.get_history("alice", "qna")) == ["1", "2"]
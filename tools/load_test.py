@@ -0,0 +1,210 @@
+# tools/load_test.py
+# Open-loop load generator for the suite's main endpoints. Requests are started at a fixed rate
+# (not when the previous one finishes), so queueing inside the server shows up as latency
+# instead of silently lowering the offered load. Meant to run against tools/mock_perplexity.py.
+#
+#   python tools/load_test.py --base-url http://127.0.0.1:8000 --rps 10 --duration 60
+#   python tools/load_test.py --endpoints chat,advisories --rps 50 --duration 30 --cache warm
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+SAMPLE_REPORT_TEXT = (
+    "COMPLETE BLOOD COUNT\n"
+    "Hemoglobin: 12.0 g/dL (13.0-17.0)\n"
+    "RBC Count: 5.79 mill/mm (4.5-5.9)\n"
+    "MCV: 65 fL (80-100)\n"
+    "Platelet Count: 250000 /uL (150000-410000)\n"
+)
+
+
+def _nonce(cold: bool) -> str:
+    # A unique suffix defeats the response cache and request coalescing, so every request goes upstream
+    return f" [{uuid.uuid4().hex[:8]}]" if cold else ""
+
+
+def build_chat(cold: bool) -> dict:
+    return {"method": "POST", "url": "/api/v1/chat", "data": {"message": "What are the early signs of type 2 diabetes?" + _nonce(cold), "mode_str": "qna"}}
+
+
+def build_symptoms(cold: bool) -> dict:
+    return {"method": "POST", "url": "/api/v1/symptoms/analyze", "json": {"symptoms": [
+        {"description": "Headache and fatigue" + _nonce(cold), "duration": "3 days", "severity": 2},
+        {"description": "Mild fever", "duration": "1 day", "severity": 1},
+    ]}}
+
+
+def build_report(cold: bool) -> dict:
+    report_text = SAMPLE_REPORT_TEXT + _nonce(cold)
+    return {"method": "POST", "url": "/report-analyzer/api/reports/upload", "files": {"file": ("cbc_report.txt", report_text.encode(), "text/plain")}}
+
+
+def build_survey(cold: bool) -> dict:
+    return {"method": "POST", "url": "/survey-research/api/research", "json": {"report_type": "comprehensive_single_area", "area1": "Mockland" + _nonce(cold)}}
+
+
+def build_advisories(cold: bool) -> dict:
+    # Advisories take 'State, Country'; vary the state for cold runs
+    state = f"Mockstate{uuid.uuid4().hex[:6]}" if cold else "Maharashtra"
+    return {"method": "POST", "url": "/advisories-app/api/advisories", "json": {"location": f"{state}, India"}}
+
+
+ENDPOINT_BUILDERS: Dict[str, Callable[[bool], dict]] = {
+    "chat": build_chat,
+    "symptoms": build_symptoms,
+    "report": build_report,
+    "survey": build_survey,
+    "advisories": build_advisories,
+}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.report_ids: List[str] = []
+
+    def record(self, endpoint: str, status: str, latency: float):
+        self.statuses[endpoint][status] += 1
+        if status.startswith("2"):
+            self.latencies[endpoint].append(latency)
+
+    def summary(self, wall_seconds: float) -> Dict[str, dict]:
+        rows = {}
+        for endpoint in sorted(self.statuses):
+            ok_latencies = sorted(self.latencies[endpoint])
+            total = sum(self.statuses[endpoint].values())
+            rows[endpoint] = {
+                "requests": total,
+                "ok": len(ok_latencies),
+                "errors": total - len(ok_latencies),
+                "throughput_rps": round(len(ok_latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+                "p50_ms": round(percentile(ok_latencies, 50) * 1000, 1),
+                "p90_ms": round(percentile(ok_latencies, 90) * 1000, 1),
+                "p95_ms": round(percentile(ok_latencies, 95) * 1000, 1),
+                "p99_ms": round(percentile(ok_latencies, 99) * 1000, 1),
+                "max_ms": round((ok_latencies[-1] if ok_latencies else 0.0) * 1000, 1),
+                "statuses": dict(self.statuses[endpoint]),
+            }
+        return rows
+
+
+async def wait_for_report(client: httpx.AsyncClient, analysis_id: str, timeout_seconds: float) -> str:
+    """Polls the report analyzer until the background analysis finishes; returns the final status."""
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        response = await client.get(f"/report-analyzer/api/reports/{analysis_id}")
+        if response.status_code == 200: # 202 while the analysis is still running
+            structured_data = response.json().get("structured_data") or {}
+            return "error" if structured_data.get("overall_status") == "error" else "completed"
+        await asyncio.sleep(0.25)
+    return "poll_timeout"
+
+
+async def run_one(client: httpx.AsyncClient, endpoint: str, cold: bool, results: Results, args) -> None:
+    request_spec = ENDPOINT_BUILDERS[endpoint](cold)
+    method, url = request_spec.pop("method"), request_spec.pop("url")
+    started = time.monotonic()
+    try:
+        response = await client.request(method, url, **request_spec)
+        status = str(response.status_code)
+        if endpoint == "report" and response.status_code == 202:
+            analysis_id = response.json().get("id")
+            results.report_ids.append(analysis_id)
+            if args.wait_for_reports:
+                final_status = await wait_for_report(client, analysis_id, args.timeout)
+                if final_status != "completed":
+                    status = f"analysis_{final_status}"
+    except httpx.TimeoutException:
+        status = "timeout"
+    except httpx.HTTPError as e:
+        status = e.__class__.__name__
+    results.record(endpoint, status, time.monotonic() - started)
+
+
+async def run_load(args) -> Tuple[Results, float]:
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in ENDPOINT_BUILDERS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoint(s): {', '.join(unknown)}. Choose from: {', '.join(ENDPOINT_BUILDERS)}")
+
+    results = Results()
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        tasks: List[asyncio.Task] = []
+        interval = 1.0 / args.rps
+        started = time.monotonic()
+        next_start = started
+        request_index = 0
+        while time.monotonic() - started < args.duration:
+            # Round-robin over the chosen endpoints so each gets rps/len(endpoints)
+            endpoint = endpoints[request_index % len(endpoints)]
+            tasks.append(asyncio.create_task(run_one(client, endpoint, args.cache == "cold", results, args)))
+            request_index += 1
+            next_start += random.expovariate(1.0 / interval) if args.poisson else interval
+            await asyncio.sleep(max(0.0, next_start - time.monotonic()))
+        await asyncio.gather(*tasks)
+        wall_seconds = time.monotonic() - started
+
+        if not args.keep_reports:
+            for analysis_id in results.report_ids:
+                try: await client.delete(f"/report-analyzer/api/reports/{analysis_id}")
+                except httpx.HTTPError: pass
+    return results, wall_seconds
+
+
+def print_table(rows: Dict[str, dict], wall_seconds: float):
+    header = f"{'endpoint':<12}{'reqs':>7}{'ok':>7}{'err':>6}{'ok/s':>8}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(f"\nWall time: {wall_seconds:.1f}s (latencies in ms, successful requests only)")
+    print(header)
+    print("-" * len(header))
+    for endpoint, row in rows.items():
+        print(f"{endpoint:<12}{row['requests']:>7}{row['ok']:>7}{row['errors']:>6}{row['throughput_rps']:>8}"
+              f"{row['p50_ms']:>9}{row['p90_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['max_ms']:>9}")
+        non_ok = {k: v for k, v in row["statuses"].items() if not k.startswith("2")}
+        if non_ok:
+            print(f"{'':<12}errors: {non_ok}")
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load-test the AI Medical Suite endpoints.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINT_BUILDERS), help=f"Comma-separated subset of: {', '.join(ENDPOINT_BUILDERS)}")
+    parser.add_argument("--rps", type=float, default=5.0, help="Offered load, requests per second across all endpoints")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to keep starting new requests")
+    parser.add_argument("--poisson", action="store_true", help="Poisson arrivals instead of a fixed interval")
+    parser.add_argument("--cache", choices=["cold", "warm"], default="cold", help="cold: unique prompts (every call goes upstream); warm: repeated prompts")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request client timeout in seconds")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--wait-for-reports", action="store_true", help="Measure report uploads until the analysis finishes, not just the 202")
+    parser.add_argument("--keep-reports", action="store_true", help="Don't delete uploaded test reports afterwards")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    print(f"LOAD_TEST: {args.rps} rps for {args.duration}s against {args.base_url} ({args.cache} cache) - endpoints: {args.endpoints}")
+    results, wall_seconds = asyncio.run(run_load(args))
+    rows = results.summary(wall_seconds)
+    if args.json:
+        print(json.dumps({"wall_seconds": round(wall_seconds, 2), "endpoints": rows}, indent=2))
+    else:
+        print_table(rows, wall_seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# tools/mock_perplexity.py
+# Local stand-in for the Perplexity /chat/completions API, for benchmarking without API credits.
+# Answers are canned in the formats each parser expects (picked from the system prompt), with
+# configurable per-model latency, SSE streaming and injected errors.
+#
+# Run (from the project root):
+#   uvicorn tools.mock_perplexity:app --port 8765
+# and start the suite against it:
+#   PERPLEXITY_API_BASE_URL=http://127.0.0.1:8765/chat/completions PERPLEXITY_API_KEY=pplx-mock \
+#   uvicorn medical-assistant.main:app --port 8000
+#
+# Settings come from MOCK_* environment variables and can be changed while running with
+# POST /_mock/config (JSON body with any of the MockConfig fields).
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+# Median latency (seconds) of a full answer per model; actual latency is lognormal around it.
+DEFAULT_MODEL_LATENCY_MEDIANS: Dict[str, float] = {
+    "sonar": 0.8,
+    "sonar-pro": 1.5,
+    "sonar-reasoning-pro": 3.0,
+    "sonar-deep-research": 8.0,
+}
+FALLBACK_LATENCY_MEDIAN = 1.5
+
+
+class MockConfig(BaseModel):
+    latency_scale: float = float(os.getenv('MOCK_LATENCY_SCALE', '1.0'))   # Multiplies every median (0 = instant)
+    latency_sigma: float = float(os.getenv('MOCK_LATENCY_SIGMA', '0.5'))   # Lognormal spread; higher = fatter tail
+    model_latency_medians: Dict[str, float] = dict(DEFAULT_MODEL_LATENCY_MEDIANS)
+    time_to_first_token_fraction: float = 0.3 # Share of the latency spent before the first streamed token
+    error_rate: float = float(os.getenv('MOCK_ERROR_RATE', '0.0'))         # Share of requests answered with an error status
+    error_statuses: List[int] = [int(s) for s in os.getenv('MOCK_ERROR_STATUSES', '429,500,503').split(',') if s.strip()]
+    hang_rate: float = float(os.getenv('MOCK_HANG_RATE', '0.0'))           # Share of requests that never answer (client timeout)
+    hang_seconds: float = 3600.0
+
+
+config = MockConfig()
+stats_counters: Dict[str, int] = {"requests": 0, "streamed": 0, "errors_injected": 0, "hangs_injected": 0}
+
+app = FastAPI(title="Mock Perplexity API", description="Canned /chat/completions for local benchmarking.")
+
+
+# --- Canned answers, one per calling site ---
+
+def _symptom_answer() -> str:
+    body = {
+        "answer_markdown": "Your symptoms (headache and fatigue for a few days) most often go with common, self-limiting causes such as a viral infection, dehydration or poor sleep.\n\n**This is not a diagnosis.** See a doctor if the headache is sudden and severe, or comes with fever and a stiff neck.",
+        "follow_up_questions_list": ["Do you have a fever?", "Has the headache changed in intensity?"],
+        "disease_identification_text": "Symptoms could align with a viral infection or tension-type headache. This is not a diagnosis.",
+        "next_steps_list": ["Stay hydrated and rest", "Monitor your temperature", "Consult a GP if symptoms persist beyond a week"],
+        "government_schemes_list": [{"name": "Ayushman Bharat PM-JAY", "description": "Health cover for secondary and tertiary care.", "region_specific": "India"}],
+        "doctor_recommendations_list": [{"specialty": "General Physician", "reason": "Initial evaluation of persistent headache"}],
+        "extracted_medical_info_dict": {"current_symptoms_list": ["headache", "fatigue"], "potential_conditions_discussed_list": ["viral infection", "tension headache"]},
+    }
+    return "<think>The user reports mild, recent symptoms. I will give a cautious preliminary analysis.</think>\n```json\n" + json.dumps(body, indent=2) + "\n```"
+
+
+def _qna_answer() -> str:
+    visualizations = {"visualizations": [{
+        "type": "chart", "chart_type": "bar", "title": "Global Diabetes Prevalence by Year (%)",
+        "data": {"labels": ["2000", "2010", "2020"], "datasets": [{"label": "Prevalence", "data": [4.6, 6.4, 9.3]}]},
+    }]}
+    return (
+        "<think>Answer with an overview, a small chart and sources.</think>\n"
+        "## Overview\nType 2 diabetes is a chronic condition in which the body does not use insulin properly.\n\n"
+        "## Key Aspects\n* **Risk factors:** excess weight, inactivity, family history.\n* **Management:** diet, exercise and medication such as metformin.\n\n"
+        "According to the World Health Organization, global prevalence has roughly doubled since 2000.\n\n"
+        "CHART_TABLE_DATA_BLOCK_START\n" + json.dumps(visualizations) + "\nCHART_TABLE_DATA_BLOCK_END\n\n"
+        "## Sources:\n* World Health Organization - Diabetes fact sheet\n* International Diabetes Federation Atlas\n\n"
+        "Further Exploration: You might want to learn about the different types of diabetes medication."
+    )
+
+
+def _deep_research_report() -> str:
+    return (
+        "<think>Plan the sections, then write the report.</think>\n"
+        "## Comprehensive Report on Healthcare in Mockland\n"
+        "This report summarises the public health situation in Mockland.\n\n"
+        "## 1. Demographics and Health Indicators\n"
+        "Life expectancy has risen steadily over the last decade.\n"
+        'CHART_DATA: TYPE=line TITLE="Life Expectancy (Years)" LABELS=["2015","2018","2021","2024"] DATA=[68.1,69.0,69.7,70.4] SOURCE="Mock Health Survey"\n\n'
+        "## 2. Disease Burden\n"
+        "Non-communicable diseases now account for most deaths.\n"
+        'CHART_DATA: TYPE=pie TITLE="Causes of Death (%)" LABELS=["Cardiovascular","Cancer","Respiratory","Other"] DATA=[31,18,12,39]\n\n'
+        "## 3. Healthcare Infrastructure\n"
+        'CHART_DATA: TYPE=bar TITLE="Hospital Beds per 1000" LABELS=["Urban","Rural"] DATA=[2.4,0.9]\n'
+        "Rural areas remain under-served.\n\n"
+        "## 4. Key Findings and Recommendations\n"
+        "* Expand primary care in rural districts.\n* Strengthen NCD screening programmes.\n"
+    )
+
+
+def _report_analysis() -> str:
+    return (
+        "TRANSCRIPTION:\nComplete Blood Count report.\n\n"
+        "IDENTIFIED_PARAMETERS:\n"
+        "Hemoglobin: 12.00 g/dL (13.00-17.00 g/dL) - Low\n"
+        "RBC Count: 5.79 mill/mm (4.50-5.90 mill/mm) - Normal\n"
+        "MCV: 65.00 fL (80.00-100.00 fL) - Low\n"
+        "Platelet Count: 250000 /uL (150000-410000 /uL) - Normal\n\n"
+        "OBSERVED_ABNORMALITIES:\n"
+        "Hemoglobin is low at 12.00 g/dL. Recommendation: Further investigation for anemia.\n"
+        "MCV: 65.00 fL, which is below the normal range.\n\n"
+        "GENERAL_SUMMARY:\nMild microcytic anemia; other values are within normal limits.\n\n"
+        "GENERAL_RECOMMENDATIONS:\n- Check iron studies.\n- Repeat CBC in 4-6 weeks.\n"
+    )
+
+
+def _advisories() -> str:
+    return (
+        "1. **Date:** 2 days ago | **Agency:** State Health Department | Dengue alert: residents advised to remove standing water.\n"
+        "2. **Date:** 6 days ago | **Agency:** National Centre for Disease Control | Heatwave advisory for outdoor workers.\n"
+        "3. **Date:** 12 days ago | **Agency:** State Health Department | Seasonal influenza vaccination drive for people over 60.\n"
+    )
+
+
+def _generic_answer() -> str:
+    return "Based on the report, the figures requested are discussed in section 2. The report does not give a breakdown by age group."
+
+
+def pick_canned_answer(system_prompt: str) -> str:
+    prompt = system_prompt.lower()
+    if "symptom analyzer" in prompt:
+        return _symptom_answer()
+    if "medical information assistant" in prompt:
+        return _qna_answer()
+    if "report writing machine" in prompt:
+        return _deep_research_report()
+    if "identified_parameters" in prompt:
+        return _report_analysis()
+    if "public health advisories" in prompt:
+        return _advisories()
+    return _generic_answer()
+
+
+def sample_latency(model_name: str) -> float:
+    median = config.model_latency_medians.get(model_name, FALLBACK_LATENCY_MEDIAN) * config.latency_scale
+    if median <= 0:
+        return 0.0
+    return random.lognormvariate(0, config.latency_sigma) * median
+
+
+def _usage(messages: List[dict], content: str) -> Dict[str, int]:
+    prompt_chars = sum(len(m["content"]) if isinstance(m.get("content"), str) else len(json.dumps(m.get("content"))) for m in messages)
+    prompt_tokens, completion_tokens = prompt_chars // 4, len(content) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats_counters["requests"] += 1
+    model_name = body.get("model", "sonar")
+    messages = body.get("messages", [])
+    system_prompt = "\n".join(m["content"] for m in messages if m.get("role") == "system" and isinstance(m.get("content"), str))
+
+    roll = random.random()
+    if roll < config.hang_rate:
+        stats_counters["hangs_injected"] += 1
+        await asyncio.sleep(config.hang_seconds)
+    elif roll < config.hang_rate + config.error_rate and config.error_statuses:
+        stats_counters["errors_injected"] += 1
+        status_code = random.choice(config.error_statuses)
+        await asyncio.sleep(min(0.05, sample_latency(model_name)))
+        headers = {"Retry-After": "1"} if status_code == 429 else None
+        return JSONResponse({"error": {"message": f"Mock injected error {status_code}", "type": "mock_error"}}, status_code=status_code, headers=headers)
+
+    content = pick_canned_answer(system_prompt)
+    latency = sample_latency(model_name)
+    completion_id = str(uuid.uuid4())
+    usage = _usage(messages, content)
+
+    if not body.get("stream"):
+        await asyncio.sleep(latency)
+        return {
+            "id": completion_id, "model": model_name, "object": "chat.completion", "created": int(time.time()),
+            "usage": usage,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        }
+
+    stats_counters["streamed"] += 1
+    chunk_size = 24
+    pieces = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+    first_token_delay = latency * config.time_to_first_token_fraction
+    per_piece_delay = (latency - first_token_delay) / max(1, len(pieces))
+
+    async def event_stream():
+        await asyncio.sleep(first_token_delay)
+        for index, piece in enumerate(pieces):
+            chunk = {"id": completion_id, "model": model_name, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            if index == len(pieces) - 1:
+                chunk["choices"][0]["finish_reason"] = "stop"
+                chunk["usage"] = usage
+            yield f"data: {json.dumps(chunk)}\n\n"
+            if per_piece_delay:
+                await asyncio.sleep(per_piece_delay)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.get("/_mock/config")
+async def get_mock_config():
+    return {"config": config.model_dump(), "stats": stats_counters}
+
+
+@app.post("/_mock/config")
+async def update_mock_config(changes: Dict[str, object]):
+    # e.g. {"error_rate": 0.3} to simulate an upstream incident mid-run
+    global config
+    config = MockConfig(**{**config.model_dump(), **changes})
+    print(f"MOCK_PERPLEXITY: Config updated: {changes}")
+    return {"config": config.model_dump()}